@@ -2,9 +2,10 @@ from pg8000.core import (
     Warning, DataError, DatabaseError, InterfaceError, ProgrammingError,
     Error, OperationalError, IntegrityError, InternalError, NotSupportedError,
     ArrayContentNotHomogenousError, ArrayDimensionsNotConsistentError,
-    ArrayContentNotSupportedError, Connection, Cursor, Binary, Date,
+    ArrayContentNotSupportedError, Connection, Cursor, Pipeline, Binary, Date,
     DateFromTicks, Time, TimeFromTicks, Timestamp, TimestampFromTicks, BINARY,
-    Interval, PGEnum, PGJson, PGJsonb, PGTsvector, PGText, PGVarchar)
+    Interval, PGEnum, PGJson, PGJsonb, PGTsvector, PGText, PGVarchar,
+    tuple_row, named_row, dict_row, paramstyle_cache_info)
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
@@ -97,9 +98,10 @@ __all__ = [
     ProgrammingError, Error, OperationalError, IntegrityError, InternalError,
     NotSupportedError, ArrayContentNotHomogenousError,
     ArrayDimensionsNotConsistentError, ArrayContentNotSupportedError,
-    Connection, Cursor, Binary, Date, DateFromTicks, Time, TimeFromTicks,
-    Timestamp, TimestampFromTicks, BINARY, Interval, PGEnum, PGJson, PGJsonb,
-    PGTsvector, PGText, PGVarchar]
+    Connection, Cursor, Pipeline, Binary, Date, DateFromTicks, Time,
+    TimeFromTicks, Timestamp, TimestampFromTicks, BINARY, Interval, PGEnum,
+    PGJson, PGJsonb, PGTsvector, PGText, PGVarchar, tuple_row, named_row,
+    dict_row, paramstyle_cache_info]
 
 """Version string for pg8000.
 
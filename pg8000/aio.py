@@ -0,0 +1,711 @@
+"""An asyncio interface to pg8000.
+
+The :class:`Connection` and :class:`Cursor` classes of this module share the
+protocol state machine of the blocking :class:`pg8000.Connection`, but the
+messages are sent and received over asyncio streams, so that a single event
+loop can drive many connections. The methods that talk to the server are
+coroutines.
+
+This module is a pg8000 extension.
+"""
+
+import asyncio
+import socket
+
+from pg8000 import core
+from pg8000.core import (
+    COPY_DATA, COPY_DONE_MSG, COPY_IN_MAX_SIZE, COPY_OUT_SIZE,
+    COPY_SENDFILE_SIZE, DATA_ROW, READY_FOR_QUERY, RECEIVE_SIZE, SYNC_MSG,
+    TERMINATE_MSG, InterfaceError, NotSupportedError, ProgrammingError,
+    ci_unpack, copy_file_size, i_pack, ii_pack)
+
+
+async def connect(
+        user, host='localhost', database=None, port=5432, password=None,
+        source_address=None, unix_sock=None, ssl_context=None, timeout=None,
+        max_prepared_statements=1000, tcp_keepalive=True,
+        application_name=None, replication=None):
+    """Opens a connection to the server, and returns a :class:`Connection`.
+    The parameters are the same as for :func:`pg8000.connect`, except that
+    the ``timeout`` only applies to establishing the connection. To put a
+    time limit on an operation use :func:`asyncio.wait_for`.
+    """
+    con = Connection(
+        user, database=database, password=password,
+        max_prepared_statements=max_prepared_statements,
+        application_name=application_name, replication=replication)
+
+    opening = con._open(
+        host, port, source_address, unix_sock, ssl_context, tcp_keepalive)
+    if timeout is None:
+        await opening
+    else:
+        await asyncio.wait_for(opening, timeout)
+    return con
+
+
+def sync_only(message):
+    # Makes a method of a blocking class that can't be used in this module,
+    # because it would need to wait for the server.
+    def method(self, *args, **kwargs):
+        raise TypeError(message)
+    return method
+
+
+class Cursor(core.Cursor):
+    """A cursor of a :class:`Connection`. It has the same attributes as a
+    :class:`pg8000.Cursor`, but the methods that talk to the server are
+    coroutines. The rows of a result can be iterated over with ``async
+    for``, and if the cursor has a ``fetch_size`` the rows are read from the
+    server in batches as they're needed.
+
+    The cursor can be used as an asynchronous context manager, in which case
+    it's closed on leaving the ``async with`` block.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    __enter__ = __exit__ = sync_only(
+        "use 'async with' with a pg8000.aio cursor")
+    __iter__ = __next__ = sync_only(
+        "use 'async for' to iterate over a pg8000.aio cursor")
+
+    async def execute(self, operation, args=None, stream=None, timeout=None):
+        """Executes a database operation. The parameters are the same as for
+        :meth:`pg8000.Cursor.execute`, except that for a ``COPY FROM`` the
+        stream can also be an asynchronous iterable of ``bytes`` or ``str``
+        chunks. For a ``COPY TO`` the stream's ``write()`` method is called
+        with each chunk of data.
+        """
+        cancels = []
+        timer = None
+        try:
+            self.stream = stream
+
+            if not self._c.in_transaction and not self._c.autocommit:
+                await self._c.execute(self, "begin transaction", None)
+            if timeout is not None:
+                timer = asyncio.get_event_loop().call_later(
+                    timeout,
+                    lambda: cancels.append(
+                        asyncio.ensure_future(self._c.cancel())))
+            await self._c.execute(self, operation, args)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            else:
+                raise e
+        finally:
+            if timer is not None:
+                # If the cancel request is already being sent, waiting for
+                # it means that it can't cancel a later operation.
+                timer.cancel()
+                for cancel in cancels:
+                    await cancel
+        return self
+
+    async def executemany(self, operation, param_sets):
+        """Executes an operation once for each of the parameter sets, in the
+        same way as :meth:`pg8000.Cursor.executemany`.
+        """
+        try:
+            self.stream = None
+
+            if not self._c.in_transaction and not self._c.autocommit:
+                await self._c.execute(self, "begin transaction", None)
+            await self._c.executemany(self, operation, param_sets)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            else:
+                raise e
+        return self
+
+    async def copy_records(self, table, columns, rows):
+        """Copies rows of Python values into a table with a binary COPY
+        FROM, in the same way as :meth:`pg8000.Cursor.copy_records`.
+        """
+        try:
+            col_list = '*' if columns is None else ', '.join(columns)
+            ps = await self._c.describe(
+                self, "SELECT " + col_list + " FROM " + table)
+            row_desc = ps['row_desc']
+            sends = self._c.make_copy_sends(
+                row_desc, await self._c.find_enum_oids(row_desc))
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            else:
+                raise e
+
+        if columns is not None:
+            table += " (" + col_list + ")"
+        return await self.execute(
+            "COPY " + table + " FROM STDIN WITH (FORMAT binary)",
+            stream=core.CopyRecordsStream(rows, sends))
+
+    async def copy_out_records(self, source, columns=None):
+        """Copies the rows of a table or query with a binary COPY TO, in the
+        same way as :meth:`pg8000.Cursor.copy_out_records`.
+        """
+        try:
+            ps = await self._c.describe(
+                self, core.copy_out_query(source, columns))
+            sql, stream = self._c.make_copy_out(ps, source, columns, self)
+            await self.execute(sql, stream=stream)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            else:
+                raise e
+        stream.finish(self)
+        return self
+
+    async def copy_out(self, operation, args=None):
+        """Executes a ``COPY ... TO STDOUT`` statement, and returns an
+        asynchronous iterator of the data in chunks, in the same way as
+        :meth:`pg8000.Cursor.copy_out`.
+        """
+        try:
+            if not self._c.in_transaction and not self._c.autocommit:
+                await self._c.execute(self, "begin transaction", None)
+            chunks = self._c.copy_out(self, operation, args)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            else:
+                raise e
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def fetchone(self):
+        """Fetches the next row of a query result set, or returns ``None``
+        if there are no more rows.
+        """
+        try:
+            return await self.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def fetchmany(self, num=None):
+        """Fetches the next set of rows of a query result, at most
+        :attr:`arraysize` rows if ``num`` isn't given.
+        """
+        rows = []
+        for i in range(self.arraysize if num is None else num):
+            try:
+                rows.append(await self.__anext__())
+            except StopAsyncIteration:
+                break
+        return tuple(rows)
+
+    async def fetchall(self):
+        """Fetches all the remaining rows of a query result."""
+        rows = []
+        while True:
+            try:
+                rows.append(await self.__anext__())
+            except StopAsyncIteration:
+                return tuple(rows)
+
+    async def fetch_columns(self, numpy=False):
+        """Fetches all the remaining rows of a query result as columns, in
+        the same way as :meth:`pg8000.Cursor.fetch_columns`.
+        """
+        while self._portal_suspended:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            await self._c.fetch_portal(self)
+        return super().fetch_columns(numpy)
+
+    async def close(self):
+        """Closes the cursor."""
+        if self._portal_suspended and self._c is not None and \
+                self._c._writer is not None:
+            await self._c.close_portal(self)
+        self._c = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while True:
+            try:
+                return self._cached_rows.popleft()
+            except IndexError:
+                if self.ps is None:
+                    raise ProgrammingError("A query hasn't been issued.")
+                elif len(self.ps['row_desc']) == 0:
+                    raise ProgrammingError("no result set")
+                elif self._portal_suspended:
+                    if self._c is None:
+                        raise InterfaceError("Cursor closed")
+                    await self._c.fetch_portal(self)
+                else:
+                    raise StopAsyncIteration()
+
+
+class Pipeline(core.Pipeline):
+    """A pipeline of a :class:`Connection`, which works in the same way as a
+    :class:`pg8000.Pipeline` except that :meth:`sync` is a coroutine, and
+    that it's used as an asynchronous context manager.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.sync()
+        else:
+            self._queue.clear()
+
+    __enter__ = __exit__ = sync_only(
+        "use 'async with' with a pg8000.aio pipeline")
+
+    def execute(self, operation, args=None):
+        cursor = Cursor(self._c, paramstyle=self.paramstyle)
+        self._queue.append((cursor, operation, args))
+        return cursor
+
+    async def sync(self):
+        queue, self._queue = self._queue, []
+        if len(queue) > 0:
+            await self._c.execute_pipeline(queue, self.sync_each)
+
+
+class Connection(core.Connection):
+    """A connection to the server that's driven by an asyncio event loop.
+    Connections are made with :func:`connect`. It has the same attributes as
+    a :class:`pg8000.Connection`, but the methods that talk to the server
+    are coroutines. Operations on the connection from different tasks are
+    carried out one after the other.
+
+    If an operation is cancelled, or fails to send or receive a message, the
+    state of the exchange with the server is unknown and so the connection
+    is closed. The exception is :meth:`wait_for_notification`, which can be
+    cancelled safely.
+
+    The connection can be used as an asynchronous context manager, in which
+    case it's closed on leaving the ``async with`` block.
+    """
+
+    def __init__(
+            self, user, database=None, password=None,
+            max_prepared_statements=1000, application_name=None,
+            replication=None):
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._buffer = b''
+        self._pos = 0
+        self._copy_in_stream = None
+        self._init_params = self.init_protocol(
+            user, password, database, application_name, replication,
+            max_prepared_statements)
+        self._run_cursor = Cursor(self, paramstyle='named')
+
+    async def _open(
+            self, host, port, source_address, unix_sock, ssl_context,
+            tcp_keepalive):
+        loop = asyncio.get_event_loop()
+        if unix_sock is None and host is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = host, port
+        elif unix_sock is not None:
+            if not hasattr(socket, "AF_UNIX"):
+                raise InterfaceError(
+                    "attempt to connect to unix socket on unsupported "
+                    "platform")
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            address = unix_sock
+        else:
+            raise ProgrammingError("one of host or unix_sock must be provided")
+
+        try:
+            sock.setblocking(False)
+            if unix_sock is None and source_address is not None:
+                sock.bind((source_address, 0))
+            await loop.sock_connect(sock, address)
+            self._family, self._address = sock.family, address
+            if tcp_keepalive:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+            server_hostname = None
+            if ssl_context is not None:
+                try:
+                    import ssl
+
+                    if ssl_context is True:
+                        ssl_context = ssl.create_default_context()
+                except ImportError:
+                    raise InterfaceError(
+                        "SSL required but ssl module not available in "
+                        "this python installation")
+
+                # Int32(8) - Message length, including self.
+                # Int32(80877103) - The SSL request code.
+                await loop.sock_sendall(sock, ii_pack(8, 80877103))
+                resp = await loop.sock_recv(sock, 1)
+                if resp != b'S':
+                    raise InterfaceError("Server refuses SSL")
+                server_hostname = host
+
+            self._reader, self._writer = await asyncio.open_connection(
+                sock=sock, ssl=ssl_context, server_hostname=server_hostname)
+        except BaseException as e:
+            sock.close()
+            if isinstance(e, socket.error):
+                raise InterfaceError("communication error", e)
+            raise
+
+        try:
+            await self.run_protocol(self.proto_startup(self._init_params))
+        except BaseException:
+            self._abort()
+            raise
+
+    def _flush(self):
+        # The messages are collected in self._out, and written to the
+        # transport in one go before run_protocol() waits for the server.
+        pass
+
+    async def _send(self):
+        writer = self._writer
+        if len(self._out) > 0:
+            # The transport may hold on to what it's given
+            writer.write(bytes(self._out))
+            self._out.clear()
+        if writer.transport.get_write_buffer_size() > 0:
+            await writer.drain()
+
+    def _abort(self):
+        if self._writer is not None:
+            self._writer.transport.abort()
+            self._writer = None
+
+    def _next_message(self):
+        # Returns the code of the next message and the position of its data
+        # in the buffer, which ends at self._pos, or None if the buffer
+        # doesn't hold the whole of it.
+        buffer, pos = self._buffer, self._pos
+        if len(buffer) - pos >= 5:
+            code, data_len = ci_unpack(buffer, pos)
+            end = pos + 1 + data_len
+            if len(buffer) >= end:
+                self._pos = end
+                return code, pos + 5
+        return None
+
+    async def _receive(self):
+        # Reads more data into the buffer. If the buffer holds the start of a
+        # large message, the rest of the message is read in one go.
+        await self._send()
+
+        buffer = self._buffer[self._pos:]
+        needed = 0
+        if len(buffer) >= 5:
+            needed = 1 + ci_unpack(buffer)[1] - len(buffer)
+
+        if needed > RECEIVE_SIZE:
+            try:
+                data = await self._reader.readexactly(needed)
+            except asyncio.IncompleteReadError:
+                data = b''
+        else:
+            data = await self._reader.read(RECEIVE_SIZE)
+        if len(data) == 0:
+            raise InterfaceError("the server closed the connection")
+        self._buffer = buffer + data
+        self._pos = 0
+
+    async def _copy_in(self):
+        # Sends the contents of the stream of a COPY FROM
+        stream, self._copy_in_stream = self._copy_in_stream, None
+        size = copy_file_size(stream)
+        if size is not None:
+            await self._send_copy_file(stream, size)
+        else:
+            try:
+                if hasattr(stream, '__aiter__'):
+                    async for chunk in stream:
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode(self._client_encoding)
+                        self._write(COPY_DATA + i_pack(len(chunk) + 4))
+                        self._write(chunk)
+                        if len(self._out) >= COPY_IN_MAX_SIZE:
+                            await self._send()
+                else:
+                    for _ in self.write_copy_data(stream):
+                        await self._send()
+            except Exception as e:
+                self.send_COPY_FAIL(e)
+                return
+
+        # Send CopyDone
+        # Byte1('c') - Identifier.
+        # Int32(4) - Message length, including self.
+        self._write(COPY_DONE_MSG)
+        self._write(SYNC_MSG)
+
+    async def _send_copy_file(self, stream, size):
+        # Sends the rest of a file as CopyData messages with the sendfile()
+        # of the event loop
+        loop = asyncio.get_event_loop()
+        offset = stream.tell()
+        while size > 0:
+            length = min(size, COPY_SENDFILE_SIZE)
+            self._write(COPY_DATA + i_pack(length + 4))
+            await self._send()
+            try:
+                sent = await loop.sendfile(
+                    self._writer.transport, stream, offset, length)
+                if sent != length:
+                    raise InterfaceError(
+                        "the file for the COPY changed while it was sent")
+            except BaseException:
+                # The message can't be finished, so the connection is lost
+                self._abort()
+                raise
+            offset += length
+            size -= length
+
+    async def _receive_messages(self, request):
+        # Carries out a request of a protocol generator
+        if request is None:
+            msg = self._next_message()
+            while msg is None:
+                await self._receive()
+                msg = self._next_message()
+            code, start = msg
+            return code, self._buffer[start:self._pos]
+
+        while not await self._handle_messages(request):
+            pass
+        return None
+
+    async def _handle_messages(self, cursor):
+        # Handles the messages up to the next ReadyForQuery, returning True,
+        # or returns False if it stops early to hand over a batch of COPY TO
+        # data. A DataRow is decoded where it is in the buffer, the other
+        # messages are copied out of it.
+        message_types = self.message_types
+        handle_data_row = self.handle_DATA_ROW
+        code = None
+        while code != READY_FOR_QUERY:
+            msg = self._next_message()
+            if msg is None:
+                await self._receive()
+            else:
+                code, start = msg
+                if code == DATA_ROW:
+                    handle_data_row(self._buffer, cursor, start)
+                elif code == COPY_DATA and self._copy_out is not None:
+                    copy_out = self._copy_out
+                    copy_out += self._buffer[start:self._pos]
+                    if len(copy_out) >= COPY_OUT_SIZE:
+                        self.write_copy_out(cursor)
+                        return False
+                else:
+                    message_types[code](
+                        self._buffer[start:self._pos], cursor)
+                    if self._copy_in_stream is not None:
+                        await self._copy_in()
+        return True
+
+    async def run_protocol(self, gen, idle=False):
+        """Runs a protocol generator, reading the messages it asks for from
+        the stream, and returns its result. If the generator is idle, waiting
+        for messages that the server sends of its own accord, the connection
+        is left open when the wait is interrupted.
+        """
+        async with self._lock:
+            if self._writer is None:
+                gen.close()
+                raise InterfaceError("connection is closed")
+
+            try:
+                request = gen.send(None)
+                while True:
+                    try:
+                        msg = await self._receive_messages(request)
+                    except BaseException as e:
+                        if not idle:
+                            self._abort()
+
+                        # Give the generator the chance to tidy up
+                        try:
+                            gen.throw(e)
+                        except BaseException:
+                            pass
+                        gen.close()
+                        raise
+                    request = gen.send(msg)
+            except StopIteration as e:
+                return e.value
+
+    async def copy_out(self, cursor, operation, vals):
+        """Executes a COPY TO, yielding the data in chunks, in the same way
+        as :meth:`pg8000.Connection.copy_out`.
+        """
+        async with self._lock:
+            if self._writer is None:
+                raise InterfaceError("connection is closed")
+
+            chunks = cursor.stream = core.CopyChunks()
+            gen = self.proto_execute(cursor, operation, vals)
+            paused = False
+            try:
+                request = gen.send(None)
+                while True:
+                    msg = None
+                    try:
+                        if request is None:
+                            msg = await self._receive_messages(None)
+                        else:
+                            paused = not await self._handle_messages(request)
+                    except BaseException as e:
+                        paused = False
+                        self._abort()
+                        try:
+                            gen.throw(e)
+                        except BaseException:
+                            pass
+                        gen.close()
+                        raise
+                    for chunk in chunks:
+                        yield chunk
+                    chunks.clear()
+                    if not paused:
+                        request = gen.send(msg)
+            except StopIteration:
+                pass
+            finally:
+                if paused and self._writer is not None:
+                    gen.close()
+                    while not await self._handle_messages(cursor):
+                        chunks.clear()
+
+    def handle_COPY_IN_RESPONSE(self, data, cursor):
+        # The stream is sent by run_protocol(), so that it can wait for the
+        # transport to drain.
+        if cursor.stream is None:
+            raise InterfaceError(
+                "An input stream is required for the COPY IN response.")
+        self._copy_in_stream = cursor.stream
+
+    def proto_notification(self):
+        while len(self.notifications) == 0:
+            code, data = yield
+            self.message_types[code](data, self._cursor)
+        return self.notifications.popleft()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    __enter__ = __exit__ = sync_only(
+        "use 'async with' with a pg8000.aio connection")
+
+    def cursor(self, fetch_size=None):
+        """Creates a :class:`Cursor` object bound to this connection."""
+        return Cursor(self, fetch_size=fetch_size)
+
+    def pipeline(self, sync_each=False):
+        """Creates a :class:`Pipeline` object bound to this connection."""
+        return Pipeline(self, sync_each=sync_each)
+
+    async def run(self, sql, stream=None, **params):
+        """Executes an SQL statement with named parameters, and returns the
+        rows, in the same way as :meth:`pg8000.Connection.run`.
+        """
+        self._run_cursor.row_factory = self.row_factory
+        await self._run_cursor.execute(sql, params, stream=stream)
+        return tuple(self._run_cursor._cached_rows)
+
+    async def commit(self):
+        """Commits the current database transaction."""
+        await self.execute(self._cursor, "commit", None)
+
+    async def rollback(self):
+        """Rolls back the current database transaction."""
+        if not self.in_transaction:
+            return
+        await self.execute(self._cursor, "rollback", None)
+
+    async def cancel(self):
+        """Asks the server to cancel the operation that this connection is
+        executing, in the same way as :meth:`pg8000.Connection.cancel`.
+        """
+        if self._backend_key_data is None:
+            raise InterfaceError(
+                "the server hasn't sent the key needed to cancel")
+
+        try:
+            if self._family == socket.AF_INET:
+                reader, writer = await asyncio.open_connection(*self._address)
+            else:
+                reader, writer = await asyncio.open_unix_connection(
+                    self._address)
+
+            # Int32(16) - Message length, including self.
+            # Int32(80877102) - The cancel request code.
+            # Int32 - The process ID of the backend.
+            # Int32 - The secret key of the backend.
+            writer.write(ii_pack(16, 80877102) + self._backend_key_data)
+
+            # The server closes the connection once it's sent the cancel
+            # signal to the backend.
+            await reader.read(1)
+            writer.close()
+        except socket.error as e:
+            raise InterfaceError("communication error", e)
+
+    async def wait_for_notification(self):
+        """Returns the oldest notification in :attr:`notifications`,
+        removing it from the deque. If there aren't any notifications, it
+        waits for one to arrive from the server. A notification is a
+        ``(backend_pid, channel)`` tuple.
+
+        While it's waiting, other operations on the connection wait as
+        well.
+        """
+        return await self.run_protocol(self.proto_notification(), idle=True)
+
+    async def close_prepared_statement(self, statement_name_bin):
+        """Closes a prepared statement on the server."""
+        await self.run_protocol(
+            self.proto_close_prepared_statement(statement_name_bin))
+
+    async def close(self):
+        """Closes the connection."""
+        writer = self._writer
+        if writer is None:
+            raise InterfaceError("connection is closed")
+        self._writer = None
+
+        # Byte1('X') - Identifies the message as a terminate message.
+        # Int32(4) - Message length, including self.
+        writer.write(TERMINATE_MSG)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (AttributeError, socket.error):
+            pass
+
+    def tpc_begin(self, *args, **kwargs):
+        raise NotSupportedError(
+            "two-phase commit isn't supported by pg8000.aio")
+
+    tpc_prepare = tpc_commit = tpc_rollback = tpc_recover = tpc_begin
+
+
+__all__ = ['connect', 'Connection', 'Cursor', 'Pipeline']
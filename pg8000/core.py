@@ -2,20 +2,26 @@ from datetime import (
     timedelta as Timedelta, datetime as Datetime, date, time)
 from warnings import warn
 import socket
-from struct import pack
+from struct import calcsize, error as struct_error, pack, unpack_from
 from hashlib import md5
 from decimal import Decimal
-from collections import deque, defaultdict
+from collections import deque, defaultdict, namedtuple, OrderedDict
+from array import array
 from itertools import count, islice
 from uuid import UUID
+from weakref import WeakSet
 from copy import deepcopy
+from functools import partial
 from calendar import timegm
 from distutils.version import LooseVersion
 from struct import Struct
 from time import localtime
+from threading import Lock, Timer
 import pg8000
 from json import loads, dumps
-from os import getpid
+from os import fstat, getpid
+from stat import S_ISREG
+from re import compile as re_compile, DOTALL
 from scramp import ScramClient
 import enum
 from ipaddress import (
@@ -198,6 +204,10 @@ ihihih_pack, ihihih_unpack = pack_funcs('ihihih')
 ci_pack, ci_unpack = pack_funcs('ci')
 bh_pack, bh_unpack = pack_funcs('bh')
 cccc_pack, cccc_unpack = pack_funcs('cccc')
+hhHh_pack, hhHh_unpack = pack_funcs('hhHh')
+QQ_pack, QQ_unpack = pack_funcs('QQ')
+I_pack, I_unpack = pack_funcs('I')
+BxB_pack, BxB_unpack = pack_funcs('BxB')
 
 
 min_int2, max_int2 = -2 ** 15, 2 ** 15
@@ -419,133 +429,148 @@ FC_TEXT = 0
 FC_BINARY = 1
 
 
+# The characters that may start a parameter, a quoted string, a quoted
+# identifier or a comment. A dash is only of interest if it's the second one
+# of a -- comment, and a dollar sign only if it starts a dollar quote, rather
+# than being part of an identifier.
+SPECIAL_CHARS = r"""'|"|-(?<=--)|/\*|\$(?<![\w$]\$)(?:[^\W\d]\w*)?\$"""
+PARAMSTYLE_SPECIAL_RES = dict(
+    (style, re_compile(SPECIAL_CHARS + chars)) for style, chars in (
+        ('qmark', r"|\?"), ('numeric', "|:"), ('named', "|:"),
+        ('format', "|%"), ('pyformat', "|%"), (None, "")))
+BLOCK_COMMENT_RE = re_compile(r"/\*|\*/")
+PARAM_NAME_RE = re_compile(r"\w*")
+
+
 def convert_paramstyle(style, query):
-    # I don't see any way to avoid scanning the query string char by char,
-    # so we might as well take that careful approach and create a
-    # state-based scanner.  We'll use int variables for the state.
-    OUTSIDE = 0    # outside quoted string
-    INSIDE_SQ = 1  # inside single-quote string '...'
-    INSIDE_QI = 2  # inside quoted identifier   "..."
-    INSIDE_ES = 3  # inside escaped single-quote string, E'...'
-    INSIDE_PN = 4  # inside parameter name eg. :name
-    INSIDE_CO = 5  # inside inline comment eg. --
-
-    in_quote_escape = False
-    in_param_escape = False
+    # Rather than looking at every character of the query, it jumps from one
+    # character that may be special to the next, and skips over quoted
+    # strings and comments with str.find(). The text in between is copied to
+    # the output as it is.
+    try:
+        find_special = PARAMSTYLE_SPECIAL_RES[style].search
+    except KeyError:
+        find_special = PARAMSTYLE_SPECIAL_RES[None].search
+
     placeholders = []
+    indexes = {}  # placeholder: number of the parameter
     output_query = []
-    param_idx = map(lambda x: "$" + str(x), count(1))
-    state = OUTSIDE
-    prev_c = None
-    for i, c in enumerate(query):
-        if i + 1 < len(query):
-            next_c = query[i + 1]
-        else:
-            next_c = None
-
-        if state == OUTSIDE:
-            if c == "'":
-                output_query.append(c)
-                if prev_c == 'E':
-                    state = INSIDE_ES
-                else:
-                    state = INSIDE_SQ
-            elif c == '"':
-                output_query.append(c)
-                state = INSIDE_QI
-            elif c == '-':
-                output_query.append(c)
-                if prev_c == '-':
-                    state = INSIDE_CO
-            elif style == "qmark" and c == "?":
-                output_query.append(next(param_idx))
-            elif style == "numeric" and c == ":" and next_c not in ':=' \
-                    and prev_c != ':':
-                # Treat : as beginning of parameter name if and only
-                # if it's the only : around
-                # Needed to properly process type conversions
-                # i.e. sum(x)::float
+    param_num = 0
+    length = len(query)
+    start = pos = 0  # start of the text to copy, and of the search
+    while True:
+        m = find_special(query, pos)
+        if m is None:
+            break
+
+        i = m.start()
+        c = query[i]
+        if c == '?':
+            param_num += 1
+            output_query.append(query[start:i])
+            output_query.append("$" + str(param_num))
+            start = pos = i + 1
+
+        elif c == ':':
+            # A colon only starts a parameter if it's on its own, so that
+            # casts such as sum(x)::float and assignments := are left alone
+            next_c = query[i + 1:i + 2]
+            if next_c in ('', ':', '=') or query[i - 1:i] == ':':
+                pos = i + 1
+            elif style == 'numeric':
+                output_query.append(query[start:i])
                 output_query.append("$")
-            elif style == "named" and c == ":" and next_c not in ':=' \
-                    and prev_c != ':':
-                # Same logic for : as in numeric parameters
-                state = INSIDE_PN
-                placeholders.append('')
-            elif style == "pyformat" and c == '%' and next_c == "(":
-                state = INSIDE_PN
-                placeholders.append('')
-            elif style in ("format", "pyformat") and c == "%":
-                style = "format"
-                if in_param_escape:
-                    in_param_escape = False
-                    output_query.append(c)
-                else:
-                    if next_c == "%":
-                        in_param_escape = True
-                    elif next_c == "s":
-                        state = INSIDE_PN
-                        output_query.append(next(param_idx))
-                    else:
-                        raise InterfaceError(
-                            "Only %s and %% are supported in the query.")
+                start = pos = i + 1
             else:
-                output_query.append(c)
-
-        elif state == INSIDE_SQ:
-            if c == "'":
-                if in_quote_escape:
-                    in_quote_escape = False
-                else:
-                    if next_c == "'":
-                        in_quote_escape = True
-                    else:
-                        state = OUTSIDE
-            output_query.append(c)
-
-        elif state == INSIDE_QI:
-            if c == '"':
-                state = OUTSIDE
-            output_query.append(c)
-
-        elif state == INSIDE_ES:
-            if c == "'" and prev_c != "\\":
-                # check for escaped single-quote
-                state = OUTSIDE
-            output_query.append(c)
-
-        elif state == INSIDE_PN:
-            if style == 'named':
-                placeholders[-1] += c
-                if next_c is None or (not next_c.isalnum() and next_c != '_'):
-                    state = OUTSIDE
-                    try:
-                        pidx = placeholders.index(placeholders[-1], 0, -1)
-                        output_query.append("$" + str(pidx + 1))
-                        del placeholders[-1]
-                    except ValueError:
-                        output_query.append("$" + str(len(placeholders)))
-            elif style == 'pyformat':
-                if prev_c == ')' and c == "s":
-                    state = OUTSIDE
-                    try:
-                        pidx = placeholders.index(placeholders[-1], 0, -1)
-                        output_query.append("$" + str(pidx + 1))
-                        del placeholders[-1]
-                    except ValueError:
-                        output_query.append("$" + str(len(placeholders)))
-                elif c in "()":
-                    pass
+                # The first character of the name is taken whatever it is
+                k = PARAM_NAME_RE.match(query, i + 2).end()
+                name = query[i + 1:k]
+                try:
+                    idx = indexes[name]
+                except KeyError:
+                    placeholders.append(name)
+                    idx = indexes[name] = len(placeholders)
+                output_query.append(query[start:i])
+                output_query.append("$" + str(idx))
+                start = pos = k
+
+        elif c == '%':
+            next_c = query[i + 1:i + 2]
+            if next_c == '(' and style == 'pyformat':
+                k = query.find(')s', i + 2)
+                if k == -1:
+                    placeholders.append(
+                        query[i + 2:].replace('(', '').replace(')', ''))
+                    output_query.append(query[start:i])
+                    start = pos = length
+                    break
+
+                name = query[i + 2:k].replace('(', '').replace(')', '')
+                try:
+                    idx = indexes[name]
+                except KeyError:
+                    placeholders.append(name)
+                    idx = indexes[name] = len(placeholders)
+                output_query.append(query[start:i])
+                output_query.append("$" + str(idx))
+                start = pos = k + 2
+            else:
+                # A %s or %% means that a pyformat query is using the format
+                # style
+                style = 'format'
+                if next_c == 's':
+                    param_num += 1
+                    output_query.append(query[start:i])
+                    output_query.append("$" + str(param_num))
+                elif next_c == '%':
+                    output_query.append(query[start:i + 1])
                 else:
-                    placeholders[-1] += c
-            elif style == 'format':
-                state = OUTSIDE
-
-        elif state == INSIDE_CO:
-            output_query.append(c)
-            if c == '\n':
-                state = OUTSIDE
-
-        prev_c = c
+                    raise InterfaceError(
+                        "Only %s and %% are supported in the query.")
+                start = pos = i + 2
+
+        elif c == "'":
+            k = i
+            if i > 0 and query[i - 1] == 'E':
+                # An escaped string ends at a quote that doesn't follow a
+                # backslash
+                while True:
+                    k = query.find("'", k + 1)
+                    if k == -1 or query[k - 1] != '\\':
+                        break
+            else:
+                # Two quotes in a string stand for one quote
+                while True:
+                    k = query.find("'", k + 1)
+                    if k == -1 or query[k + 1:k + 2] != "'":
+                        break
+                    k += 1
+            pos = length if k == -1 else k + 1
+
+        elif c == '"':
+            k = query.find('"', i + 1)
+            pos = length if k == -1 else k + 1
+
+        elif c == '-':
+            k = query.find('\n', i + 1)
+            pos = length if k == -1 else k + 1
+
+        elif c == '/':
+            # Block comments can be nested
+            depth = 0
+            while m is not None:
+                depth += 1 if m.group() == '/*' else -1
+                if depth == 0:
+                    break
+                m = BLOCK_COMMENT_RE.search(query, m.end())
+            pos = length if m is None else m.end()
+
+        else:  # $
+            tag = m.group()
+            k = query.find(tag, m.end())
+            pos = length if k == -1 else k + len(tag)
+
+    output_query.append(query[start:])
 
     if style in ('numeric', 'qmark', 'format'):
         def make_args(vals):
@@ -557,9 +582,78 @@ def convert_paramstyle(style, query):
     return ''.join(output_query), make_args
 
 
+StatementCacheInfo = namedtuple(
+    'StatementCacheInfo', 'hits misses evictions maxsize currsize')
+
+PARAMSTYLE_CACHE_SIZE = 1000
+
+
+class ParamstyleCache():
+    # A least recently used cache of the results of convert_paramstyle(),
+    # keyed by (style, query). There's one for the process, shared by all
+    # the connections, so it's guarded by a lock. The conversion itself is
+    # done outside the lock, so two threads may convert the same query at
+    # once, in which case they both get the result that's cached first.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._cache = OrderedDict()
+        self._hits = self._misses = self._evictions = 0
+
+    def __call__(self, style, query):
+        key = style, query
+        cache = self._cache
+        # Acquired explicitly because it's quicker than a with statement
+        self._lock.acquire()
+        try:
+            result = cache[key]
+            cache.move_to_end(key)
+            self._hits += 1
+            return result
+        except KeyError:
+            pass
+        finally:
+            self._lock.release()
+
+        result = convert_paramstyle(style, query)
+        with self._lock:
+            self._misses += 1
+            result = cache.setdefault(key, result)
+            while len(cache) > self.maxsize:
+                cache.popitem(last=False)
+                self._evictions += 1
+        return result
+
+    def info(self):
+        with self._lock:
+            return StatementCacheInfo(
+                self._hits, self._misses, self._evictions, self.maxsize,
+                len(self._cache))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._hits = self._misses = self._evictions = 0
+
+
+paramstyle_cache = ParamstyleCache(PARAMSTYLE_CACHE_SIZE)
+
+
+def paramstyle_cache_info():
+    """Returns the statistics of the cache of converted queries, as a named
+    tuple of hits, misses, evictions, maxsize and currsize. The cache is
+    shared by all the connections of the process.
+
+    This function is a pg8000 extension.
+    """
+    return paramstyle_cache.info()
+
+
 EPOCH = Datetime(2000, 1, 1)
 EPOCH_TZ = EPOCH.replace(tzinfo=Timezone.utc)
 EPOCH_SECONDS = timegm(EPOCH.timetuple())
+MICROSECOND = Timedelta(microseconds=1)
 INFINITY_MICROSECONDS = 2 ** 63 - 1
 MINUS_INFINITY_MICROSECONDS = -1 * INFINITY_MICROSECONDS - 1
 
@@ -585,8 +679,7 @@ def timestamp_recv_float(data, offset, length):
 
 # data is 64-bit integer representing microseconds since 2000-01-01
 def timestamp_send_integer(v):
-    return q_pack(
-        int((timegm(v.timetuple()) - EPOCH_SECONDS) * 1e6) + v.microsecond)
+    return q_pack((v - EPOCH) // MICROSECOND)
 
 
 # data is double-precision float representing seconds since 2000-01-01
@@ -595,10 +688,11 @@ def timestamp_send_float(v):
 
 
 def timestamptz_send_integer(v):
-    # timestamps should be sent as UTC.  If they have zone info,
-    # convert them.
-    return timestamp_send_integer(
-        v.astimezone(Timezone.utc).replace(tzinfo=None))
+    # The difference from the epoch in UTC. A naive datetime is taken to be
+    # in local time.
+    if v.tzinfo is None:
+        v = v.astimezone()
+    return q_pack((v - EPOCH_TZ) // MICROSECOND)
 
 
 def timestamptz_send_float(v):
@@ -630,6 +724,86 @@ def timestamptz_recv_float(data, offset, length):
         tzinfo=Timezone.utc)
 
 
+EPOCH_DATE_ORDINAL = EPOCH.toordinal()
+INFINITY_DAYS = 2 ** 31 - 1
+MINUS_INFINITY_DAYS = -1 * INFINITY_DAYS - 1
+
+
+# The number of days in 400 years of the Gregorian calendar
+DAYS_PER_400_YEARS = 146097
+
+
+def date_text(days):
+    # Returns the ISO text that the server gives for a date that's outside
+    # the range of Python dates, such as 10000-01-01 or 0044-03-15 BC. The
+    # calendar repeats every 400 years, so the date is moved into the range
+    # of Python dates by a whole number of 400 year cycles.
+    ordinal = days + EPOCH_DATE_ORDINAL
+    cycles = (ordinal - 1) // DAYS_PER_400_YEARS
+    d = date.fromordinal(ordinal - cycles * DAYS_PER_400_YEARS)
+    year = d.year + cycles * 400
+    if year > 0:
+        return '%04d-%02d-%02d' % (year, d.month, d.day)
+    else:
+        return '%04d-%02d-%02d BC' % (1 - year, d.month, d.day)
+
+
+# data is 32-bit integer representing days since 2000-01-01
+def date_recv(data, offset, length):
+    days = i_unpack(data, offset)[0]
+    try:
+        return date.fromordinal(days + EPOCH_DATE_ORDINAL)
+    except (ValueError, OverflowError):
+        if days == INFINITY_DAYS:
+            return 'infinity'
+        elif days == MINUS_INFINITY_DAYS:
+            return '-infinity'
+        else:
+            return date_text(days)
+
+
+def date_send(v):
+    return i_pack(v.toordinal() - EPOCH_DATE_ORDINAL)
+
+
+# data is 64-bit integer representing microseconds since midnight
+def time_recv_integer(data, offset, length):
+    seconds, micros = divmod(q_unpack(data, offset)[0], 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return time(hours, minutes, seconds, micros)
+
+
+# data is double-precision float representing seconds since midnight
+def time_recv_float(data, offset, length):
+    seconds, micros = divmod(round(d_unpack(data, offset)[0] * 1e6), 1000000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return time(hours, minutes, seconds, micros)
+
+
+# timetz data is the time followed by the 32-bit offset of the zone in
+# seconds west of UTC
+def timetz_recv_integer(data, offset, length):
+    return time_recv_integer(data, offset, length).replace(
+        tzinfo=Timezone(Timedelta(seconds=-i_unpack(data, offset + 8)[0])))
+
+
+def timetz_recv_float(data, offset, length):
+    return time_recv_float(data, offset, length).replace(
+        tzinfo=Timezone(Timedelta(seconds=-i_unpack(data, offset + 8)[0])))
+
+
+def time_send_integer(v):
+    return q_pack(
+        ((v.hour * 60 + v.minute) * 60 + v.second) * 1000000 + v.microsecond)
+
+
+def time_send_float(v):
+    return d_pack(
+        (v.hour * 60 + v.minute) * 60 + v.second + v.microsecond / 1e6)
+
+
 def interval_send_integer(v):
     microseconds = v.microseconds
     try:
@@ -678,6 +852,19 @@ def interval_recv_float(data, offset, length):
         return Interval(int(seconds * 1000 * 1000), days, months)
 
 
+EPOCH_UNIX_MICROSECONDS = EPOCH_SECONDS * 1000000
+
+
+# Returns a timestamp as microseconds since 1970-01-01 rather than 2000-01-01,
+# leaving the +/-infinity values as they are.
+def timestamp_recv_unix_micros(data, offset, length):
+    micros = q_unpack(data, offset)[0]
+    if micros in (INFINITY_MICROSECONDS, MINUS_INFINITY_MICROSECONDS):
+        return micros
+    else:
+        return micros + EPOCH_UNIX_MICROSECONDS
+
+
 def int8_recv(data, offset, length):
     return q_unpack(data, offset)[0]
 
@@ -698,13 +885,112 @@ def float8_recv(data, offset, length):
     return d_unpack(data, offset)[0]
 
 
+def bool_recv(data, offset, length):
+    return data[offset] == 1
+
+
+# The sign word of a binary NUMERIC
+NUMERIC_POS = 0x0000
+NUMERIC_NEG = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_PINF = 0xD000
+NUMERIC_NINF = 0xF000
+
+
+# A binary NUMERIC is a header of ndigits, weight, sign and dscale followed by
+# ndigits base 10000 digits, the first of which is multiplied by
+# 10000 ** weight. The dscale is the number of decimal digits after the
+# decimal point.
+def numeric_recv(data, offset, length):
+    ndigits, weight, sign, dscale = hhHh_unpack(data, offset)
+    if sign == NUMERIC_NAN:
+        return Decimal('NaN')
+    elif sign == NUMERIC_PINF:
+        return Decimal('Infinity')
+    elif sign == NUMERIC_NINF:
+        return Decimal('-Infinity')
+
+    num = 0
+    for digit in unpack_from('!' + 'H' * ndigits, data, offset + 8):
+        num = num * 10000 + digit
+
+    # Scale the digits so that the exponent is -dscale, matching the text
+    # representation.
+    shift = (weight + 1 - ndigits) * 4 + dscale
+    if shift > 0:
+        num *= 10 ** shift
+    elif shift < 0:
+        num //= 10 ** -shift
+
+    return Decimal(
+        ('-' if sign == NUMERIC_NEG else '') + str(num) + 'E-' + str(dscale))
+
+
+def numeric_send(v):
+    try:
+        sign, digits, exponent = v.as_tuple()
+    except AttributeError:
+        sign, digits, exponent = Decimal(v).as_tuple()
+
+    if exponent == 'F':
+        return hhHh_pack(0, 0, NUMERIC_NINF if sign else NUMERIC_PINF, 0)
+    elif exponent in ('n', 'N'):
+        return hhHh_pack(0, 0, NUMERIC_NAN, 0)
+
+    digit_str = ''.join(map(str, digits))
+    if exponent < 0:
+        dscale = frac_len = -exponent
+        weight = 0
+    else:
+        # Whole base 10000 digits of trailing zeros are implied by the weight
+        dscale = frac_len = 0
+        weight, zeros = divmod(exponent, 4)
+        digit_str += '0' * zeros
+
+    # Pad the digits so that they split into base 10000 digits either side of
+    # the decimal point.
+    frac_pad = -frac_len % 4
+    int_len = max(len(digit_str) - frac_len, 0)
+    int_pad = -int_len % 4
+    digit_str = '0' * (int_pad + int_len + frac_len - len(digit_str)) + \
+        digit_str + '0' * frac_pad
+    weight += (int_len + int_pad) // 4 - 1
+
+    pg_digits = [
+        int(digit_str[i:i + 4]) for i in range(0, len(digit_str), 4)]
+    start = 0
+    while start < len(pg_digits) and pg_digits[start] == 0:
+        start += 1
+        weight -= 1
+    end = len(pg_digits)
+    while end > start and pg_digits[end - 1] == 0:
+        end -= 1
+    pg_digits = pg_digits[start:end]
+    if len(pg_digits) == 0:
+        weight = 0
+
+    return hhHh_pack(
+        len(pg_digits), weight, NUMERIC_NEG if sign else NUMERIC_POS,
+        dscale) + pack('!' + 'H' * len(pg_digits), *pg_digits)
+
+
+# The array.array typecodes of the values of a column, by receive function
+COLUMN_TYPECODES = {
+    int2_recv: 'h',
+    int4_recv: 'i',
+    int8_recv: 'q',
+    float4_recv: 'f',
+    float8_recv: 'd',
+}
+
+
 def bytea_send(v):
     return v
 
 
 # bytea
 def bytea_recv(data, offset, length):
-    return data[offset:offset + length]
+    return bytes(data[offset:offset + length])
 
 
 def uuid_send(v):
@@ -712,7 +998,8 @@ def uuid_send(v):
 
 
 def uuid_recv(data, offset, length):
-    return UUID(bytes=data[offset:offset+length])
+    high, low = QQ_unpack(data, offset)
+    return UUID(int=high << 64 | low)
 
 
 def bool_send(v):
@@ -728,10 +1015,78 @@ def null_send(v):
     return NULL
 
 
+# The struct formats of the send functions that pack a value as it is, so that
+# a run of parameters sent with them can be packed with a single Struct.
+BIND_FORMATS = {
+    h_pack: 'h',
+    i_pack: 'i',
+    q_pack: 'q',
+    d_pack: 'd',
+    bool_send: '?'}
+
+# The sizes of the values made by the send functions that convert a value
+# into a fixed number of bytes.
+BIND_SIZES = {
+    date_send: 4,
+    time_send_integer: 8,
+    time_send_float: 8,
+    timestamp_send_integer: 8,
+    timestamp_send_float: 8,
+    timestamptz_send_integer: 8,
+    timestamptz_send_float: 8,
+    interval_send_integer: 16,
+    interval_send_float: 16,
+    uuid_send: 16}
+
+
 def int_in(data, offset, length):
     return int(data[offset: offset + length])
 
 
+def inet_parse(inet_str):
+    if '/' in inet_str:
+        return ip_network(inet_str, False)
+    else:
+        return ip_address(inet_str)
+
+
+# A token of a text array is a quoted element, a brace or comma, or an
+# unquoted element.
+ARRAY_TOKEN = re_compile(r'"((?:[^"\\]|\\.)*)"|([{},])|([^{},"]+)', DOTALL)
+ARRAY_ESCAPE = re_compile(r'\\(.)', DOTALL)
+
+
+def parse_array(value, conversion):
+    """Parses the text representation of an array into nested lists, the
+    elements being converted from strings with the conversion function.
+    """
+    if value.startswith('['):
+        # Skip the dimensions decoration, eg. [0:2]={1,2,3}
+        value = value[value.index('=') + 1:]
+
+    stack = []
+    arr = None
+    for quoted, brace, unquoted in ARRAY_TOKEN.findall(value):
+        if brace == '{':
+            new_arr = []
+            if arr is not None:
+                arr.append(new_arr)
+                stack.append(arr)
+            arr = new_arr
+        elif brace == '}':
+            if len(stack) > 0:
+                arr = stack.pop()
+        elif brace == ',':
+            pass
+        elif unquoted != '':
+            arr.append(None if unquoted == 'NULL' else conversion(unquoted))
+        else:
+            if '\\' in quoted:
+                quoted = ARRAY_ESCAPE.sub(r'\1', quoted)
+            arr.append(conversion(quoted))
+    return arr
+
+
 class Cursor():
     """A cursor object is returned by the :meth:`~Connection.cursor` method of
     a connection. It has the following attributes and methods:
@@ -783,14 +1138,52 @@ class Cursor():
 
         This attribute is part of the `DBAPI 2.0 specification
         <http://www.python.org/dev/peps/pep-0249/>`_.
+
+    .. attribute:: fetch_size
+
+        If ``None`` (the default) all the rows of a query are read from the
+        server by ``execute()``. Otherwise it is the number of rows that are
+        read from the server at a time, the next batch only being requested
+        when the rows already read have been consumed. This is done using a
+        named portal, and since the server closes portals at the end of a
+        transaction it only takes effect within a transaction. The rows that
+        haven't been read when the transaction ends are discarded.
+
+        This attribute is a pg8000 extension.
+
+    .. attribute:: row_factory
+
+        If ``None`` each row is returned as a list. Otherwise it's a function,
+        such as :func:`tuple_row`, :func:`named_row` or :func:`dict_row`, that
+        is called once for each result with the names of the columns, and
+        returns the function that makes a row from a list of the values. The
+        initial value is the :attr:`Connection.row_factory` of the connection.
+
+        This attribute is a pg8000 extension.
+
+    .. attribute:: columnar
+
+        If ``True`` the rows returned by ``execute()`` are decoded straight
+        into a buffer for each column, which are read with
+        :meth:`fetch_columns`, rather than into rows. Defaults to ``False``.
+
+        This attribute is a pg8000 extension.
     """
 
-    def __init__(self, connection, paramstyle=None):
+    def __init__(self, connection, paramstyle=None, fetch_size=None):
         self._c = connection
         self.arraysize = 1
+        self.fetch_size = fetch_size
+        self.row_factory = connection.row_factory
+        self.columnar = False
+        self._columns = None
         self.ps = None
         self._row_count = -1
         self._cached_rows = deque()
+        self._portal_name_bin = None
+        self._portal_suspended = False
+        self._portal_row_count = 0
+        self._portal_max_rows = 0
         if paramstyle is None:
             self.paramstyle = pg8000.paramstyle
         else:
@@ -830,7 +1223,7 @@ class Cursor():
     # or mapping and will be bound to variables in the operation.
     # <p>
     # Stability: Part of the DBAPI 2.0 specification.
-    def execute(self, operation, args=None, stream=None):
+    def execute(self, operation, args=None, stream=None, timeout=None):
         """Executes a database operation.  Parameters may be provided as a
         sequence, or as a mapping, depending upon the value of
         :data:`pg8000.paramstyle`.
@@ -856,12 +1249,22 @@ class Cursor():
             object, and for COPY TO it must be writable.
 
             .. versionadded:: 1.9.11
+
+        :param timeout: This is a pg8000 extension. If the operation hasn't
+            finished after this number of seconds, it's cancelled with
+            :meth:`Connection.cancel`, and a :exc:`ProgrammingError` with the
+            code 57014 is raised. The connection can still be used once the
+            transaction has been rolled back.
         """
+        timer = None
         try:
             self.stream = stream
 
             if not self._c.in_transaction and not self._c.autocommit:
                 self._c.execute(self, "begin transaction", None)
+            if timeout is not None:
+                timer = Timer(timeout, self._c.cancel)
+                timer.start()
             self._c.execute(self, operation, args)
         except AttributeError as e:
             if self._c is None:
@@ -870,6 +1273,12 @@ class Cursor():
                 raise InterfaceError("connection is closed")
             else:
                 raise e
+        finally:
+            if timer is not None:
+                # If the cancel request is already being sent, waiting for
+                # it means that it can't cancel a later operation.
+                timer.cancel()
+                timer.join()
         return self
 
     def executemany(self, operation, param_sets):
@@ -885,13 +1294,119 @@ class Cursor():
             A sequence of parameters to execute the statement with. The values
             in the sequence should be sequences or mappings of parameters, the
             same as the args argument of the :meth:`execute` method.
+
+        The executions are sent to the server in batches, without waiting for
+        each one to complete, and are followed by a single Sync message.
         """
-        rowcounts = []
-        for parameters in param_sets:
-            self.execute(operation, parameters)
-            rowcounts.append(self._row_count)
+        try:
+            self.stream = None
+
+            if not self._c.in_transaction and not self._c.autocommit:
+                self._c.execute(self, "begin transaction", None)
+            self._c.executemany(self, operation, param_sets)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        return self
+
+    def copy_records(self, table, columns, rows):
+        """Copies rows of Python values into a table, with a COPY FROM in
+        the binary format. Each value is sent in the binary format of the
+        type of its column, so the server doesn't have to parse any text,
+        and the rows are encoded as they're sent, so that the rows can be
+        an iterator of any length.
+
+        This method is a pg8000 extension.
+
+        :param table: The name of the table, which is put into the SQL as
+            it is.
+        :param columns: A sequence of the names of the columns that the
+            values of each row are for, or ``None`` for all the columns of
+            the table.
+        :param rows: An iterable of sequences of values. A value of ``None``
+            is copied as a NULL.
+        """
+        try:
+            col_list = '*' if columns is None else ', '.join(columns)
+            ps = self._c.describe(
+                self, "SELECT " + col_list + " FROM " + table)
+            row_desc = ps['row_desc']
+            sends = self._c.make_copy_sends(
+                row_desc, self._c.find_enum_oids(row_desc))
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
 
-        self._row_count = -1 if -1 in rowcounts else sum(rowcounts)
+        if columns is not None:
+            table += " (" + col_list + ")"
+        return self.execute(
+            "COPY " + table + " FROM STDIN WITH (FORMAT binary)",
+            stream=CopyRecordsStream(rows, sends))
+
+    def copy_out(self, operation, args=None):
+        """Executes a ``COPY ... TO STDOUT`` statement, and returns an
+        iterator of the data as ``bytes`` chunks. The statement is executed
+        when the iteration starts, and the chunks are read from the server
+        as they're iterated over. The data can be passed on to a
+        compressor or an upload without being held in memory or written to
+        a file. The connection can't be used for anything else until the
+        iterator is exhausted or closed, and if it's closed early the rest
+        of the data is read and thrown away.
+
+        This method is a pg8000 extension.
+
+        :param operation: The SQL of the COPY statement.
+        :param args: The parameters of the statement, the same as for
+            :meth:`execute`.
+        """
+        try:
+            if not self._c.in_transaction and not self._c.autocommit:
+                self._c.execute(self, "begin transaction", None)
+            chunks = self._c.copy_out(self, operation, args)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        yield from chunks
+
+    def copy_out_records(self, source, columns=None):
+        """Copies the rows of a table or query with a COPY TO in the binary
+        format, decoding the values as they're received. The rows are then
+        fetched from the cursor in the same way as the rows of a query, or
+        as columns if the cursor is in :attr:`columnar` mode. The server
+        doesn't have to format the values as text, and pg8000 doesn't have
+        to parse them.
+
+        This method is a pg8000 extension.
+
+        :param source: The name of a table, or a query in parentheses, which
+            is put into the SQL as it is.
+        :param columns: A sequence of the names of the columns of the table
+            to copy, or ``None`` for all of them.
+        """
+        try:
+            ps = self._c.describe(self, copy_out_query(source, columns))
+            sql, stream = self._c.make_copy_out(ps, source, columns, self)
+            self.execute(sql, stream=stream)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        stream.finish(self)
         return self
 
     def fetchone(self):
@@ -952,12 +1467,58 @@ class Cursor():
         except TypeError:
             raise ProgrammingError("attempting to use unexecuted cursor")
 
+    def fetch_columns(self, numpy=False):
+        """Fetches all remaining rows of a query result, as columns. The
+        cursor must be in :attr:`columnar` mode.
+
+        This method is a pg8000 extension.
+
+        :param numpy: If ``True`` the typed columns are returned as NumPy
+            arrays rather than ``array.array`` objects.
+
+        :returns:
+            A list with a ``(values, nulls)`` pair for each column. For
+            int2, int4, int8, float4, float8, bool, timestamp and timestamptz
+            columns the values are an ``array.array``, with a zero where the
+            value is NULL. Timestamps are given as the number of
+            microseconds since 1970-01-01 UTC. For the other types the values
+            are a list. The nulls are an ``array.array`` of bytes, which are
+            1 where the value is NULL, and 0 otherwise. With ``numpy=True``
+            the typed values are a NumPy array of the corresponding type
+            (``datetime64[us]`` for timestamps), and the nulls are a NumPy
+            array of bools.
+        """
+        if not self.columnar:
+            raise ProgrammingError("the cursor isn't in columnar mode")
+        if self.ps is None:
+            raise ProgrammingError("A query hasn't been issued.")
+        if len(self.ps['row_desc']) == 0:
+            raise ProgrammingError("no result set")
+
+        while self._portal_suspended:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            self._c.fetch_portal(self)
+
+        columns = self._columns
+        if columns is None:
+            columns = make_columns(self.ps)
+        self._columns = None
+
+        if numpy:
+            return [numpy_column(*column) for column in columns]
+        else:
+            return [(values, nulls) for values, nulls, _, _ in columns]
+
     def close(self):
         """Closes the cursor.
 
         This method is part of the `DBAPI 2.0 specification
         <http://www.python.org/dev/peps/pep-0249/>`_.
         """
+        if self._portal_suspended and self._c is not None and \
+                self._c._sock is not None:
+            self._c.close_portal(self)
         self._c = None
 
     def __iter__(self):
@@ -982,15 +1543,403 @@ class Cursor():
         pass
 
     def __next__(self):
-        try:
-            return self._cached_rows.popleft()
-        except IndexError:
-            if self.ps is None:
-                raise ProgrammingError("A query hasn't been issued.")
-            elif len(self.ps['row_desc']) == 0:
-                raise ProgrammingError("no result set")
-            else:
-                raise StopIteration()
+        while True:
+            try:
+                return self._cached_rows.popleft()
+            except IndexError:
+                if self.ps is None:
+                    raise ProgrammingError("A query hasn't been issued.")
+                elif len(self.ps['row_desc']) == 0:
+                    raise ProgrammingError("no result set")
+                elif self._portal_suspended:
+                    if self._c is None:
+                        raise InterfaceError("Cursor closed")
+                    self._c.fetch_portal(self)
+                else:
+                    raise StopIteration()
+
+
+def make_columns(ps):
+    """Makes a [values, nulls, func, dtype] list for each column of the result
+    of a prepared statement. The values of int2, int4, int8, float4, float8,
+    bool and integer timestamp columns go in an array.array, with dtype being
+    the corresponding NumPy dtype. The values of other columns go in a list.
+    """
+    columns = []
+    for f, func in zip(ps['row_desc'], ps['input_funcs']):
+        if f['type_oid'] == 16:
+            typecode, dtype = 'b', '?'
+        elif func in (timestamp_recv_integer, timestamptz_recv_integer):
+            typecode, dtype = 'q', 'datetime64[us]'
+            func = timestamp_recv_unix_micros
+        else:
+            typecode = dtype = COLUMN_TYPECODES.get(func)
+
+        if typecode is None:
+            values = []
+        else:
+            values = array(typecode)
+        columns.append([values, array('b'), func, dtype])
+    return columns
+
+
+# The struct formats of the receive functions that unpack a value as it is, so
+# that a run of columns received with them can be unpacked with one Struct.
+ROW_FORMATS = dict(COLUMN_TYPECODES)
+ROW_FORMATS[bool_recv] = '?'
+
+
+def decode_fields(funcs, data, idx, row):
+    # Decodes the fields of a DataRow from idx, one for each of the funcs,
+    # appending them to the row, and returns the index after them.
+    for func in funcs:
+        vlen = i_unpack(data, idx)[0]
+        idx += 4
+        if vlen == -1:
+            row.append(None)
+        else:
+            row.append(func(data, idx, vlen))
+            idx += vlen
+    return idx
+
+
+def make_row_decoder(funcs):
+    """Returns a function that decodes a DataRow, starting at an offset in
+    the data, into a list of values, with one receive function for each
+    column. If none of the columns can be unpacked together it returns None,
+    and the row is decoded by the loop in :meth:`Connection.handle_DATA_ROW`.
+
+    Each run of columns that are unpacked as they are, such as int4 or
+    float8 columns, is unpacked along with the lengths of the values by a
+    single Struct. A NULL doesn't have a value, so if the lengths aren't the
+    ones expected the run is decoded one field at a time instead.
+    """
+    def run_struct(run):
+        # The unpack function, the size and the value lengths of a run
+        fmt = '!' + ''.join('i' + ROW_FORMATS[func] for func in run)
+        lengths = tuple(calcsize('!' + ROW_FORMATS[func]) for func in run)
+        return Struct(fmt).unpack_from, calcsize(fmt), lengths
+
+    def packed(run):
+        unpack, size, lengths = run_struct(run)
+
+        def decode(data, idx, row):
+            try:
+                vals = unpack(data, idx)
+            except struct_error:
+                vals = ()
+            if vals[0::2] == lengths:
+                row.extend(vals[1::2])
+                return idx + size
+            return decode_fields(run, data, idx, row)
+        return decode
+
+    groups = []
+    for func in funcs:
+        is_packed = func in ROW_FORMATS
+        if len(groups) > 0 and groups[-1][0] == is_packed:
+            groups[-1][1].append(func)
+        else:
+            groups.append((is_packed, [func]))
+
+    # A single column isn't worth a Struct of its own, so it's decoded along
+    # with the columns around it.
+    runs = []
+    for is_packed, run in groups:
+        is_packed = is_packed and len(run) > 1
+        if len(runs) > 0 and not is_packed and not runs[-1][0]:
+            runs[-1][1].extend(run)
+        else:
+            runs.append((is_packed, run))
+
+    if len(runs) == 1 and runs[0][0]:
+        # All the columns are unpacked in one go
+        run = runs[0][1]
+        unpack, size, lengths = run_struct(run)
+
+        def decode_row(data, offset):
+            try:
+                vals = unpack(data, offset + 2)
+            except struct_error:
+                vals = ()
+            if vals[0::2] == lengths:
+                return list(vals[1::2])
+            row = []
+            decode_fields(run, data, offset + 2, row)
+            return row
+
+    elif len(runs) <= 1:
+        return None
+
+    else:
+        decoders = tuple(
+            packed(run) if is_packed else partial(decode_fields, run)
+            for is_packed, run in runs)
+
+        def decode_row(data, offset):
+            row = []
+            idx = offset + 2
+            for decode in decoders:
+                idx = decode(data, idx, row)
+            return row
+
+    return decode_row
+
+
+def numpy_column(values, nulls, func, dtype):
+    import numpy
+
+    if dtype is not None:
+        values = numpy.frombuffer(values, dtype=values.typecode)
+        if dtype != values.dtype:
+            values = values.view(dtype)
+    return values, numpy.frombuffer(nulls, dtype='?')
+
+
+def tuple_row(names):
+    """A row factory that makes each row a tuple.
+
+    This function is a pg8000 extension.
+    """
+    return tuple
+
+
+def named_row(names):
+    """A row factory that makes each row an instance of a named tuple class,
+    created for the columns of the result. Column names that aren't valid
+    identifiers are replaced with positional names.
+
+    This function is a pg8000 extension.
+    """
+    return namedtuple('Row', names, rename=True)._make
+
+
+def dict_row(names):
+    """A row factory that makes each row a dict of column names to values.
+
+    This function is a pg8000 extension.
+    """
+    def make_row(values):
+        return dict(zip(names, values))
+    return make_row
+
+
+# The signature, flags and header extension length at the start of the
+# binary COPY format, and the field count that ends it.
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + ii_pack(0, 0)
+COPY_BINARY_TRAILER = h_pack(-1)
+
+# The struct formats of the types whose values have a fixed length
+COPY_FIXED_FORMATS = {
+    16: '?',  # bool
+    20: 'q',  # int8
+    21: 'h',  # int2
+    23: 'i',  # int4
+    26: 'I',  # oid
+    700: 'f',  # float4
+    701: 'd',  # float8
+}
+
+# The types whose binary format is the text: name, text, unknown, bpchar and
+# varchar. The same goes for enums, whose oids vary between databases.
+COPY_TEXT_OIDS = (19, 25, 705, 1042, 1043)
+
+# The oids of the types defined in a database start from here
+FIRST_NORMAL_OID = 16384
+
+
+def copy_user_oids(row_desc):
+    # Returns the oids of the columns whose types are defined in the
+    # database, and so may be enums
+    return sorted(
+        set(
+            f['type_oid'] for f in row_desc
+            if f['type_oid'] >= FIRST_NORMAL_OID))
+
+
+def enum_oids_query(oids):
+    # Returns the query that finds which of the type oids are enums
+    return "SELECT oid FROM pg_type WHERE typtype = 'e' AND oid IN (" + \
+        ', '.join(str(oid) for oid in oids) + ")"
+
+
+class CopyRecordsStream():
+    """A readable stream of rows in the binary COPY format. The rows are
+    encoded as they're read, with a function for each column that returns
+    the field of a value.
+    """
+
+    def __init__(self, rows, sends):
+        self._rows = iter(rows)
+        self._sends = sends
+        self._field_count = h_pack(len(sends))
+        self._buffer = bytearray(COPY_BINARY_HEADER)
+
+    def readinto(self, b):
+        buffer, sends, field_count = self._buffer, self._sends, \
+            self._field_count
+        wanted = len(b)
+        while len(buffer) < wanted and self._rows is not None:
+            try:
+                row = next(self._rows)
+            except StopIteration:
+                buffer += COPY_BINARY_TRAILER
+                self._rows = None
+                break
+
+            if len(row) != len(sends):
+                raise ProgrammingError(
+                    "a row has " + str(len(row)) + " values, but there are " +
+                    str(len(sends)) + " columns")
+            buffer += field_count
+            for value, send in zip(row, sends):
+                buffer += NULL if value is None else send(value)
+
+        # The data that's been read is dropped, so the buffer holds no more
+        # than one read plus one row. Deleting from the start of a bytearray
+        # doesn't move the rest of it.
+        size = min(len(b), len(buffer))
+        b[:size] = buffer[:size]
+        del buffer[:size]
+        return size
+
+
+def copy_out_query(source, columns):
+    # Returns the query whose description gives the columns of a COPY TO
+    source = source.strip()
+    if source.startswith('('):
+        return source[1:-1]
+    else:
+        return "SELECT " + (
+            '*' if columns is None else ', '.join(columns)) + " FROM " + source
+
+
+class CopyChunks(list):
+    # The stream of a COPY TO run by Connection.copy_out(), which holds the
+    # chunks that haven't been yielded yet.
+    write = list.append
+
+
+def copy_file_size(stream):
+    # Returns the number of bytes from the position of a binary stream to the
+    # end, if it's a regular file that can be sent with sendfile(), otherwise
+    # None.
+    try:
+        if 'b' not in getattr(stream, 'mode', 'b') or not stream.readable():
+            return None
+        stat = fstat(stream.fileno())
+        if not S_ISREG(stat.st_mode):
+            return None
+        return max(0, stat.st_size - stream.tell())
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class CopyRowsWriter():
+    """A writable stream that decodes the rows of a binary COPY TO as
+    they're written to it. Each row has the same layout as a DataRow, so the
+    rows are decoded by :meth:`Connection.handle_DATA_ROW`, into the rows or
+    columns of a cursor of their own.
+    """
+
+    def __init__(self, connection, ps, cursor):
+        self._handle_row = connection.handle_DATA_ROW
+        self._cursor = Cursor(connection)
+        self._cursor.ps = ps
+        self._cursor.row_factory = cursor.row_factory
+        self._cursor.columnar = cursor.columnar
+        self._in_header = True
+
+    def write(self, data):
+        # The server sends each row in a CopyData message of its own, so the
+        # data is always a whole row. The first row is preceded by the
+        # header, which is the signature and flags followed by the length
+        # of the header extension, and the last message is the trailer.
+        pos = 0
+        if self._in_header:
+            pos = 19 + i_unpack(data, 15)[0]
+            self._in_header = False
+        if h_unpack(data, pos)[0] != -1:
+            self._handle_row(data, self._cursor, pos)
+
+    def finish(self, cursor):
+        # Hands the decoded rows to the cursor that executed the COPY
+        cursor.ps = self._cursor.ps
+        cursor._cached_rows = self._cursor._cached_rows
+        cursor._columns = self._cursor._columns
+
+
+class Pipeline():
+    """A pipeline object is returned by the :meth:`~Connection.pipeline`
+    method of a connection. Statements queued with :meth:`execute` are sent
+    to the server together, and the responses are read back, when the
+    pipeline is synced. So however many statements there are, executing them
+    takes a single round trip to the server, or two round trips if some of
+    them haven't been prepared yet.
+
+    The pipeline can be used as a context manager, in which case it is synced
+    on leaving the ``with`` block, unless an exception has been raised.
+
+    The statements that haven't been prepared yet are all prepared before any
+    of the statements are executed, so a statement can't refer to a table
+    created by an earlier statement in the same pipeline. COPY statements
+    can't be executed in a pipeline.
+
+    This class is a pg8000 extension.
+
+    .. attribute:: sync_each
+
+        If ``False`` a single Sync message is sent after the last statement,
+        and an error stops the rest of the statements being executed. If
+        ``True`` a Sync is sent after each statement, so that the statements
+        after an error are still executed (although within a transaction they
+        will fail because the transaction is aborted).
+    """
+
+    def __init__(self, connection, sync_each=False, paramstyle=None):
+        self._c = connection
+        self.sync_each = sync_each
+        self._queue = []
+        if paramstyle is None:
+            self.paramstyle = pg8000.paramstyle
+        else:
+            self.paramstyle = paramstyle
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.sync()
+        else:
+            self._queue.clear()
+
+    def execute(self, operation, args=None):
+        """Queues a database operation. The parameters are the same as for
+        :meth:`Cursor.execute`.
+
+        :returns:
+            A :class:`Cursor` that holds the result of the operation once the
+            pipeline has been synced.
+        """
+        cursor = Cursor(self._c, paramstyle=self.paramstyle)
+        self._queue.append((cursor, operation, args))
+        return cursor
+
+    def sync(self):
+        """Sends the queued statements to the server and reads the responses.
+        If any of the statements fail, the first error is raised once all the
+        responses have been read.
+        """
+        queue, self._queue = self._queue, []
+        if len(queue) > 0:
+            try:
+                self._c.execute_pipeline(queue, self.sync_each)
+            except AttributeError as e:
+                if self._c._sock is None:
+                    raise InterfaceError("connection is closed")
+                else:
+                    raise e
 
 
 # Message codes
@@ -1021,6 +1970,7 @@ PARSE = b"P"
 EXECUTE = b"E"
 FLUSH = b'H'
 SYNC = b'S'
+COPY_FAIL = b'f'
 PASSWORD = b'p'
 DESCRIBE = b'D'
 TERMINATE = b'X'
@@ -1060,6 +2010,34 @@ IDLE = b"I"
 IDLE_IN_TRANSACTION = b"T"
 IDLE_IN_FAILED_TRANSACTION = b"E"
 
+# The maximum number of executions, and the number of bytes of messages,
+# that executemany() sends before reading their responses. The limit on the
+# bytes stops the client and server each waiting for the other to read from
+# a full socket buffer.
+EXECUTEMANY_BATCH_SIZE = 1000
+EXECUTEMANY_BATCH_BYTES = 65536
+
+# A portal that never exists, which executemany() executes to make the
+# server fail the statements it's been sent when the client hits an error.
+ABORT_PORTAL = b'pg8000_abort' + NULL_BYTE
+
+# The initial size of the buffer that messages are received into, and the
+# number of bytes asked for with each read from the socket.
+RECEIVE_SIZE = 65536
+
+# The size of the first read from the stream of a COPY FROM. It's doubled
+# each time a read fills it, up to COPY_IN_MAX_SIZE, which is also the number
+# of bytes of CopyData messages that are gathered before they're sent.
+COPY_IN_SIZE = 8192
+COPY_IN_MAX_SIZE = 1048576
+
+# The maximum size of a CopyData message sent from a file with sendfile().
+COPY_SENDFILE_SIZE = 8388608
+
+# The number of bytes of COPY TO data that are gathered before they're
+# written to the stream, or yielded by Cursor.copy_out().
+COPY_OUT_SIZE = 1048576
+
 
 arr_trans = dict(zip(map(ord, "[] 'u"), list('{}') + [None] * 3))
 
@@ -1095,48 +2073,9 @@ class Connection():
             password=None, source_address=None, unix_sock=None,
             ssl_context=None, timeout=None, max_prepared_statements=1000,
             tcp_keepalive=True, application_name=None, replication=None):
-        self._client_encoding = "utf8"
-        self._commands_with_count = (
-            b"INSERT", b"DELETE", b"UPDATE", b"MOVE", b"FETCH", b"COPY",
-            b"SELECT")
-        self.notifications = deque(maxlen=100)
-        self.notices = deque(maxlen=100)
-        self.parameter_statuses = deque(maxlen=100)
-        self.max_prepared_statements = int(max_prepared_statements)
-        self._run_cursor = Cursor(self, paramstyle='named')
-
-        if user is None:
-            raise InterfaceError(
-                "The 'user' connection parameter cannot be None")
-
-        init_params = {
-            'user': user,
-            'database': database,
-            'application_name': application_name,
-            'replication': replication
-        }
-
-        for k, v in tuple(init_params.items()):
-            if isinstance(v, str):
-                init_params[k] = v.encode('utf8')
-            elif v is None:
-                del init_params[k]
-            elif not isinstance(v, (bytes, bytearray)):
-                raise InterfaceError(
-                    "The parameter " + k + " can't be of type " +
-                    str(type(v)) + ".")
-
-        self.user = init_params['user']
-
-        if isinstance(password, str):
-            self.password = password.encode('utf8')
-        else:
-            self.password = password
-
-        self.autocommit = False
-        self._xid = None
-
-        self._caches = {}
+        init_params = self.init_protocol(
+            user, password, database, application_name, replication,
+            max_prepared_statements)
 
         try:
             if unix_sock is None and host is not None:
@@ -1156,9 +2095,12 @@ class Connection():
                 self._usock.settimeout(timeout)
 
             if unix_sock is None and host is not None:
-                self._usock.connect((host, port))
+                self._address = (host, port)
             elif unix_sock is not None:
-                self._usock.connect(unix_sock)
+                self._address = unix_sock
+            self._usock.connect(self._address)
+            self._family = self._usock.family
+            self._timeout = timeout
 
             if ssl_context is not None:
                 try:
@@ -1181,50 +2123,114 @@ class Connection():
                         "SSL required but ssl module not available in "
                         "this python installation")
 
-            self._sock = self._usock.makefile(mode="rwb")
-            if tcp_keepalive:
-                self._usock.setsockopt(
-                    socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-        except socket.error as e:
-            self._usock.close()
-            raise InterfaceError("communication error", e)
-        self._flush = self._sock.flush
-        self._read = self._sock.read
-        self._write = self._sock.write
+            self._sock = self._usock
+            if tcp_keepalive:
+                self._usock.setsockopt(
+                    socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        except socket.error as e:
+            self._usock.close()
+            raise InterfaceError("communication error", e)
+
+        # The messages from the server are received into a buffer that's
+        # used again and again. It's only replaced by a bigger one when a
+        # message doesn't fit, and the unread part starts at _in_pos.
+        self._in = bytearray(RECEIVE_SIZE)
+        self._in_view = memoryview(self._in)
+        self._in_pos = self._in_end = 0
+
+        self.run_protocol(self.proto_startup(init_params))
+
+    def init_protocol(
+            self, user, password, database, application_name, replication,
+            max_prepared_statements):
+        """Sets up the state of the connection that doesn't depend on how
+        the messages are sent and received, and returns the parameters of the
+        startup message.
+        """
+        self._client_encoding = "utf8"
+        self._commands_with_count = (
+            b"INSERT", b"DELETE", b"UPDATE", b"MOVE", b"FETCH", b"COPY",
+            b"SELECT")
+        self.notifications = deque(maxlen=100)
+        self.notices = deque(maxlen=100)
+        self.parameter_statuses = deque(maxlen=100)
+        self.max_prepared_statements = int(max_prepared_statements)
+        self.row_factory = None
+        self._run_cursor = Cursor(self, paramstyle='named')
+
+        # The outgoing messages are collected here, and sent by _flush()
+        self._out = bytearray()
+        self._write = self._out.extend
+
+        if user is None:
+            raise InterfaceError(
+                "The 'user' connection parameter cannot be None")
+
+        init_params = {
+            'user': user,
+            'database': database,
+            'application_name': application_name,
+            'replication': replication
+        }
+
+        for k, v in tuple(init_params.items()):
+            if isinstance(v, str):
+                init_params[k] = v.encode('utf8')
+            elif v is None:
+                del init_params[k]
+            elif not isinstance(v, (bytes, bytearray)):
+                raise InterfaceError(
+                    "The parameter " + k + " can't be of type " +
+                    str(type(v)) + ".")
+
+        self.user = init_params['user']
+
+        if isinstance(password, str):
+            self.password = password.encode('utf8')
+        else:
+            self.password = password
+
+        self.autocommit = False
+        self._xid = None
+
+        self._caches = {}
+        self._pending_closes = []
+        self._statement_nums = count(1)
+        self._free_statement_nums = []
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+        self._statement_generation = 0
+        self._portal_nums = count(1)
+        self._suspended_cursors = WeakSet()
+
+        # The process ID and secret key of the backend, for cancel requests
         self._backend_key_data = None
 
+        # An exception raised while sending the data of a COPY FROM, which
+        # is raised in place of the error that the server responds with.
+        self._copy_in_error = None
+
+        # The COPY TO data that hasn't been written to the stream yet
+        self._copy_out = None
+
         def text_out(v):
             return v.encode(self._client_encoding)
 
         def enum_out(v):
             return str(v.value).encode(self._client_encoding)
 
-        def time_out(v):
-            return v.isoformat().encode(self._client_encoding)
-
-        def date_out(v):
-            return v.isoformat().encode(self._client_encoding)
-
         def unknown_out(v):
             return str(v).encode(self._client_encoding)
 
-        trans_tab = dict(zip(map(ord, '{}'), '[]'))
-        glbls = {'Decimal': Decimal}
-
-        def array_in(data, idx, length):
-            arr = []
-            prev_c = None
-            for c in data[idx:idx+length].decode(
-                    self._client_encoding).translate(
-                    trans_tab).replace('NULL', 'None'):
-                if c not in ('[', ']', ',', 'N') and prev_c in ('[', ','):
-                    arr.extend("Decimal('")
-                elif c in (']', ',') and prev_c not in ('[', ']', ',', 'e'):
-                    arr.extend("')")
-
-                arr.append(c)
-                prev_c = c
-            return eval(''.join(arr), glbls)
+        def array_in(conversion):
+            # Returns a function for receiving a text array, converting
+            # each element from a string with the conversion function.
+            def array_in_conversion(data, idx, length):
+                return parse_array(
+                    str(data[idx:idx + length], self._client_encoding),
+                    conversion)
+            return array_in_conversion
 
         def array_recv(data, idx, length):
             final_idx = idx + length
@@ -1258,52 +2264,19 @@ class Connection():
                 values = list(map(list, zip(*[iter(values)] * length)))
             return values
 
-        def vector_in(data, idx, length):
-            return eval('[' + data[idx:idx+length].decode(
-                self._client_encoding).replace(' ', ',') + ']')
-
         def text_recv(data, offset, length):
             return str(data[offset: offset + length], self._client_encoding)
 
-        def bool_recv(data, offset, length):
-            return data[offset] == 1
-
         def json_in(data, offset, length):
             return loads(
                 str(data[offset: offset + length], self._client_encoding))
 
-        def time_in(data, offset, length):
-            hour = int(data[offset:offset + 2])
-            minute = int(data[offset + 3:offset + 5])
-            sec = Decimal(
-                data[offset + 6:offset + length].decode(self._client_encoding))
-            return time(
-                hour, minute, int(sec), int((sec - int(sec)) * 1000000))
-
-        def date_in(data, offset, length):
-            d = data[offset:offset+length].decode(self._client_encoding)
-            try:
-                return date(int(d[:4]), int(d[5:7]), int(d[8:10]))
-            except ValueError:
-                return d
-
-        def numeric_in(data, offset, length):
-            return Decimal(
-                data[offset: offset + length].decode(self._client_encoding))
-
-        def numeric_out(d):
-            return str(d).encode(self._client_encoding)
-
         def inet_out(v):
             return str(v).encode(self._client_encoding)
 
         def inet_in(data, offset, length):
-            inet_str = data[offset: offset + length].decode(
-                self._client_encoding)
-            if '/' in inet_str:
-                return ip_network(inet_str, False)
-            else:
-                return ip_address(inet_str)
+            return inet_parse(
+                data[offset: offset + length].decode(self._client_encoding))
 
         self.pg_types = defaultdict(
             lambda: (FC_TEXT, text_recv), {
@@ -1312,7 +2285,7 @@ class Connection():
                 19: (FC_BINARY, text_recv),  # name type
                 20: (FC_BINARY, int8_recv),  # int8
                 21: (FC_BINARY, int2_recv),  # int2
-                22: (FC_TEXT, vector_in),  # int2vector
+                22: (FC_BINARY, array_recv),  # int2vector
                 23: (FC_BINARY, int4_recv),  # int4
                 25: (FC_BINARY, text_recv),  # TEXT type
                 26: (FC_TEXT, int_in),  # oid
@@ -1323,6 +2296,7 @@ class Connection():
                 705: (FC_BINARY, text_recv),  # unknown
                 829: (FC_TEXT, text_recv),  # MACADDR type
                 869: (FC_TEXT, inet_in),  # inet
+                199: (FC_TEXT, array_in(loads)),  # JSON[]
                 1000: (FC_BINARY, array_recv),  # BOOL[]
                 1003: (FC_BINARY, array_recv),  # NAME[]
                 1005: (FC_BINARY, array_recv),  # INT2[]
@@ -1330,22 +2304,28 @@ class Connection():
                 1009: (FC_BINARY, array_recv),  # TEXT[]
                 1014: (FC_BINARY, array_recv),  # CHAR[]
                 1015: (FC_BINARY, array_recv),  # VARCHAR[]
+                1011: (FC_TEXT, array_in(int)),  # XID[]
                 1016: (FC_BINARY, array_recv),  # INT8[]
                 1021: (FC_BINARY, array_recv),  # FLOAT4[]
                 1022: (FC_BINARY, array_recv),  # FLOAT8[]
+                1028: (FC_TEXT, array_in(int)),  # OID[]
+                1040: (FC_TEXT, array_in(str)),  # MACADDR[]
+                1041: (FC_TEXT, array_in(inet_parse)),  # INET[]
                 1042: (FC_BINARY, text_recv),  # CHAR type
                 1043: (FC_BINARY, text_recv),  # VARCHAR type
-                1082: (FC_TEXT, date_in),  # date
-                1083: (FC_TEXT, time_in),
+                1082: (FC_BINARY, date_recv),  # date
+                1083: (FC_BINARY, time_recv_integer),  # time
                 1114: (FC_BINARY, timestamp_recv_float),  # timestamp w/ tz
                 1184: (FC_BINARY, timestamptz_recv_float),
                 1186: (FC_BINARY, interval_recv_integer),
-                1231: (FC_TEXT, array_in),  # NUMERIC[]
+                1231: (FC_BINARY, array_recv),  # NUMERIC[]
                 1263: (FC_BINARY, array_recv),  # cstring[]
-                1700: (FC_TEXT, numeric_in),  # NUMERIC
+                1266: (FC_BINARY, timetz_recv_integer),  # timetz
+                1700: (FC_BINARY, numeric_recv),  # NUMERIC
                 2275: (FC_BINARY, text_recv),  # cstring
                 2950: (FC_BINARY, uuid_recv),  # uuid
                 3802: (FC_TEXT, json_in),  # jsonb
+                3807: (FC_TEXT, array_in(loads)),  # JSONB[]
             }
         )
 
@@ -1359,8 +2339,8 @@ class Connection():
             PGText: (25, FC_TEXT, text_out),  # text
             float: (701, FC_BINARY, d_pack),  # float8
             PGEnum: (705, FC_TEXT, enum_out),
-            date: (1082, FC_TEXT, date_out),  # date
-            time: (1083, FC_TEXT, time_out),  # time
+            date: (1082, FC_BINARY, date_send),  # date
+            time: (1083, FC_BINARY, time_send_integer),  # time
             1114: (1114, FC_BINARY, timestamp_send_integer),  # timestamp
             # timestamp w/ tz
             PGVarchar: (1043, FC_TEXT, text_out),  # varchar
@@ -1369,7 +2349,7 @@ class Connection():
             PGJsonb: (3802, FC_TEXT, text_out),
             Timedelta: (1186, FC_BINARY, interval_send_integer),
             Interval: (1186, FC_BINARY, interval_send_integer),
-            Decimal: (1700, FC_TEXT, numeric_out),  # Decimal
+            Decimal: (1700, FC_BINARY, numeric_send),  # Decimal
             PGTsvector: (3614, FC_TEXT, text_out),
             UUID: (2950, FC_BINARY, uuid_send),  # uuid
             bytes: (17, FC_BINARY, bytea_send),  # bytea
@@ -1388,6 +2368,10 @@ class Connection():
             int: self.inspect_int
         }
 
+        # The functions that give the parameters of the values of types that
+        # aren't keys of py_types, found by param_func()
+        self._param_funcs = {}
+
         self.message_types = {
             NOTICE_RESPONSE: self.handle_NOTICE_RESPONSE,
             AUTHENTICATION_REQUEST: self.handle_AUTHENTICATION_REQUEST,
@@ -1411,6 +2395,165 @@ class Connection():
             COPY_IN_RESPONSE: self.handle_COPY_IN_RESPONSE,
             COPY_OUT_RESPONSE: self.handle_COPY_OUT_RESPONSE}
 
+        self._cursor = self.cursor()
+        self.in_transaction = False
+        return init_params
+
+    # The exchanges of messages with the server are written as protocol
+    # generators. A protocol generator writes its messages with self._write
+    # and self._flush, and yields whenever it needs messages from the
+    # server. If it yields None the next message is sent back into it as a
+    # (code, data) tuple. If it yields a cursor, the messages up to the next
+    # ReadyForQuery are handled for that cursor, and None is sent back. The
+    # value it returns is the result of the exchange. Protocol generators are
+    # run by run_protocol(), which reads the messages from a blocking
+    # socket, and by pg8000.aio.Connection, which reads them from an asyncio
+    # stream.
+
+    def run_protocol(self, gen):
+        """Runs a protocol generator, reading the messages it asks for from
+        the socket, and returns its result.
+        """
+        try:
+            request = gen.send(None)
+            while True:
+                try:
+                    if request is None:
+                        code, start = self._next_message()
+                        msg = code, bytes(self._in_view[start:self._in_pos])
+                    else:
+                        msg = None
+                        while not self._handle_messages(request):
+                            pass
+                except BaseException as e:
+                    request = gen.throw(e)
+                else:
+                    request = gen.send(msg)
+        except StopIteration as e:
+            return e.value
+
+    def copy_out(self, cursor, operation, vals):
+        """Executes a COPY TO, yielding the data in chunks of about
+        COPY_OUT_SIZE bytes. It's a generator that runs the protocol of
+        :meth:`execute`, reading from the socket as the chunks are asked
+        for. If it's closed before the end, the rest of the data is read
+        and thrown away, so that the connection can be used again.
+        """
+        chunks = cursor.stream = CopyChunks()
+        gen = self.proto_execute(cursor, operation, vals)
+        paused = False
+        try:
+            request = gen.send(None)
+            while True:
+                msg = None
+                try:
+                    if request is None:
+                        code, start = self._next_message()
+                        msg = code, bytes(self._in_view[start:self._in_pos])
+                    else:
+                        paused = not self._handle_messages(request)
+                except BaseException as e:
+                    paused = False
+                    request = gen.throw(e)
+                    continue
+                yield from chunks
+                chunks.clear()
+                if not paused:
+                    request = gen.send(msg)
+        except StopIteration:
+            pass
+        finally:
+            if paused and self._sock is not None:
+                gen.close()
+                while not self._handle_messages(cursor):
+                    chunks.clear()
+
+    def _handle_messages(self, cursor):
+        # Handles the messages up to the next ReadyForQuery, returning True,
+        # or returns False if it stops early to hand over a batch of COPY TO
+        # data. The messages that are already in the buffer are walked
+        # through in place, and a DataRow is decoded where it is, the other
+        # messages being copied out of the buffer.
+        message_types = self.message_types
+        handle_data_row = self.handle_DATA_ROW
+        buf, view, pos, end = self._in, self._in_view, self._in_pos, \
+            self._in_end
+        code = None
+        while code != READY_FOR_QUERY:
+            if end - pos >= 5:
+                code, data_len = ci_unpack(buf, pos)
+                if end - pos > data_len:
+                    start = pos + 5
+                    self._in_pos = pos = pos + data_len + 1
+                    if code == DATA_ROW:
+                        handle_data_row(buf, cursor, start)
+                    elif code == COPY_DATA and self._copy_out is not None:
+                        copy_out = self._copy_out
+                        copy_out += view[start:pos]
+                        if len(copy_out) >= COPY_OUT_SIZE:
+                            self.write_copy_out(cursor)
+                            return False
+                    else:
+                        message_types[code](bytes(view[start:pos]), cursor)
+                    continue
+                code = None
+                needed = data_len + 1
+            else:
+                needed = 5
+
+            self._receive(needed)
+            buf, view, pos, end = self._in, self._in_view, self._in_pos, \
+                self._in_end
+        return True
+
+    def _next_message(self):
+        # Returns the code of the next message and the position of its data
+        # in the buffer, which ends at _in_pos.
+        pos = self._in_pos
+        if self._in_end - pos < 5:
+            self._receive(5)
+            pos = self._in_pos
+        code, data_len = ci_unpack(self._in, pos)
+        if self._in_end - pos <= data_len:
+            self._receive(data_len + 1)
+            pos = self._in_pos
+        self._in_pos = pos + data_len + 1
+        return code, pos + 5
+
+    def _receive(self, needed):
+        # Reads from the socket until there are at least the number of bytes
+        # needed after _in_pos. If they don't fit after _in_pos, the unread
+        # bytes are moved to the start of the buffer first.
+        pos, end = self._in_pos, self._in_end
+        if pos + needed > len(self._in):
+            unread = self._in_view[pos:end].tobytes()
+            if needed > len(self._in) or len(self._in) > RECEIVE_SIZE:
+                self._in = bytearray(max(needed, RECEIVE_SIZE))
+                self._in_view = memoryview(self._in)
+            pos, end = 0, len(unread)
+            self._in[:end] = unread
+            self._in_pos, self._in_end = pos, end
+
+        while end - pos < needed:
+            try:
+                received = self._sock.recv_into(self._in_view[end:])
+            except AttributeError:
+                raise InterfaceError("connection is closed")
+            if received == 0:
+                raise socket.error("the server closed the connection")
+            end += received
+            self._in_end = end
+
+    def _flush(self):
+        # Sends the messages that have been written, in a single call.
+        if self._sock is None:
+            raise InterfaceError("connection is closed")
+        try:
+            self._usock.sendall(self._out)
+        finally:
+            self._out.clear()
+
+    def proto_startup(self, init_params):
         # Int32 - Message length, including self.
         # Int32(196608) - Protocol version number.  Version 3.0.
         # Any number of key/value pairs, terminated by a zero byte:
@@ -1426,17 +2569,14 @@ class Connection():
         self._write(val)
         self._flush()
 
-        self._cursor = self.cursor()
         code = self.error = None
         while code not in (READY_FOR_QUERY, ERROR_RESPONSE):
-            code, data_len = ci_unpack(self._read(5))
-            self.message_types[code](self._read(data_len - 4), None)
+            code, data = yield
+            self.message_types[code](data, None)
         if self.error is not None:
             raise self.error
 
-        self.in_transaction = False
-
-    def handle_ERROR_RESPONSE(self, data, ps):
+    def handle_ERROR_RESPONSE(self, data, cursor):
         msg = dict(
             (
                 s[:1].decode(self._client_encoding),
@@ -1451,7 +2591,25 @@ class Connection():
         else:
             cls = ProgrammingError
 
-        self.error = cls(msg)
+        if response_code == '0A000' and (
+                msg.get(RESPONSE_ROUTINE) == 'RevalidateCachedQuery' or
+                msg[RESPONSE_MSG] ==
+                'cached plan must not change result type') and \
+                cursor is not None and cursor.ps is not None:
+            # The result columns of a prepared statement have changed, so
+            # it has to be prepared again.
+            self.discard_ps(cursor.ps)
+            cursor.ps['generation'] = None
+
+        if self._copy_out is not None:
+            # The data received before the error is still written
+            self.write_copy_out(cursor)
+            self._copy_out = None
+
+        if self._copy_in_error is None:
+            self.error = cls(msg)
+        else:
+            self.error, self._copy_in_error = self._copy_in_error, None
 
     def handle_EMPTY_QUERY_RESPONSE(self, data, ps):
         self.error = ProgrammingError("query was empty")
@@ -1468,7 +2626,10 @@ class Connection():
         pass
 
     def handle_PORTAL_SUSPENDED(self, data, cursor):
-        pass
+        # The portal returned as many rows as were asked for
+        cursor._portal_suspended = True
+        cursor._portal_row_count += cursor._portal_max_rows
+        self._suspended_cursors.add(cursor)
 
     def handle_PARAMETER_DESCRIPTION(self, data, ps):
         # Well, we don't really care -- we're going to send whatever we
@@ -1480,6 +2641,9 @@ class Connection():
 
     def handle_COPY_DONE(self, data, ps):
         self._copy_done = True
+        if self._copy_out is not None:
+            self.write_copy_out(ps)
+            self._copy_out = None
 
     def handle_COPY_OUT_RESPONSE(self, data, ps):
         # Int8(1) - 0 textual, 1 binary
@@ -1492,9 +2656,21 @@ class Connection():
             raise InterfaceError(
                 "An output stream is required for the COPY OUT response.")
 
+        # The data is written to the stream in batches, apart from the rows
+        # of a binary COPY TO that are decoded by copy_out_records(), which
+        # come one to a message.
+        if not isinstance(ps.stream, CopyRowsWriter):
+            self._copy_out = bytearray()
+
     def handle_COPY_DATA(self, data, ps):
         ps.stream.write(data)
 
+    def write_copy_out(self, ps):
+        # Writes the COPY TO data that's been gathered to the stream
+        if len(self._copy_out) > 0:
+            ps.stream.write(bytes(self._copy_out))
+            self._copy_out.clear()
+
     def handle_COPY_IN_RESPONSE(self, data, ps):
         # Int16(2) - Number of columns
         # Int16(N) - Format codes for each column (0 text, 1 binary)
@@ -1504,14 +2680,16 @@ class Connection():
             raise InterfaceError(
                 "An input stream is required for the COPY IN response.")
 
-        bffr = bytearray(8192)
-        while True:
-            bytes_read = ps.stream.readinto(bffr)
-            if bytes_read == 0:
-                break
-            self._write(COPY_DATA + i_pack(bytes_read + 4))
-            self._write(bffr[:bytes_read])
-            self._flush()
+        size = copy_file_size(ps.stream)
+        if size is not None:
+            self.send_copy_file(ps.stream, size)
+        else:
+            try:
+                for _ in self.write_copy_data(ps.stream):
+                    self._flush()
+            except Exception as e:
+                self.send_COPY_FAIL(e)
+                return
 
         # Send CopyDone
         # Byte1('c') - Identifier.
@@ -1520,6 +2698,64 @@ class Connection():
         self._write(SYNC_MSG)
         self._flush()
 
+    def write_copy_data(self, stream):
+        # Reads the stream into CopyData messages, yielding each time enough
+        # has been written to be worth sending.
+        #
+        # Byte1('d') - Identifies the message as COPY data.
+        # Int32 - Message length, including self.
+        # Byten - Data that forms part of a COPY data stream.
+        size = COPY_IN_SIZE
+        view = memoryview(bytearray(COPY_IN_MAX_SIZE))
+        out, write = self._out, self._write
+        while True:
+            bytes_read = stream.readinto(view[:size])
+            if not bytes_read:
+                break
+            write(COPY_DATA + i_pack(bytes_read + 4))
+            write(view[:bytes_read])
+            if bytes_read == size and size < COPY_IN_MAX_SIZE:
+                size *= 2
+            if len(out) >= COPY_IN_MAX_SIZE:
+                yield
+        if len(out) > 0:
+            yield
+
+    def send_copy_file(self, stream, size):
+        # Sends the rest of a file as CopyData messages, the contents going
+        # from the file to the socket with sendfile(). It falls back to
+        # reading and sending for an SSL socket.
+        offset = stream.tell()
+        while size > 0:
+            length = min(size, COPY_SENDFILE_SIZE)
+            self._write(COPY_DATA + i_pack(length + 4))
+            self._flush()
+            try:
+                sent = self._usock.sendfile(stream, offset, length)
+                if sent != length:
+                    raise InterfaceError(
+                        "the file for the COPY changed while it was sent")
+            except BaseException:
+                # The message can't be finished, so the connection is lost
+                self._usock.close()
+                self._sock = None
+                raise
+            offset += length
+            size -= length
+
+    def send_COPY_FAIL(self, e):
+        # Byte1('f') - Identifies the message as a COPY-failure indicator.
+        # Int32 - Message length, including self.
+        # String - An error message to report as the cause of failure.
+        #
+        # The server responds with an error, and the exception is raised in
+        # its place.
+        self._copy_in_error = e
+        self._send_message(
+            COPY_FAIL, str(e).encode(self._client_encoding) + NULL_BYTE)
+        self._write(SYNC_MSG)
+        self._flush()
+
     def handle_NOTIFICATION_RESPONSE(self, data, ps):
         ##
         # A message sent if this connection receives a NOTIFY that it was
@@ -1538,20 +2774,24 @@ class Connection():
 
         self.notifications.append((backend_pid, condition))
 
-    def cursor(self):
+    def cursor(self, fetch_size=None):
         """Creates a :class:`Cursor` object bound to this
         connection.
 
         This function is part of the `DBAPI 2.0 specification
         <http://www.python.org/dev/peps/pep-0249/>`_.
+
+        :param fetch_size: The initial value of the :attr:`Cursor.fetch_size`
+            attribute of the cursor. This parameter is a pg8000 extension.
         """
-        return Cursor(self)
+        return Cursor(self, fetch_size=fetch_size)
 
     @property
     def description(self):
         return self._run_cursor._getDescription()
 
     def run(self, sql, stream=None, **params):
+        self._run_cursor.row_factory = self.row_factory
         self._run_cursor.execute(sql, params, stream=stream)
         return tuple(self._run_cursor._cached_rows)
 
@@ -1584,11 +2824,6 @@ class Connection():
             # Int32(4) - Message length, including self.
             self._write(TERMINATE_MSG)
             self._flush()
-            self._sock.close()
-        except AttributeError:
-            raise InterfaceError("connection is closed")
-        except ValueError:
-            raise InterfaceError("connection is closed")
         except socket.error:
             pass
         finally:
@@ -1686,6 +2921,13 @@ class Connection():
         # Byte1 -   Status indicator.
         self.in_transaction = data != IDLE
 
+        # The server closes the portals at the end of a transaction, so the
+        # cursors reading from them have no more rows.
+        if not self.in_transaction and len(self._suspended_cursors) > 0:
+            for cursor in self._suspended_cursors:
+                cursor._portal_suspended = False
+            self._suspended_cursors.clear()
+
     def handle_BACKEND_KEY_DATA(self, data, ps):
         self._backend_key_data = data
 
@@ -1705,42 +2947,39 @@ class Connection():
         return self.py_types[Decimal]
 
     def make_params(self, values):
+        py_types, param_funcs = self.py_types, self._param_funcs
         params = []
         for value in values:
             typ = type(value)
-            try:
-                params.append(self.py_types[typ])
-            except KeyError:
-                try:
-                    params.append(self.inspect_funcs[typ](value))
-                except KeyError as e:
-                    param = None
-                    for k, v in self.py_types.items():
-                        try:
-                            if isinstance(value, k):
-                                param = v
-                                break
-                        except TypeError:
-                            pass
+            param = py_types.get(typ)
+            if param is None:
+                func = param_funcs.get(typ)
+                if func is None:
+                    func = param_funcs[typ] = self.param_func(typ)
+                param = func(value)
+            params.append(param)
+        return tuple(params)
 
-                    if param is None:
-                        for k, v in self.inspect_funcs.items():
-                            try:
-                                if isinstance(value, k):
-                                    param = v(value)
-                                    break
-                            except TypeError:
-                                pass
-                            except KeyError:
-                                pass
-
-                    if param is None:
-                        raise NotSupportedError(
-                            "type " + str(e) + " not mapped to pg type")
-                    else:
-                        params.append(param)
+    def param_func(self, typ):
+        # Returns the function that gives the parameter of a value of a type
+        # that isn't a key of py_types. It's an inspect function, or, for a
+        # subclass of a type in py_types or inspect_funcs, the function for
+        # that type. The parameter is looked up in py_types when it's needed,
+        # so that it can still be changed.
+        try:
+            return self.inspect_funcs[typ]
+        except KeyError:
+            pass
 
-        return tuple(params)
+        for k in self.py_types:
+            if isinstance(k, type) and issubclass(typ, k):
+                return lambda value: self.py_types[k]
+
+        for k, func in self.inspect_funcs.items():
+            if issubclass(typ, k):
+                return func
+
+        raise NotSupportedError("type " + str(typ) + " not mapped to pg type")
 
     def handle_ROW_DESCRIPTION(self, data, cursor):
         count = h_unpack(data)[0]
@@ -1758,136 +2997,695 @@ class Connection():
             field['pg8000_fc'], field['func'] = \
                 self.pg_types[field['type_oid']]
 
-    def execute(self, cursor, operation, vals):
-        if vals is None:
-            vals = ()
-
-        pid = getpid()
+    def get_cache(self, paramstyle, pid):
         try:
-            cache = self._caches[cursor.paramstyle][pid]
+            return self._caches[paramstyle][pid]
         except KeyError:
             try:
-                param_cache = self._caches[cursor.paramstyle]
+                param_cache = self._caches[paramstyle]
             except KeyError:
-                param_cache = self._caches[cursor.paramstyle] = {}
+                param_cache = self._caches[paramstyle] = {}
 
             try:
-                cache = param_cache[pid]
+                return param_cache[pid]
             except KeyError:
-                cache = param_cache[pid] = {'statement': {}, 'ps': {}}
+                cache = param_cache[pid] = {'ps': OrderedDict()}
+                return cache
+
+    def lookup_ps(self, paramstyle, operation, vals):
+        """Finds the prepared statement for an operation and its arguments.
+        Returns the prepared statement and the arguments in the order of the
+        parameters. If the operation hasn't been prepared yet, a new prepared
+        statement is added to the cache and returned, but it isn't sent to the
+        server.
+        """
+        if vals is None:
+            vals = ()
 
-        try:
-            statement, make_args = cache['statement'][operation]
-        except KeyError:
-            statement, make_args = cache['statement'][operation] = \
-                convert_paramstyle(cursor.paramstyle, operation)
+        pid = getpid()
+        cache = self.get_cache(paramstyle, pid)
 
+        statement, make_args = paramstyle_cache(paramstyle, operation)
         args = make_args(vals)
         params = self.make_params(args)
         key = operation, params
 
+        cache_ps = cache['ps']
         try:
-            ps = cache['ps'][key]
-            cursor.ps = ps
+            ps = cache_ps[key]
         except KeyError:
-            statement_nums = [0]
-            for style_cache in self._caches.values():
-                try:
-                    pid_cache = style_cache[pid]
-                    for csh in pid_cache['ps'].values():
-                        statement_nums.append(csh['statement_num'])
-                except KeyError:
-                    pass
-
-            statement_num = sorted(statement_nums)[-1] + 1
-            statement_name = '_'.join(
-                ("pg8000", "statement", str(pid), str(statement_num)))
-            statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
-            ps = {
-                'statement_name_bin': statement_name_bin,
-                'pid': pid,
-                'statement_num': statement_num,
-                'row_desc': [],
-                'param_funcs': tuple(x[2] for x in params)}
-            cursor.ps = ps
-
-            param_fcs = tuple(x[1] for x in params)
-
-            # Byte1('P') - Identifies the message as a Parse command.
-            # Int32 -   Message length, including self.
-            # String -  Prepared statement name. An empty string selects the
-            #           unnamed prepared statement.
-            # String -  The query string.
-            # Int16 -   Number of parameter data types specified (can be zero).
-            # For each parameter:
-            #   Int32 - The OID of the parameter data type.
-            val = bytearray(statement_name_bin)
-            val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
-            val.extend(h_pack(len(params)))
-            for oid, fc, send_func in params:
-                # Parse message doesn't seem to handle the -1 type_oid for NULL
-                # values that other messages handle.  So we'll provide type_oid
-                # 705, the PG "unknown" type.
-                val.extend(i_pack(705 if oid == -1 else oid))
-
-            # Byte1('D') - Identifies the message as a describe command.
-            # Int32 - Message length, including self.
-            # Byte1 - 'S' for prepared statement, 'P' for portal.
-            # String - The name of the item to describe.
-            self._send_message(PARSE, val)
-            self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
+            self._cache_misses += 1
+        else:
+            if ps['generation'] == self._statement_generation or \
+                    len(ps['row_desc']) == 0:
+                # The cache is kept in order of use, least recently used first
+                cache_ps.move_to_end(key)
+                self._cache_hits += 1
+                return ps, args
+            else:
+                # The statement returns rows, and was prepared before a
+                # statement that may have changed its result columns.
+                self.discard_ps(ps)
+                self._cache_misses += 1
+
+        # The numbers of closed statements are used again before new ones
+        try:
+            statement_num = self._free_statement_nums.pop()
+        except IndexError:
+            statement_num = next(self._statement_nums)
+        statement_name = '_'.join(
+            ("pg8000", "statement", str(pid), str(statement_num)))
+        statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
+        ps = {
+            'statement_name_bin': statement_name_bin,
+            'pid': pid,
+            'statement_num': statement_num,
+            'statement': statement,
+            'cache': cache,
+            'key': key,
+            'params': params,
+            'row_desc': [],
+            'row_makers': {},
+            'generation': self._statement_generation,
+            'param_funcs': tuple(x[2] for x in params)}
+
+        # The statement is cached straight away so that it isn't prepared
+        # twice by a pipeline. Until it's been prepared it doesn't have any
+        # 'input_funcs'.
+        cache_ps[key] = ps
+        return ps, args
+
+    def send_PARSE(self, ps):
+        params = ps['params']
+
+        # Byte1('P') - Identifies the message as a Parse command.
+        # Int32 -   Message length, including self.
+        # String -  Prepared statement name. An empty string selects the
+        #           unnamed prepared statement.
+        # String -  The query string.
+        # Int16 -   Number of parameter data types specified (can be zero).
+        # For each parameter:
+        #   Int32 - The OID of the parameter data type.
+        val = bytearray(ps['statement_name_bin'])
+        val.extend(ps['statement'].encode(self._client_encoding) + NULL_BYTE)
+        val.extend(h_pack(len(params)))
+        for oid, fc, send_func in params:
+            # Parse message doesn't seem to handle the -1 type_oid for NULL
+            # values that other messages handle.  So we'll provide type_oid
+            # 705, the PG "unknown" type.
+            val.extend(i_pack(705 if oid == -1 else oid))
+
+        # Byte1('D') - Identifies the message as a describe command.
+        # Int32 - Message length, including self.
+        # Byte1 - 'S' for prepared statement, 'P' for portal.
+        # String - The name of the item to describe.
+        self._send_message(PARSE, val)
+        self._send_message(DESCRIBE, STATEMENT + ps['statement_name_bin'])
+
+    def prepared(self, ps):
+        """Called when the description of a newly prepared statement has been
+        received from the server.
+        """
+        params = ps['params']
+        param_fcs = tuple(x[1] for x in params)
+
+        # We've got row_desc that allows us to identify what we're
+        # going to get back from this statement.
+        output_fc = tuple(
+            self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
+
+        ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
+        ps['decode_row'] = make_row_decoder(ps['input_funcs'])
+        # Byte1('B') - Identifies the Bind command.
+        # Int32 - Message length, including self.
+        # String - Name of the destination portal.
+        # String - Name of the source prepared statement.
+        # Int16 - Number of parameter format codes.
+        # For each parameter format code:
+        #   Int16 - The parameter format code.
+        # Int16 - Number of parameter values.
+        # For each parameter value:
+        #   Int32 - The length of the parameter value, in bytes, not
+        #           including this length.  -1 indicates a NULL parameter
+        #           value, in which no value bytes follow.
+        #   Byte[n] - Value of the parameter.
+        # Int16 - The number of result-column format codes.
+        # For each result-column format code:
+        #   Int16 - The format code.
+        ps['bind_1'] = ps['statement_name_bin'] + h_pack(len(params)) + \
+            pack("!" + "h" * len(param_fcs), *param_fcs) + \
+            h_pack(len(params))
+
+        ps['bind_2'] = h_pack(len(output_fc)) + \
+            pack("!" + "h" * len(output_fc), *output_fc)
+
+        ps['bind'] = self.compile_bind(ps)
+
+    def uncache_ps(self, ps):
+        cache_ps = ps['cache']['ps']
+        if cache_ps.get(ps['key']) is ps:
+            del cache_ps[ps['key']]
+
+    def discard_ps(self, ps):
+        # Removes a prepared statement from the cache, closing it at the start
+        # of the next request.
+        cache_ps = ps['cache']['ps']
+        if cache_ps.get(ps['key']) is ps:
+            del cache_ps[ps['key']]
+            self._pending_closes.append(ps)
+
+    def trim_cache(self, cache, keep):
+        # Evicts the least recently used statements, apart from those in
+        # keep, until the cache is back down to max_prepared_statements. The
+        # statements are closed at the start of the next request.
+        cache_ps = cache['ps']
+        excess = len(cache_ps) - self.max_prepared_statements
+        if excess > 0:
+            for key in list(islice(cache_ps, excess + len(keep))):
+                p = cache_ps[key]
+                if all(p is not k for k in keep):
+                    del cache_ps[key]
+                    self._pending_closes.append(p)
+                    self._cache_evictions += 1
+                    excess -= 1
+                    if excess == 0:
+                        break
+
+    def send_pending_closes(self):
+        # Byte1('C') - Identifies the message as a close command.
+        # Int32 - Message length, including self.
+        # Byte1 - 'S' for prepared statement, 'P' for portal.
+        # String - The name of the item to close.
+        #
+        # Once the Close has been written the number of the statement can be
+        # used again, since the server will have closed it before it gets the
+        # Parse of any later statement.
+        for ps in self._pending_closes:
+            self._send_message(CLOSE, STATEMENT + ps['statement_name_bin'])
+            self._free_statement_nums.append(ps['statement_num'])
+        self._pending_closes.clear()
+
+    def statement_cache_info(self):
+        """Returns the statistics of the prepared statement cache, as a named
+        tuple of hits, misses, evictions, maxsize and currsize. The maxsize
+        is the max_prepared_statements of the connection, and the currsize
+        is the number of statements in the cache.
+
+        This method is a pg8000 extension.
+        """
+        return StatementCacheInfo(
+            self._cache_hits, self._cache_misses, self._cache_evictions,
+            self.max_prepared_statements, sum(
+                len(pcache['ps']) for scache in self._caches.values()
+                for pcache in scache.values()))
+
+    def proto_prepare(self, cursor, ps):
+        # Prepares a statement that isn't in the cache yet
+        try:
+            self.send_PARSE(ps)
             self._write(SYNC_MSG)
+            self._flush()
+            yield from self.proto_messages(cursor)
+        except BaseException:
+            self.uncache_ps(ps)
+            self._pending_closes.append(ps)
+            raise
+        self.prepared(ps)
+        self.trim_cache(ps['cache'], (ps,))
+
+    def describe(self, cursor, operation):
+        """Returns the prepared statement of an operation without executing
+        it, preparing it first if it isn't in the cache.
+        """
+        return self.run_protocol(self.proto_describe(cursor, operation))
+
+    def proto_describe(self, cursor, operation):
+        ps, args = self.lookup_ps(cursor.paramstyle, operation, None)
+        cursor.ps = ps
+        if 'input_funcs' not in ps:
+            self.send_pending_closes()
+            yield from self.proto_prepare(cursor, ps)
+        return ps
+
+    def find_enum_oids(self, row_desc):
+        """Returns the oids of the enum types of the columns of a row
+        description, which need a query to find.
+        """
+        return self.run_protocol(self.proto_find_enum_oids(row_desc))
+
+    def proto_find_enum_oids(self, row_desc):
+        oids = copy_user_oids(row_desc)
+        if len(oids) == 0:
+            return ()
+        yield from self.proto_execute(
+            self._cursor, enum_oids_query(oids), None)
+        return [row[0] for row in self._cursor._cached_rows]
+
+    def make_copy_sends(self, row_desc, enum_oids=()):
+        """Returns a function for each column of a row description, that
+        encodes a value as a field of the binary COPY format, which is the
+        length of the value followed by the value in the binary format of
+        the type of the column. The enum_oids are the oids of the enum types
+        among the columns, as given by :meth:`find_enum_oids`.
+
+        Raises NotSupportedError for a type that pg8000 can't send in the
+        binary format, rather than send its text, which the server would
+        either reject or misread.
+        """
+        sends = dict(
+            (oid, send) for oid, fc, send in self.py_types.values()
+            if fc == FC_BINARY)
+
+        def text_send(v):
+            if isinstance(v, enum.Enum):
+                v = v.value
+            return str(v).encode(self._client_encoding)
+
+        def json_send(v):
+            if not isinstance(v, str):
+                v = dumps(v)
+            return v.encode(self._client_encoding)
+
+        def jsonb_send(v):
+            return b'\x01' + json_send(v)
+
+        sends[26] = I_pack  # oid
+        sends[114] = json_send  # json
+        sends[3802] = jsonb_send  # jsonb
+        text_oids = set(COPY_TEXT_OIDS)
+        text_oids.update(enum_oids)
+        for oid in text_oids:
+            sends[oid] = text_send
+
+        def get_send(oid):
+            try:
+                return sends[oid]
+            except KeyError:
+                raise NotSupportedError(
+                    "values of the type with oid " + str(oid) + " can't be "
+                    "copied in the binary format")
+
+        def array_send(oid, send):
+            def send_array(arr):
+                array_check_dimensions(arr)
+                dim_lengths = array_dim_lengths(arr)
+                data = bytearray(
+                    iii_pack(len(dim_lengths), array_has_null(arr), oid))
+                for i in dim_lengths:
+                    data.extend(ii_pack(i, 1))
+                for v in array_flatten(arr):
+                    if v is None:
+                        data.extend(NULL)
+                    else:
+                        val = send(v)
+                        data.extend(i_pack(len(val)))
+                        data.extend(val)
+                return data
+            return send_array
+
+        def field(send):
+            def send_field(v):
+                val = send(v)
+                return i_pack(len(val)) + val
+            return send_field
+
+        def text_field(v):
+            try:
+                val = v.encode(self._client_encoding)
+            except AttributeError:
+                val = text_send(v)
+            return i_pack(len(val)) + val
+
+        fields = []
+        for f in row_desc:
+            oid = f['type_oid']
+            elem_oid = pg_array_elements.get(oid)
+            if oid in COPY_FIXED_FORMATS:
+                # The length and the value are packed together
+                fmt = COPY_FIXED_FORMATS[oid]
+                fields.append(
+                    partial(Struct('!i' + fmt).pack, calcsize('!' + fmt)))
+            elif elem_oid is not None:
+                fields.append(field(array_send(elem_oid, get_send(elem_oid))))
+            elif oid in text_oids:
+                fields.append(text_field)
+            else:
+                fields.append(field(get_send(oid)))
+        return fields
+
+    def make_copy_out(self, ps, source, columns, cursor):
+        """Returns the SQL of a binary COPY TO of the columns described by a
+        prepared statement, and a :class:`CopyRowsWriter` that decodes the
+        rows for a cursor.
+
+        The values of the types with a receive function for the binary
+        format are decoded from that. The types that are received as text
+        are cast to text in the COPY, since the binary format of text is the
+        text, apart from the few that can be decoded from their binary
+        format.
+        """
+        def uint4_recv(data, offset, length):
+            return I_unpack(data, offset)[0]
 
+        def jsonb_recv(data, offset, length):
+            # A version number followed by the text
+            return loads(
+                str(
+                    data[offset + 1:offset + length],
+                    self._client_encoding))
+
+        def inet_recv(data, offset, length):
+            # The family, bits, whether it's a cidr and the address length,
+            # followed by the address
+            bits, nb = BxB_unpack(data, offset + 1)
+            address = ip_address(bytes(data[offset + 4:offset + 4 + nb]))
+            if bits == nb * 8:
+                return address
+            else:
+                return ip_network((address, bits), False)
+
+        binary_recvs = {
+            26: uint4_recv,  # oid
+            28: uint4_recv,  # xid
+            869: inet_recv,  # inet
+            3802: jsonb_recv,  # jsonb
+        }
+
+        funcs = []
+        casts = []
+        for f in ps['row_desc']:
+            oid = f['type_oid']
+            fc, func = self.pg_types[oid]
+            if fc == FC_BINARY:
+                funcs.append(func)
+            elif oid in binary_recvs:
+                funcs.append(binary_recvs[oid])
+            else:
+                funcs.append(func)
+                casts.append(len(funcs) - 1)
+
+        source = source.strip()
+        if len(casts) > 0:
+            names = ['c' + str(i) for i in range(len(funcs))]
+            source = "(SELECT " + ', '.join(
+                n + '::text' if i in casts else n
+                for i, n in enumerate(names)) + \
+                " FROM (" + copy_out_query(source, columns) + \
+                ") AS pg8000_copy (" + ', '.join(names) + "))"
+        elif columns is not None and not source.startswith('('):
+            source += " (" + ', '.join(columns) + ")"
+
+        out_ps = dict(
+            ps, input_funcs=tuple(funcs), decode_row=make_row_decoder(funcs),
+            row_makers={})
+        return "COPY " + source + " TO STDOUT WITH (FORMAT binary)", \
+            CopyRowsWriter(self, out_ps, cursor)
+
+    def execute(self, cursor, operation, vals):
+        return self.run_protocol(self.proto_execute(cursor, operation, vals))
+
+    def proto_execute(self, cursor, operation, vals):
+        ps, args = self.lookup_ps(cursor.paramstyle, operation, vals)
+        cursor.ps = ps
+        self.send_pending_closes()
+
+        cached = 'input_funcs' in ps
+        if not cached:
+            yield from self.proto_prepare(cursor, ps)
+
+        # A cursor with a fetch_size reads its rows in batches from a named
+        # portal. The portal only lasts until the end of the transaction, so
+        # outside a transaction all the rows are read in one go.
+        if cursor.fetch_size is not None and self.in_transaction:
+            if cursor._portal_name_bin is None:
+                cursor._portal_name_bin = '_'.join(
+                    (
+                        "pg8000", "portal", str(ps['pid']),
+                        str(next(self._portal_nums)))
+                    ).encode('ascii') + NULL_BYTE
+            portal_name_bin = cursor._portal_name_bin
+        else:
+            portal_name_bin = NULL_BYTE
+
+        bind_data = ps['bind'](args, portal_name_bin)
+
+        if portal_name_bin != NULL_BYTE:
+            # Close any portal left over from the last execution of this
+            # cursor, so that the name can be bound again.
+            self._send_message(CLOSE, PORTAL + portal_name_bin)
+
+        self.reset_cursor(cursor, ps)
+        self._send_message(BIND, bind_data)
+        self.send_EXECUTE(cursor, portal_name_bin)
+        self._write(SYNC_MSG)
+        self._flush()
+        try:
+            yield from self.proto_messages(cursor)
+        except ProgrammingError:
+            # If the result columns of a cached statement have changed it's
+            # discarded by handle_ERROR_RESPONSE. The error comes from the
+            # Bind, so outside a transaction block the operation can be
+            # retried with the statement prepared again.
+            if cached and ps['generation'] is None and \
+                    not self.in_transaction:
+                yield from self.proto_execute(cursor, operation, vals)
+            else:
+                raise
+
+    def execute_pipeline(self, items, sync_each=False):
+        """Executes a sequence of (cursor, operation, vals) items with a
+        single flush. With sync_each a Sync follows each statement, otherwise
+        a single Sync follows the last statement, so that an error stops the
+        execution of the rest of the statements.
+        """
+        return self.run_protocol(self.proto_execute_pipeline(items, sync_each))
+
+    def proto_execute_pipeline(self, items, sync_each):
+        items = list(items)
+        if not self.in_transaction and not self.autocommit:
+            items.insert(0, (self._cursor, "begin transaction", None))
+
+        statements = []
+        new_pss = {}
+        for cursor, operation, vals in items:
+            ps, args = self.lookup_ps(cursor.paramstyle, operation, vals)
+            if 'input_funcs' not in ps:
+                new_pss[id(ps)] = ps
+            statements.append((ps, args))
+
+        self.send_pending_closes()
+        if len(new_pss) > 0:
             try:
+                for ps in new_pss.values():
+                    self.send_PARSE(ps)
+                self._write(SYNC_MSG)
                 self._flush()
-            except AttributeError as e:
-                if self._sock is None:
-                    raise InterfaceError("connection is closed")
-                else:
-                    raise e
+                yield from self.proto_describe_messages(new_pss.values())
+            except BaseException:
+                # Some of the statements may have been prepared
+                for ps in new_pss.values():
+                    self.uncache_ps(ps)
+                    self._pending_closes.append(ps)
+                raise
+            for ps in new_pss.values():
+                self.prepared(ps)
+
+        binds = [ps['bind'](args) for ps, args in statements]
+
+        for (cursor, _, _), (ps, _), bind_data in zip(
+                items, statements, binds):
+            self.reset_cursor(cursor, ps)
+            self._send_message(BIND, bind_data)
+            self.send_EXECUTE(cursor)
+            if sync_each:
+                self._write(SYNC_MSG)
+        if not sync_each:
+            self._write(SYNC_MSG)
+        self._flush()
+
+        try:
+            yield from self.proto_pipeline_messages(
+                [item[0] for item in items], sync_each)
+        finally:
+            for ps in new_pss.values():
+                self.trim_cache(ps['cache'], [s[0] for s in statements])
+
+    def executemany(self, cursor, operation, param_sets):
+        """Executes an operation once for each of the parameter sets. The
+        Bind and Execute messages are sent in batches of
+        EXECUTEMANY_BATCH_SIZE, or EXECUTEMANY_BATCH_BYTES, the responses to
+        each batch being read before the next batch is sent, and a single
+        Sync follows the last execution.
+        """
+        return self.run_protocol(
+            self.proto_executemany(cursor, operation, param_sets))
+
+    def proto_executemany(self, cursor, operation, param_sets):
+        self.reset_cursor(cursor, None)
+        in_flight = deque()
+        new_pss = []
+        self.error = None
+        self.send_pending_closes()
+        executed = False
+        try:
+            for vals in param_sets:
+                ps, args = self.lookup_ps(cursor.paramstyle, operation, vals)
+                if 'input_funcs' not in ps:
+                    # The description is needed before the statement can be
+                    # bound. A Sync would end an implicit transaction, so
+                    # the server is asked for the responses with a Flush.
+                    new_pss.append(ps)
+                    self.send_PARSE(ps)
+                    in_flight.append(ps)
+                    self._write(FLUSH_MSG)
+                    self._flush()
+                    yield from self.proto_executemany_messages(
+                        cursor, in_flight)
+                    if self.error is not None:
+                        break
+
+                bind_data = ps['bind'](args)
+                self._send_message(BIND, bind_data)
+                self.send_EXECUTE(cursor)
+                in_flight.append(ps)
+                executed = True
+
+                if len(in_flight) >= EXECUTEMANY_BATCH_SIZE or \
+                        len(self._out) >= EXECUTEMANY_BATCH_BYTES:
+                    self._write(FLUSH_MSG)
+                    self._flush()
+                    yield from self.proto_executemany_messages(
+                        cursor, in_flight)
+                    if self.error is not None:
+                        break
+        except BaseException:
+            # An error on the client, such as a parameter that can't be sent.
+            # The executions that have been sent are in the same implicit
+            # transaction (or transaction block) as the Sync that follows,
+            # which would commit them. So an Execute of a portal that
+            # doesn't exist is sent before the Sync. The server answers it
+            # with an ErrorResponse (34000), which rolls back the implicit
+            # transaction, or fails the transaction block, and the Sync only
+            # ends the failed transaction. The server's error is read, and
+            # left in self.error, by the finally block, and the client's
+            # error is the one raised.
+            if executed:
+                self._send_message(EXECUTE, ABORT_PORTAL + i_pack(0))
+            raise
+        finally:
+            # After an error the server skips everything up to the Sync
+            self._write(SYNC_MSG)
+            self._flush()
+            yield from self.proto_executemany_messages(
+                cursor, in_flight, True)
 
-            self.handle_messages(cursor)
-
-            # We've got row_desc that allows us to identify what we're
-            # going to get back from this statement.
-            output_fc = tuple(
-                self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
-
-            ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
-            # Byte1('B') - Identifies the Bind command.
-            # Int32 - Message length, including self.
-            # String - Name of the destination portal.
-            # String - Name of the source prepared statement.
-            # Int16 - Number of parameter format codes.
-            # For each parameter format code:
-            #   Int16 - The parameter format code.
-            # Int16 - Number of parameter values.
-            # For each parameter value:
-            #   Int32 - The length of the parameter value, in bytes, not
-            #           including this length.  -1 indicates a NULL parameter
-            #           value, in which no value bytes follow.
-            #   Byte[n] - Value of the parameter.
-            # Int16 - The number of result-column format codes.
-            # For each result-column format code:
-            #   Int16 - The format code.
-            ps['bind_1'] = NULL_BYTE + statement_name_bin + \
-                h_pack(len(params)) + \
-                pack("!" + "h" * len(param_fcs), *param_fcs) + \
-                h_pack(len(params))
-
-            ps['bind_2'] = h_pack(len(output_fc)) + \
-                pack("!" + "h" * len(output_fc), *output_fc)
-
-            if len(cache['ps']) > self.max_prepared_statements:
-                for p in cache['ps'].values():
-                    self.close_prepared_statement(p['statement_name_bin'])
-                cache['ps'].clear()
-
-            cache['ps'][key] = ps
+            for ps in new_pss:
+                if 'input_funcs' not in ps:
+                    self.uncache_ps(ps)
+                    self._pending_closes.append(ps)
 
+        if cursor.ps is None:
+            cursor._row_count = 0
+
+        if len(new_pss) > 0:
+            self.trim_cache(new_pss[0]['cache'], new_pss)
+
+        if self.error is not None:
+            raise self.error
+
+    def proto_executemany_messages(self, cursor, in_flight, sync=False):
+        # Reads the responses to the Describes and Executes in flight. The
+        # responses to a Describe end with a RowDescription or a NoData, and
+        # those to an Execute with a CommandComplete or an
+        # EmptyQueryResponse. After an ErrorResponse the rest are skipped.
+        code = None
+        while code != READY_FOR_QUERY if sync else len(in_flight) > 0:
+            if len(in_flight) > 0:
+                cursor.ps = in_flight[0]
+            code, data = yield
+            if code == BIND_COMPLETE:
+                # Only the rows of the last execution are kept, as if each
+                # had been run with execute()
+                cursor._cached_rows.clear()
+            self.message_types[code](data, cursor)
+            if code in (ROW_DESCRIPTION, NO_DATA):
+                self.prepared(in_flight.popleft())
+            elif code in (COMMAND_COMPLETE, EMPTY_QUERY_RESPONSE):
+                in_flight.popleft()
+            elif code == ERROR_RESPONSE:
+                in_flight.clear()
+
+    def proto_describe_messages(self, pss):
+        # Each Describe is answered with either a RowDescription or a NoData
+        pss = iter(pss)
+        cursor = Cursor(self)
+        cursor.ps = next(pss)
+        code = self.error = None
+        while code != READY_FOR_QUERY:
+            code, data = yield
+            self.message_types[code](data, cursor)
+            if code in (ROW_DESCRIPTION, NO_DATA):
+                cursor.ps = next(pss, None)
+
+        if self.error is not None:
+            raise self.error
+
+    def proto_pipeline_messages(self, cursors, sync_each):
+        # The responses to each statement end with a CommandComplete, an
+        # EmptyQueryResponse or an ErrorResponse. After an error the server
+        # skips the statements up to the next Sync.
+        idx = 0
+        syncs = len(cursors) if sync_each else 1
+        errors = []
+        self.error = None
+        while syncs > 0:
+            code, data = yield
+            cursor = cursors[idx] if idx < len(cursors) else self._cursor
+            self.message_types[code](data, cursor)
+            if code in (COMMAND_COMPLETE, EMPTY_QUERY_RESPONSE):
+                idx += 1
+            elif code == ERROR_RESPONSE:
+                idx = idx + 1 if sync_each else len(cursors)
+            elif code == READY_FOR_QUERY:
+                syncs -= 1
+
+            if self.error is not None:
+                errors.append(self.error)
+                self.error = None
+
+        if len(errors) > 0:
+            raise errors[0]
+
+    def reset_cursor(self, cursor, ps):
+        cursor.ps = ps
         cursor._cached_rows.clear()
+        cursor._columns = None
         cursor._row_count = -1
+        cursor._portal_suspended = False
+        cursor._portal_row_count = 0
+
+    def pipeline(self, sync_each=False):
+        """Creates a :class:`Pipeline` object bound to this connection.
+
+        This method is a pg8000 extension.
+
+        :param sync_each: If ``False`` (the default) a single Sync message is
+            sent after the last statement, and an error stops the rest of the
+            statements being executed. If ``True`` a Sync is sent after each
+            statement.
+        """
+        return Pipeline(self, sync_each=sync_each)
+
+    def compile_bind(self, ps):
+        """Returns a function that makes the data of a Bind message for a
+        prepared statement, from the arguments and the name of the portal.
 
+        The types of the arguments are part of the key of a prepared
+        statement, so the function is made for them. Each run of parameters
+        that are packed as they are is packed, with their lengths, by a
+        single Struct, and the other parameters are encoded one by one with
+        their lengths in front.
+        """
         # Byte1('B') - Identifies the Bind command.
         # Int32 - Message length, including self.
         # String - Name of the destination portal.
@@ -1904,45 +3702,118 @@ class Connection():
         # Int16 - The number of result-column format codes.
         # For each result-column format code:
         #   Int16 - The format code.
-        retval = bytearray(ps['bind_1'])
-        for value, send_func in zip(args, ps['param_funcs']):
-            if value is None:
-                val = NULL
+        def packed(run):
+            start, stop = run[0][0], run[-1][0] + 1
+            pack = Struct('!' + ''.join('i' + fmt for i, fmt in run)).pack
+            template = []
+            for i, fmt in run:
+                template.extend((calcsize('!' + fmt), None))
+
+            def encode(args):
+                vals = list(template)
+                try:
+                    vals[1::2] = args[start:stop]
+                except TypeError:
+                    # A sequence that can't be sliced, such as a deque
+                    vals[1::2] = tuple(args)[start:stop]
+                return pack(*vals)
+            return encode
+
+        def sized(i, send, size):
+            prefix = i_pack(size)
+
+            def encode(args):
+                return prefix + send(args[i])
+            return encode
+
+        def unsized(i, send):
+            def encode(args):
+                val = send(args[i])
+                return i_pack(len(val)) + val
+            return encode
+
+        def null(args):
+            return NULL
+
+        encoders = []
+        run = []
+        for i, send in enumerate(ps['param_funcs']):
+            fmt = BIND_FORMATS.get(send)
+            if fmt is not None:
+                run.append((i, fmt))
+                continue
+
+            if len(run) > 0:
+                encoders.append(packed(run))
+                run = []
+            if send is null_send:
+                encoders.append(null)
+            elif send in BIND_SIZES:
+                encoders.append(sized(i, send, BIND_SIZES[send]))
             else:
-                val = send_func(value)
-                retval.extend(i_pack(len(val)))
-            retval.extend(val)
-        retval.extend(ps['bind_2'])
+                encoders.append(unsized(i, send))
+        if len(run) > 0:
+            encoders.append(packed(run))
+
+        head, tail = ps['bind_1'], ps['bind_2']
+        if len(encoders) == 1:
+            encode = encoders[0]
+
+            def bind(args, portal_name_bin=NULL_BYTE):
+                return portal_name_bin + head + encode(args) + tail
+        else:
+            def bind(args, portal_name_bin=NULL_BYTE):
+                return b''.join(
+                    [portal_name_bin, head] + [e(args) for e in encoders] +
+                    [tail])
+        return bind
+
+    def fetch_portal(self, cursor):
+        """Reads the next batch of rows from the suspended portal of a cursor
+        that has a fetch_size.
+        """
+        return self.run_protocol(self.proto_fetch_portal(cursor))
 
-        self._send_message(BIND, retval)
-        self.send_EXECUTE(cursor)
+    def proto_fetch_portal(self, cursor):
+        cursor._portal_suspended = False
+        self.send_EXECUTE(cursor, cursor._portal_name_bin)
         self._write(SYNC_MSG)
         self._flush()
-        self.handle_messages(cursor)
+        yield from self.proto_messages(cursor)
 
-    def _send_message(self, code, data):
-        try:
-            self._write(code)
-            self._write(i_pack(len(data) + 4))
-            self._write(data)
-            self._write(FLUSH_MSG)
-        except ValueError as e:
-            if str(e) == "write to closed file":
-                raise InterfaceError("connection is closed")
-            else:
-                raise e
-        except AttributeError:
-            raise InterfaceError("connection is closed")
+    def close_portal(self, cursor):
+        return self.run_protocol(self.proto_close_portal(cursor))
+
+    def proto_close_portal(self, cursor):
+        cursor._portal_suspended = False
+        cursor._cached_rows.clear()
+        self._send_message(CLOSE, PORTAL + cursor._portal_name_bin)
+        self._write(SYNC_MSG)
+        self._flush()
+        yield from self.proto_messages(self._cursor)
 
-    def send_EXECUTE(self, cursor):
+    def _send_message(self, code, data):
+        # The message is only written to the buffer. The server doesn't
+        # answer until it gets a Sync, or a Flush where the responses are
+        # needed in the middle of a request.
+        self._write(code)
+        self._write(i_pack(len(data) + 4))
+        self._write(data)
+
+    def send_EXECUTE(self, cursor, portal_name_bin=NULL_BYTE):
         # Byte1('E') - Identifies the message as an execute message.
         # Int32 -   Message length, including self.
         # String -  The name of the portal to execute.
         # Int32 -   Maximum number of rows to return, if portal
         #           contains a query # that returns rows.
         #           0 = no limit.
-        self._write(EXECUTE_MSG)
-        self._write(FLUSH_MSG)
+        if portal_name_bin == NULL_BYTE:
+            self._write(EXECUTE_MSG)
+        else:
+            cursor._portal_max_rows = cursor.fetch_size
+            self._write(
+                create_message(
+                    EXECUTE, portal_name_bin + i_pack(cursor.fetch_size)))
 
     def handle_NO_DATA(self, msg, ps):
         pass
@@ -1951,51 +3822,135 @@ class Connection():
         values = data[:-1].split(b' ')
         command = values[0]
         if command in self._commands_with_count:
-            row_count = int(values[-1])
+            # For a portal read in batches, the count is of the last batch
+            row_count = int(values[-1]) + cursor._portal_row_count
             if cursor._row_count == -1:
                 cursor._row_count = row_count
             else:
                 cursor._row_count += row_count
 
-        if command in (b"ALTER", b"CREATE"):
-            for scache in self._caches.values():
-                for pcache in scache.values():
-                    for ps in pcache['ps'].values():
-                        self.close_prepared_statement(ps['statement_name_bin'])
-                    pcache['ps'].clear()
-
-    def handle_DATA_ROW(self, data, cursor):
-        data_idx = 2
-        row = []
-        for func in cursor.ps['input_funcs']:
+        if command in (b"ALTER", b"DROP") or \
+                values[:2] == [b"CREATE", b"VIEW"]:
+            # The result columns of the prepared statements may have changed,
+            # so they'll be prepared again the next time they're used.
+            self._statement_generation += 1
+
+    def handle_DATA_ROW(self, data, cursor, offset=0):
+        # The row may be in the middle of the data, starting at the offset
+        if cursor.columnar:
+            return self.handle_column_data(data, cursor, offset)
+
+        ps = cursor.ps
+        decode_row = ps['decode_row']
+        if decode_row is None:
+            data_idx = offset + 2
+            row = []
+            for func in ps['input_funcs']:
+                vlen = i_unpack(data, data_idx)[0]
+                data_idx += 4
+                if vlen == -1:
+                    row.append(None)
+                else:
+                    row.append(func(data, data_idx, vlen))
+                    data_idx += vlen
+        else:
+            row = decode_row(data, offset)
+
+        row_factory = cursor.row_factory
+        if row_factory is None:
+            cursor._cached_rows.append(row)
+        else:
+            row_makers = ps['row_makers']
+            try:
+                make_row = row_makers[row_factory]
+            except KeyError:
+                make_row = row_makers[row_factory] = row_factory(
+                    [
+                        str(f['name'], self._client_encoding)
+                        for f in ps['row_desc']])
+            cursor._cached_rows.append(make_row(row))
+
+    def handle_column_data(self, data, cursor, offset=0):
+        # Appends the values of a DataRow to the column buffers of a cursor
+        columns = cursor._columns
+        if columns is None:
+            columns = cursor._columns = make_columns(cursor.ps)
+
+        data_idx = offset + 2
+        for values, nulls, func, dtype in columns:
             vlen = i_unpack(data, data_idx)[0]
             data_idx += 4
             if vlen == -1:
-                row.append(None)
+                values.append(None if dtype is None else 0)
+                nulls.append(1)
             else:
-                row.append(func(data, data_idx, vlen))
+                values.append(func(data, data_idx, vlen))
+                nulls.append(0)
                 data_idx += vlen
-        cursor._cached_rows.append(row)
-
-    def handle_messages(self, cursor):
-        code = self.error = None
 
-        while code != READY_FOR_QUERY:
-            code, data_len = ci_unpack(self._read(5))
-            self.message_types[code](self._read(data_len - 4), cursor)
+    def proto_messages(self, cursor):
+        # Handles the messages up to the next ReadyForQuery
+        self.error = None
+        yield cursor
 
         if self.error is not None:
             raise self.error
 
+    def cancel(self):
+        """Asks the server to cancel the operation that this connection is
+        executing. The operation then fails with a :exc:`ProgrammingError`
+        with the code 57014. If the connection isn't executing anything the
+        request is ignored by the server.
+
+        The request is sent over a new connection to the server, and the
+        state of this connection isn't changed, so it's safe to call this
+        method from another thread or from a signal handler.
+
+        This method is a pg8000 extension.
+        """
+        if self._backend_key_data is None:
+            raise InterfaceError(
+                "the server hasn't sent the key needed to cancel")
+
+        sock = socket.socket(self._family, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self._timeout)
+            sock.connect(self._address)
+
+            # Int32(16) - Message length, including self.
+            # Int32(80877102) - The cancel request code.
+            # Int32 - The process ID of the backend.
+            # Int32 - The secret key of the backend.
+            sock.sendall(ii_pack(16, 80877102) + self._backend_key_data)
+
+            # The server closes the connection once it's sent the cancel
+            # signal to the backend.
+            sock.recv(1)
+        except socket.error as e:
+            raise InterfaceError("communication error", e)
+        finally:
+            sock.close()
+
+    def proto_sync(self):
+        # A Sync on its own is answered with a ReadyForQuery, so it's the
+        # cheapest way of checking that the server is still there.
+        self._write(SYNC_MSG)
+        self._flush()
+        yield from self.proto_messages(self._cursor)
+
     # Byte1('C') - Identifies the message as a close command.
     # Int32 - Message length, including self.
     # Byte1 - 'S' for prepared statement, 'P' for portal.
     # String - The name of the item to close.
     def close_prepared_statement(self, statement_name_bin):
+        return self.run_protocol(
+            self.proto_close_prepared_statement(statement_name_bin))
+
+    def proto_close_prepared_statement(self, statement_name_bin):
         self._send_message(CLOSE, STATEMENT + statement_name_bin)
         self._write(SYNC_MSG)
         self._flush()
-        self.handle_messages(self._cursor)
+        yield from self.proto_messages(self._cursor)
 
     # Byte1('N') - Identifier
     # Int32 - Message length
@@ -2029,6 +3984,10 @@ class Connection():
                 self.py_types[Timedelta] = (
                     1186, FC_BINARY, interval_send_integer)
                 self.pg_types[1186] = (FC_BINARY, interval_recv_integer)
+
+                self.py_types[time] = (1083, FC_BINARY, time_send_integer)
+                self.pg_types[1083] = (FC_BINARY, time_recv_integer)
+                self.pg_types[1266] = (FC_BINARY, timetz_recv_integer)
             else:
                 self.py_types[1114] = (1114, FC_BINARY, timestamp_send_float)
                 self.pg_types[1114] = (FC_BINARY, timestamp_recv_float)
@@ -2041,6 +4000,10 @@ class Connection():
                     1186, FC_BINARY, interval_send_float)
                 self.pg_types[1186] = (FC_BINARY, interval_recv_float)
 
+                self.py_types[time] = (1083, FC_BINARY, time_send_float)
+                self.pg_types[1083] = (FC_BINARY, time_recv_float)
+                self.pg_types[1266] = (FC_BINARY, timetz_recv_float)
+
         elif key == b"server_version":
             self._server_version = LooseVersion(value.decode('ascii'))
             if self._server_version < LooseVersion('8.2.0'):
@@ -2289,6 +4252,26 @@ pg_array_types = {
     1700: 1231,  # NUMERIC[]
 }
 
+# pg array typeoid -> pg element oid
+pg_array_elements = {
+    1000: 16,    # BOOL[]
+    1001: 17,    # BYTEA[]
+    1005: 21,    # INT2[]
+    1007: 23,    # INT4[]
+    1009: 25,    # TEXT[]
+    1014: 1042,  # CHAR[]
+    1015: 1043,  # VARCHAR[]
+    1016: 20,    # INT8[]
+    1021: 700,   # FLOAT4[]
+    1022: 701,   # FLOAT8[]
+    1115: 1114,  # TIMESTAMP[]
+    1182: 1082,  # DATE[]
+    1183: 1083,  # TIME[]
+    1185: 1184,  # TIMESTAMPTZ[]
+    1231: 1700,  # NUMERIC[]
+    2951: 2950,  # UUID[]
+}
+
 
 # PostgreSQL encodings:
 #   http://www.postgresql.org/docs/8.3/interactive/multibyte.html
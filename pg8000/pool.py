@@ -0,0 +1,317 @@
+"""A thread-safe pool of connections.
+
+Opening a connection takes a round trip to the server for the TCP
+connection, more for an SSL handshake and authentication, and the new
+connection starts with an empty prepared statement cache. A
+:class:`ConnectionPool` keeps connections open so that they can be used by
+one thread after another.
+
+This module is a pg8000 extension.
+"""
+
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from time import monotonic
+
+import pg8000
+from pg8000.core import InterfaceError, OperationalError
+
+
+class PoolTimeoutError(OperationalError):
+    """Raised by :meth:`ConnectionPool.acquire` if a connection doesn't
+    become available within the timeout.
+
+    This exception is a pg8000 extension.
+    """
+    pass
+
+
+class ConnectionPool():
+    """A pool of connections that can be shared between threads. The
+    connections are opened with :func:`pg8000.connect`, with the keyword
+    arguments given to the pool.
+
+    A connection is taken from the pool with :meth:`acquire` and given back
+    with :meth:`release`, or used in a ``with`` block with
+    :meth:`connection`. A connection that's given back in a transaction is
+    rolled back. The connections keep their prepared statements, so the
+    most recently used connection is the one handed out next.
+
+    A daemon thread closes the connections that have been idle for longer
+    than ``max_idle``, or have been open for longer than ``max_lifetime``,
+    and opens connections to keep the pool at ``min_size``. The pool can be
+    used as a context manager, in which case it's closed on leaving the
+    ``with`` block.
+
+    This class is a pg8000 extension.
+
+    :param min_size: The number of connections that the pool keeps open.
+        They're opened in parallel when the pool is created.
+    :param max_size: The maximum number of connections, both in use and
+        idle.
+    :param timeout: The default number of seconds that :meth:`acquire` waits
+        for a connection. If ``None`` it waits for ever.
+    :param max_idle: The number of seconds a connection above the
+        ``min_size`` can be idle before it's closed.
+    :param max_lifetime: The number of seconds after which a connection is
+        closed, once it's been given back to the pool.
+    :param check_after: A connection that's been idle for longer than this
+        number of seconds is checked before it's handed out, and if the
+        server doesn't answer it's replaced.
+    :param reap_interval: The number of seconds between the runs of the
+        daemon thread.
+    """
+
+    def __init__(
+            self, min_size=0, max_size=10, timeout=None, max_idle=600.0,
+            max_lifetime=3600.0, check_after=30.0, reap_interval=10.0,
+            **kwargs):
+        if min_size > max_size:
+            raise InterfaceError("min_size can't be more than max_size")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self._connect_kwargs = kwargs
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (released time, connection), oldest first
+        self._opened = {}  # connection: opened time
+        self._in_use = set()
+        self._size = min_size  # including the connections being opened
+        self._closed = False
+
+        for con in self._open_connections(min_size):
+            self._idle.append((monotonic(), con))
+
+        self._closing = threading.Event()
+        self._reaper = threading.Thread(
+            target=self._run_reaper, args=(reap_interval,), daemon=True)
+        self._reaper.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def size(self):
+        """The number of open connections, both in use and idle."""
+        with self._cond:
+            return len(self._opened)
+
+    @property
+    def idle(self):
+        """The number of idle connections."""
+        with self._cond:
+            return len(self._idle)
+
+    def _connect(self):
+        con = pg8000.connect(**self._connect_kwargs)
+        with self._cond:
+            self._opened[con] = monotonic()
+        return con
+
+    def _open_connections(self, count):
+        # Opens connections in parallel. The caller has already added them
+        # to the size of the pool.
+        if count == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            futures = [executor.submit(self._connect) for i in range(count)]
+
+        cons = [f.result() for f in futures if f.exception() is None]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if len(errors) > 0:
+            for con in cons:
+                self._discard(con)
+            with self._cond:
+                self._size -= len(errors)
+                self._cond.notify_all()
+            raise errors[0]
+        return cons
+
+    def _discard(self, con):
+        with self._cond:
+            self._size -= 1
+            del self._opened[con]
+            self._cond.notify()
+        try:
+            con.close()
+        except Exception:
+            # The connection may be broken already
+            pass
+
+    def _check(self, con):
+        # Returns True if the server answers
+        try:
+            con.run_protocol(con.proto_sync())
+            return True
+        except Exception:
+            return False
+
+    def acquire(self, timeout=None):
+        """Takes a connection from the pool, opening a new one if there
+        aren't any idle connections and the pool is below ``max_size``.
+        Otherwise it waits for a connection to be given back.
+
+        :param timeout: The number of seconds to wait for a connection. If
+            ``None`` the ``timeout`` of the pool is used.
+        :raises PoolTimeoutError: If a connection doesn't become available
+            in time.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = None if timeout is None else monotonic() + timeout
+
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise InterfaceError("the pool is closed")
+                    if len(self._idle) > 0:
+                        released, con = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        con = None
+                        break
+
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - monotonic()
+                        if remaining <= 0:
+                            raise PoolTimeoutError(
+                                "timed out waiting for a connection")
+                        self._cond.wait(remaining)
+
+            if con is None:
+                try:
+                    con = self._connect()
+                except BaseException:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            else:
+                now = monotonic()
+                if now - self._opened[con] > self.max_lifetime or (
+                        now - released > self.check_after and
+                        not self._check(con)):
+                    self._discard(con)
+                    continue
+
+            with self._cond:
+                self._in_use.add(con)
+            return con
+
+    def release(self, con):
+        """Gives a connection back to the pool. If the connection is in a
+        transaction it's rolled back, and if it's broken, or has been open
+        for longer than ``max_lifetime``, it's closed.
+
+        Only the transaction is rolled back. Session state, such as settings
+        made with SET and temporary tables, carries over to the next user of
+        the connection. The prepared statements are kept on purpose, so
+        DISCARD ALL mustn't be used to reset the session.
+        """
+        with self._cond:
+            try:
+                self._in_use.remove(con)
+            except KeyError:
+                raise InterfaceError(
+                    "the connection isn't in use from this pool")
+
+        keep = con._sock is not None
+        if keep and con.in_transaction:
+            try:
+                con.rollback()
+            except Exception:
+                keep = False
+
+        if keep:
+            with self._cond:
+                now = monotonic()
+                if not self._closed and \
+                        now - self._opened[con] <= self.max_lifetime:
+                    self._idle.append((now, con))
+                    self._cond.notify()
+                    return
+        self._discard(con)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """A context manager that acquires a connection, and releases it on
+        leaving the ``with`` block.
+        """
+        con = self.acquire(timeout)
+        try:
+            yield con
+        finally:
+            self.release(con)
+
+    def reap(self):
+        """Closes the idle connections that have been idle for longer than
+        ``max_idle``, or have been open for longer than ``max_lifetime``, and
+        opens connections to bring the pool up to ``min_size``. This is
+        called periodically by the daemon thread of the pool.
+        """
+        expired = []
+        with self._cond:
+            if self._closed:
+                return
+            now = monotonic()
+            for item in list(self._idle):
+                released, con = item
+                if now - self._opened[con] > self.max_lifetime or (
+                        now - released > self.max_idle and
+                        self._size - len(expired) > self.min_size):
+                    self._idle.remove(item)
+                    expired.append(con)
+
+        for con in expired:
+            self._discard(con)
+
+        with self._cond:
+            missing = max(0, self.min_size - self._size)
+            self._size += missing
+
+        cons = self._open_connections(missing)
+        with self._cond:
+            for con in cons:
+                self._idle.appendleft((monotonic(), con))
+            self._cond.notify(len(cons))
+
+    def _run_reaper(self, reap_interval):
+        while not self._closing.wait(reap_interval):
+            try:
+                self.reap()
+            except Exception:
+                # The server may be unavailable for a while
+                pass
+
+    def close(self):
+        """Closes the idle connections of the pool, and stops the daemon
+        thread. Connections that are in use are closed when they're given
+        back.
+        """
+        with self._cond:
+            self._closed = True
+            idle = [con for released, con in self._idle]
+            self._idle.clear()
+            self._cond.notify_all()
+        self._closing.set()
+
+        for con in idle:
+            self._discard(con)
+
+
+__all__ = ['ConnectionPool', 'PoolTimeoutError']
@@ -4,6 +4,8 @@ import time
 import warnings
 from contextlib import closing
 from decimal import Decimal
+from enum import Enum, IntEnum
+from io import BytesIO
 
 
 whole_begin_time = time.time()
@@ -18,6 +20,13 @@ tests = (
         ("cast(id / 100 as float8)", 'float8'),
         ("cast(id / 100 as numeric)", 'numeric'),
         ("timestamp '2001-09-28' + id * interval '1 second'", 'timestamp'),
+        ("cast('1 2 3 4 5 6 7 8' as int2vector)", 'int2vector'),
+)
+
+array_tests = (
+        ("cast(id as numeric) / 100", 'numeric[]'),
+        ("cast(id as oid)", 'oid[]'),
+        ("cast(cast(id as text) as json)", 'json[]'),
 )
 
 with warnings.catch_warnings(), closing(pg8000.connect(**db_connect)) as db:
@@ -34,6 +43,17 @@ with warnings.catch_warnings(), closing(pg8000.connect(**db_connect)) as db:
                 pass
             end_time = time.time()
             print("Attempt %s - %s seconds." % (i, end_time - begin_time))
+    for txt, name in array_tests:
+        query = """SELECT ARRAY(SELECT {0} FROM generate_series(1, 100000)
+            AS id)""".format(txt)
+        cursor = db.cursor()
+        print("Beginning large %s test..." % name)
+        for i in range(1, 5):
+            begin_time = time.time()
+            cursor.execute(query)
+            cursor.fetchall()
+            end_time = time.time()
+            print("Attempt %s - %s seconds." % (i, end_time - begin_time))
     db.commit()
     cursor = db.cursor()
     cursor.execute(
@@ -50,6 +70,44 @@ with warnings.catch_warnings(), closing(pg8000.connect(**db_connect)) as db:
         end_time = time.time()
         print("Attempt {0} took {1} seconds.".format(i, end_time - begin_time))
 
+    rows = [(i, 'season of mists...', i % 2 == 0) for i in range(10000)]
+    print("Beginning bulk load tests...")
+    begin_time = time.time()
+    cursor.executemany(
+        "insert into t1 (f2, f3, f4) values (%s, %s, %s)", rows)
+    db.commit()
+    print("executemany took {0} seconds.".format(time.time() - begin_time))
+
+    begin_time = time.time()
+    stream = BytesIO(
+        ''.join(
+            "{0}\t{1}\t{2}\n".format(*row) for row in rows).encode('utf8'))
+    cursor.execute("COPY t1 (f2, f3, f4) FROM STDIN", stream=stream)
+    db.commit()
+    print("Text COPY took {0} seconds.".format(time.time() - begin_time))
+
+    begin_time = time.time()
+    cursor.copy_records("t1", ("f2", "f3", "f4"), rows)
+    db.commit()
+    print("copy_records took {0} seconds.".format(time.time() - begin_time))
+
+    class Colour(str, Enum):
+        red = 'red'
+        green = 'green'
+
+    class Level(IntEnum):
+        low = 1
+        high = 2
+
+    params = [(Colour.red, Level.high, Colour.green, Level.low)] * 10000
+    print("Beginning enum parameters test...")
+    for i in range(1, 5):
+        begin_time = time.time()
+        cursor.executemany(
+            "SELECT %s, cast(%s as int), %s, cast(%s as int)", params)
+        end_time = time.time()
+        print("Attempt {0} took {1} seconds.".format(i, end_time - begin_time))
+
     print("Beginning reuse statements test...")
     begin_time = time.time()
     for i in range(2000):
@@ -57,4 +115,20 @@ with warnings.catch_warnings(), closing(pg8000.connect(**db_connect)) as db:
         cursor.fetchall()
     print("Took {0} seconds.".format(time.time() - begin_time))
 
+with warnings.catch_warnings(), closing(
+        pg8000.connect(max_prepared_statements=20000, **db_connect)) as db:
+    print("Beginning statement numbering test...")
+    cached = 0
+    for n in (1, 100, 10000):
+        while cached < n:
+            db.lookup_ps('format', "SELECT " + str(cached), ())
+            cached += 1
+        begin_time = time.time()
+        for i in range(1000):
+            ps, _ = db.lookup_ps('format', "SELECT 'new', " + str(i), ())
+            db.uncache_ps(ps)
+        print(
+            "{0} cached statements - {1} us per new statement.".format(
+                n, round((time.time() - begin_time) * 1000, 2)))
+
 print("Whole time - %s seconds." % (time.time() - whole_begin_time))
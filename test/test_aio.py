@@ -0,0 +1,258 @@
+import asyncio
+from io import BytesIO
+
+import pg8000
+import pg8000.aio
+import pytest
+
+
+@pytest.fixture
+def run(db_kwargs):
+    # Runs a test coroutine with an asyncio connection
+    def run_test(test):
+        async def with_con():
+            con = await pg8000.aio.connect(**db_kwargs)
+            try:
+                return await test(con)
+            finally:
+                if con._writer is not None:
+                    await con.close()
+
+        return asyncio.run(with_con())
+
+    return run_test
+
+
+def test_execute(run):
+    async def test(con):
+        cursor = con.cursor()
+        await cursor.execute("SELECT %s, %s", (1, 'two'))
+        assert await cursor.fetchall() == ([1, 'two'],)
+        assert cursor.description[0][0] == b'?column?'
+
+        assert await con.run("SELECT :v || 'b'", v='a') == (['ab'],)
+        await con.commit()
+        assert not con.in_transaction
+
+    run(test)
+
+
+def test_fetch(run):
+    async def test(con):
+        async with con.cursor() as cursor:
+            await cursor.execute("SELECT * FROM generate_series(1, 5)")
+            assert await cursor.fetchone() == [1]
+            assert await cursor.fetchmany(2) == ([2], [3])
+            assert await cursor.fetchall() == ([4], [5])
+            assert await cursor.fetchone() is None
+
+    run(test)
+
+
+def test_streaming(run):
+    async def test(con):
+        cursor = con.cursor(fetch_size=10)
+        await cursor.execute("SELECT * FROM generate_series(1, 95)")
+        assert len(cursor._cached_rows) == 10
+        assert [row[0] async for row in cursor] == list(range(1, 96))
+        assert cursor.rowcount == 95
+
+    run(test)
+
+
+def test_error_recovery(run):
+    async def test(con):
+        cursor = con.cursor()
+        with pytest.raises(pg8000.ProgrammingError, match='42P01'):
+            await cursor.execute("SELECT * FROM table_that_doesnt_exist")
+        await con.rollback()
+        await cursor.execute("SELECT 1")
+        assert await cursor.fetchall() == ([1],)
+
+    run(test)
+
+
+def test_executemany_and_pipeline(run):
+    async def test(con):
+        cursor = con.cursor()
+        await cursor.execute("CREATE TEMPORARY TABLE t1 (f1 int)")
+        await cursor.executemany(
+            "INSERT INTO t1 VALUES (%s)", [(i,) for i in range(10)])
+        assert cursor.rowcount == 10
+
+        async with con.pipeline() as pipeline:
+            c1 = pipeline.execute("SELECT count(*) FROM t1")
+            c2 = pipeline.execute("SELECT max(f1) FROM t1")
+        assert await c1.fetchone() == [10]
+        assert await c2.fetchone() == [9]
+
+    run(test)
+
+
+def test_copy(run):
+    async def test(con):
+        cursor = con.cursor()
+        await cursor.execute("CREATE TEMPORARY TABLE t1 (f1 int, f2 text)")
+        await cursor.execute(
+            "COPY t1 FROM STDIN", stream=BytesIO(b"1\ta\n2\tb\n"))
+
+        async def chunks():
+            yield "3\tc\n"
+            yield b"4\td\n"
+
+        await cursor.execute("COPY t1 FROM STDIN", stream=chunks())
+        assert cursor.rowcount == 2
+
+        await cursor.copy_records("t1", ("f2", "f1"), [('e', 5), ('f', 6)])
+        assert cursor.rowcount == 2
+
+        await cursor.execute("CREATE TYPE pg_temp.mood AS ENUM ('happy')")
+        await cursor.execute("CREATE TEMPORARY TABLE t2 (f1 pg_temp.mood)")
+        await cursor.copy_records("t2", None, [('happy',)])
+        assert await con.run("SELECT f1::text FROM t2") == (['happy'],)
+
+        stream = BytesIO()
+        await cursor.execute("COPY t1 TO STDOUT", stream=stream)
+        assert stream.getvalue() == \
+            b"1\ta\n2\tb\n3\tc\n4\td\n5\te\n6\tf\n"
+
+        chunks = [c async for c in cursor.copy_out("COPY t1 TO STDOUT")]
+        assert b"".join(chunks) == b"1\ta\n2\tb\n3\tc\n4\td\n5\te\n6\tf\n"
+
+        await cursor.copy_out_records("t1", ("f2",))
+        assert await cursor.fetchall() == tuple([c] for c in 'abcdef')
+
+    run(test)
+
+
+def test_copy_from_file(run, tmp_path):
+    path = tmp_path / "t1.txt"
+    path.write_bytes(b"1\ta\n2\tb\n")
+
+    async def test(con):
+        cursor = con.cursor()
+        await cursor.execute("CREATE TEMPORARY TABLE t1 (f1 int, f2 text)")
+        with path.open('rb') as f:
+            await cursor.execute("COPY t1 FROM STDIN", stream=f)
+        assert cursor.rowcount == 2
+        await cursor.execute("SELECT * FROM t1 ORDER BY f1")
+        assert await cursor.fetchall() == ([1, 'a'], [2, 'b'])
+
+    run(test)
+
+
+def test_copy_out_closed_early(run):
+    async def test(con):
+        cursor = con.cursor()
+        chunks = cursor.copy_out(
+            "COPY (SELECT * FROM generate_series(1, 1000000)) TO STDOUT")
+        async for chunk in chunks:
+            assert chunk.startswith(b"1\n2\n")
+            break
+        await chunks.aclose()
+        assert await con.run("SELECT 1") == ([1],)
+
+    run(test)
+
+
+def test_notifications(run, db_kwargs):
+    async def test(con):
+        con.autocommit = True
+        await con.run("LISTEN aliens_landed")
+
+        # Waiting for a notification can be cancelled safely
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(con.wait_for_notification(), 0.1)
+
+        with pg8000.connect(**db_kwargs) as sync_con:
+            sync_con.autocommit = True
+            sync_con.run("NOTIFY aliens_landed")
+
+        backend_pid, channel = await asyncio.wait_for(
+            con.wait_for_notification(), 5)
+        assert channel == 'aliens_landed'
+        assert len(con.notifications) == 0
+        assert await con.run("SELECT 1") == ([1],)
+
+    run(test)
+
+
+def test_concurrent_connections(db_kwargs):
+    async def query(i):
+        async with await pg8000.aio.connect(**db_kwargs) as con:
+            rows = await con.run("SELECT :i, pg_sleep(0.1)", i=i)
+            return rows[0][0]
+
+    async def test():
+        return await asyncio.gather(*[query(i) for i in range(20)])
+
+    assert asyncio.run(test()) == list(range(20))
+
+
+def test_concurrent_tasks(run):
+    async def test(con):
+        # Operations from different tasks are carried out one at a time
+        return await asyncio.gather(
+            *[con.run("SELECT CAST(:i AS int)", i=i) for i in range(20)])
+
+    assert run(test) == [([i],) for i in range(20)]
+
+
+def test_cancel_closes_connection(run):
+    async def test(con):
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(con.run("SELECT pg_sleep(5)"), 0.1)
+        with pytest.raises(pg8000.InterfaceError, match="closed"):
+            await con.run("SELECT 1")
+
+    run(test)
+
+
+def test_execute_timeout(run):
+    async def test(con):
+        cursor = con.cursor()
+        with pytest.raises(pg8000.ProgrammingError, match='57014'):
+            await cursor.execute("SELECT pg_sleep(10)", timeout=0.2)
+        await con.rollback()
+        await cursor.execute("SELECT 1")
+        assert await cursor.fetchall() == ([1],)
+
+    run(test)
+
+
+def test_star_import():
+    namespace = {}
+    exec("from pg8000.aio import *", namespace)
+    assert namespace['connect'] is pg8000.aio.connect
+    assert namespace['Connection'] is pg8000.aio.Connection
+
+
+def test_sync_use_blocked(run):
+    async def test(con):
+        cursor = con.cursor(fetch_size=2)
+        await cursor.execute("SELECT * FROM generate_series(1, 5)")
+        with pytest.raises(TypeError, match="async for"):
+            for row in cursor:
+                pass
+        assert [row[0] async for row in cursor] == [1, 2, 3, 4, 5]
+
+        for obj in (con, cursor, con.pipeline()):
+            with pytest.raises(TypeError, match="async with"):
+                with obj:
+                    pass
+
+    run(test)
+
+
+def test_close_prepared_statement(run):
+    async def test(con):
+        cursor = con.cursor()
+        await cursor.execute("SELECT 'close_prepared_statement'")
+        name = cursor.ps['statement_name_bin'][:-1].decode('ascii')
+        sql = "SELECT count(*) FROM pg_prepared_statements WHERE name = :n"
+        assert await con.run(sql, n=name) == ([1],)
+
+        await con.close_prepared_statement(cursor.ps['statement_name_bin'])
+        assert await con.run(sql, n=name) == ([0],)
+
+    run(test)
@@ -4,6 +4,7 @@ import socket
 import struct
 import pytest
 import ssl
+import threading
 
 
 # Check if running in Jython
@@ -207,3 +208,22 @@ def test_scram_sha_256(db_kwargs):
     # Should only raise an exception saying db doesn't exist
     with pytest.raises(pg8000.ProgrammingError, match='3D000'):
         pg8000.connect(**db_kwargs)
+
+
+def test_cancel(con):
+    with con.cursor() as cursor:
+        timer = threading.Timer(0.2, con.cancel)
+        timer.start()
+        with pytest.raises(pg8000.ProgrammingError, match='57014'):
+            cursor.execute("SELECT pg_sleep(10)")
+        timer.join()
+
+        # The connection can still be used
+        con.rollback()
+        cursor.execute("SELECT 1")
+        assert cursor.fetchall() == ([1],)
+
+        # A cancel request when nothing is being executed is ignored
+        con.cancel()
+        cursor.execute("SELECT 2")
+        assert cursor.fetchall() == ([2],)
@@ -1,4 +1,7 @@
+from functools import partial
 from io import BytesIO
+from struct import Struct
+import pg8000
 import pytest
 
 
@@ -37,6 +40,45 @@ def test_copy_to_with_query(db_table):
         assert cursor.rowcount == 1
 
 
+def test_copy_out(con):
+    sql = "COPY (SELECT i, repeat('x', 40) FROM generate_series(1, 100000) " \
+        "AS i) TO STDOUT"
+    expected = b"".join(
+        b"%d\t%s\n" % (i, b"x" * 40) for i in range(1, 100001))
+    with con.cursor() as cursor:
+        stream = BytesIO()
+        cursor.execute(sql, stream=stream)
+        assert stream.getvalue() == expected
+
+        chunks = list(cursor.copy_out(sql))
+        assert len(chunks) > 1
+        assert b"".join(chunks) == expected
+        assert cursor.rowcount == 100000
+
+
+def test_copy_out_closed_early(con):
+    with con.cursor() as cursor:
+        chunks = cursor.copy_out(
+            "COPY (SELECT * FROM generate_series(1, 1000000)) TO STDOUT")
+        assert next(chunks).startswith(b"1\n2\n")
+        chunks.close()
+
+        cursor.execute("SELECT 1")
+        assert cursor.fetchall() == ([1],)
+
+
+def test_copy_out_error(con):
+    with con.cursor() as cursor:
+        with pytest.raises(pg8000.ProgrammingError, match='22012'):
+            for chunk in cursor.copy_out(
+                    "COPY (SELECT 1 / (1000000 - i) FROM "
+                    "generate_series(1, 1000000) AS i) TO STDOUT"):
+                pass
+        con.rollback()
+        cursor.execute("SELECT 1")
+        assert cursor.fetchall() == ([1],)
+
+
 def test_copy_from_with_table(db_table):
     with db_table.cursor() as cursor:
         stream = BytesIO(b"1\t1\t1\n2\t2\t2\n3\t3\t3\n")
@@ -61,6 +103,31 @@ def test_copy_from_with_query(db_table):
         assert retval == ([1, 1, None],)
 
 
+def test_copy_from_large(db_table):
+    # Enough data for the reads to grow and for several sends
+    data = b"".join(
+        b"%d\t%d\t%s\n" % (i, i, b"x" * 40) for i in range(1, 100001))
+    with db_table.cursor() as cursor:
+        cursor.execute("COPY t1 FROM STDIN", stream=BytesIO(data))
+        assert cursor.rowcount == 100000
+
+        cursor.execute("SELECT count(*), sum(f2) FROM t1")
+        assert cursor.fetchall() == ([100000, 5000050000],)
+
+
+def test_copy_from_file(db_table, tmp_path):
+    path = tmp_path / "t1.txt"
+    path.write_bytes(b"f1\tf2\n1\t1\t1\n2\t2\t2\n")
+    with db_table.cursor() as cursor, path.open('rb') as f:
+        # The file is sent from where it's been read up to
+        f.readline()
+        cursor.execute("COPY t1 FROM STDIN", stream=f)
+        assert cursor.rowcount == 2
+
+        cursor.execute("SELECT * FROM t1 ORDER BY f1")
+        assert cursor.fetchall() == ([1, 1, '1'], [2, 2, '2'])
+
+
 def test_copy_from_with_error(db_table):
     with db_table.cursor() as cursor:
         stream = BytesIO(b"f1Xf2\n\n1XY1Y\n")
@@ -79,3 +146,130 @@ def test_copy_from_with_error(db_table):
         earg = e.value.args[0]
         for k, v in arg.items():
             assert earg[k] == v
+
+
+def test_copy_records(db_table):
+    with db_table.cursor() as cursor:
+        rows = ((i, i * 2, None if i % 2 else str(i)) for i in range(1, 3001))
+        cursor.copy_records("t1", ("f1", "f2", "f3"), rows)
+        assert cursor.rowcount == 3000
+
+        cursor.execute("SELECT count(*), sum(f2), count(f3) FROM t1")
+        assert cursor.fetchall() == ([3000, 9003000, 1500],)
+        cursor.execute("SELECT * FROM t1 WHERE f1 IN (1, 2) ORDER BY f1")
+        assert cursor.fetchall() == ([1, 2, None], [2, 4, '2'])
+
+
+def test_copy_records_types(con):
+    from datetime import date, datetime as Datetime, timedelta as Timedelta
+    from decimal import Decimal
+    from enum import Enum
+    from ipaddress import ip_address
+    from uuid import UUID
+
+    class Mood(Enum):
+        happy = 'happy'
+
+    row = [
+        True, 12, 123456789012, 1.5, 2.25, Decimal('-12.345'), 'text',
+        b'\x00\xff', date(2020, 2, 29), Datetime(2020, 2, 29, 12, 30, 1, 5),
+        Timedelta(days=1, seconds=2), UUID('12345678123456781234567812345678'),
+        {'a': [1, 2]}, [[1, 2], [3, None]], ['a', 'b']]
+    with con.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE t2 (f1 bool, f2 int2, f3 int8, "
+            "f4 float4, f5 float8, f6 numeric, f7 text, f8 bytea, f9 date, "
+            "f10 timestamp, f11 interval, f12 uuid, f13 jsonb, f14 int4[][], "
+            "f15 varchar[])")
+        cursor.execute("CREATE TYPE pg_temp.mood AS ENUM ('sad', 'happy')")
+        cursor.copy_records("t2", None, [row, [None] * len(row)])
+        cursor.execute("SELECT * FROM t2")
+        assert cursor.fetchall() == (row, [None] * len(row))
+
+        # The types whose binary format isn't known to pg8000 aren't sent as
+        # text
+        cursor.execute(
+            "CREATE TEMPORARY TABLE t3 (f1 oid, f2 json, f3 pg_temp.mood, "
+            "f4 name, f5 char(3))")
+        cursor.copy_records(
+            "t3", None, [(1234, {'a': [1, 2]}, Mood.happy, 'n', 'abc')])
+        cursor.execute("SELECT f1, f2, f3::text, f4, f5 FROM t3")
+        assert cursor.fetchall() == (
+            [1234, {'a': [1, 2]}, 'happy', 'n', 'abc'],)
+        cursor.execute("CREATE TEMPORARY TABLE t4 (f1 inet)")
+        with pytest.raises(pg8000.NotSupportedError, match="oid 869"):
+            cursor.copy_records("t4", None, [(ip_address('10.0.0.1'),)])
+
+        # An error in the rows fails the COPY, and leaves the connection
+        # usable
+        with pytest.raises(pg8000.ProgrammingError, match="3 values"):
+            cursor.copy_records("t2", None, [(1, 2, 3)])
+        con.rollback()
+        cursor.execute("SELECT 1")
+        assert cursor.fetchall() == ([1],)
+
+
+def test_copy_records_naive_timestamptz(con):
+    # A naive datetime is taken to be in local time, as it is by execute()
+    from datetime import datetime as Datetime
+    value = Datetime(2020, 1, 1, 12, 30)
+    with con.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE t2 (f1 timestamptz)")
+        cursor.copy_records("t2", ["f1"], [(value,)])
+        cursor.execute("SELECT f1 FROM t2")
+        assert cursor.fetchall() == ([value.astimezone()],)
+
+
+def test_copy_records_stream_bounded():
+    # The stream holds no more than one read and one row at a time
+    rows = ((i, i, i) for i in range(200000))
+    stream = pg8000.core.CopyRecordsStream(
+        rows, [partial(Struct('!iq').pack, 8)] * 3)
+    b = bytearray(65536)
+    total = max_size = 0
+    while True:
+        size = stream.readinto(b)
+        if size == 0:
+            break
+        total += size
+        max_size = max(max_size, len(stream._buffer))
+    assert total == 19 + 200000 * 38 + 2
+    assert max_size < 65536 + 38
+
+
+def test_copy_out_records(db_table):
+    with db_table.cursor() as cursor:
+        cursor.copy_records(
+            "t1", None, [(i, i * 2, None if i % 2 else str(i)) for i in
+                         range(1, 1001)])
+
+        cursor.copy_out_records("t1")
+        assert cursor.rowcount == 1000
+        assert cursor.description[0][0] == b'f1'
+        rows = cursor.fetchall()
+        assert len(rows) == 1000
+        assert rows[:2] == ([1, 2, None], [2, 4, '2'])
+
+        cursor.copy_out_records("t1", ("f3", "f1"))
+        assert cursor.fetchone() == [None, 1]
+
+        cursor.columnar = True
+        cursor.copy_out_records("(SELECT f1, f2 FROM t1 WHERE f1 <= 3)")
+        assert [(list(v), list(n)) for v, n in cursor.fetch_columns()] == \
+            [([1, 2, 3], [0, 0, 0]), ([2, 4, 6], [0, 0, 0])]
+
+
+def test_copy_out_records_types(con):
+    from decimal import Decimal
+    from ipaddress import ip_address, ip_network
+
+    with con.cursor() as cursor:
+        cursor.copy_out_records(
+            "(SELECT 1.5::numeric, 'x'::text, '{\"a\": 1}'::jsonb, "
+            "'{\"b\": 2}'::json, 26::oid, '10.0.0.1'::inet, "
+            "'10.0.0.0/8'::inet, ARRAY['10.0.0.1'::inet], "
+            "'(1,2)'::point, NULL::int, 'x'::text)")
+        assert cursor.fetchall() == ([
+            Decimal('1.5'), 'x', {'a': 1}, {'b': 2}, 26,
+            ip_address('10.0.0.1'), ip_network('10.0.0.0/8'),
+            [ip_address('10.0.0.1')], '(1,2)', None, 'x'],)
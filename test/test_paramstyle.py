@@ -1,4 +1,9 @@
-from pg8000.core import convert_paramstyle as convert
+from pg8000.core import ParamstyleCache, convert_paramstyle as convert
+import pytest
+from pg8000 import InterfaceError
+from itertools import count
+from random import Random
+from threading import Thread
 
 
 # Tests of the convert_paramstyle function.
@@ -83,3 +88,246 @@ def test_py_format():
         "b='75%%'"
     assert new_query, expected
     assert make_args((1, 2, 3)) == (1, 2, 3)
+
+
+def test_paramstyle_cache():
+    cache = ParamstyleCache(2)
+    query, make_args = cache("named", "SELECT :a, :b")
+    assert query == "SELECT $1, $2"
+    assert make_args({'a': 1, 'b': 2}) == (1, 2)
+    assert cache("named", "SELECT :a, :b")[1] is make_args
+    assert cache.info() == (1, 1, 0, 2, 1)
+
+    # The same query in another style is a different entry
+    assert cache("format", "SELECT :a, :b")[0] == "SELECT :a, :b"
+    assert cache.info() == (1, 2, 0, 2, 2)
+
+    # The least recently used query is the one evicted
+    cache("named", "SELECT :a, :b")
+    cache("format", "SELECT %s")
+    assert cache.info() == (2, 3, 1, 2, 2)
+    assert cache("named", "SELECT :a, :b")[1] is make_args
+
+    # Errors aren't cached
+    with pytest.raises(InterfaceError):
+        cache("format", "SELECT %d")
+    assert cache.info().currsize == 2
+
+    cache.clear()
+    assert cache.info() == (0, 0, 0, 2, 0)
+
+
+def test_paramstyle_cache_threads():
+    cache = ParamstyleCache(10)
+    queries = ["SELECT %s, " + str(i) for i in range(20)]
+
+    def run():
+        for i in range(200):
+            query, make_args = cache("format", queries[i % 20])
+            assert query == "SELECT $1, " + str(i % 20)
+
+    threads = [Thread(target=run) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    hits, misses, evictions, maxsize, currsize = cache.info()
+    assert hits + misses == 800
+    assert currsize == 10
+
+
+def test_dollar_quotes():
+    new_query, make_args = convert(
+        "format", "SELECT $$it's 100%$$, $tag$ a $$ %s $tag$, %s, a$b$, $1")
+    assert new_query == \
+        "SELECT $$it's 100%$$, $tag$ a $$ %s $tag$, $1, a$b$, $1"
+
+    new_query, make_args = convert("named", "SELECT :a, $$:b")
+    assert new_query == "SELECT $1, $$:b"
+    assert make_args({'a': 1}) == (1,)
+
+
+def test_block_comments():
+    new_query, make_args = convert(
+        "qmark", "SELECT /* it's ? /* nested ? */ ? */ ?, '/*', ? /* ?")
+    assert new_query == \
+        "SELECT /* it's ? /* nested ? */ ? */ $1, '/*', $2 /* ?"
+
+
+def test_trailing_colon():
+    new_query, make_args = convert("named", "SELECT :a, 'b':")
+    assert new_query == "SELECT $1, 'b':"
+
+
+# The scanner that convert_paramstyle() used before it jumped between the
+# special characters. It doesn't know about dollar quotes or block comments.
+
+def old_convert(style, query):
+    # I don't see any way to avoid scanning the query string char by char,
+    # so we might as well take that careful approach and create a
+    # state-based scanner.  We'll use int variables for the state.
+    OUTSIDE = 0    # outside quoted string
+    INSIDE_SQ = 1  # inside single-quote string '...'
+    INSIDE_QI = 2  # inside quoted identifier   "..."
+    INSIDE_ES = 3  # inside escaped single-quote string, E'...'
+    INSIDE_PN = 4  # inside parameter name eg. :name
+    INSIDE_CO = 5  # inside inline comment eg. --
+
+    in_quote_escape = False
+    in_param_escape = False
+    placeholders = []
+    output_query = []
+    param_idx = map(lambda x: "$" + str(x), count(1))
+    state = OUTSIDE
+    prev_c = None
+    for i, c in enumerate(query):
+        if i + 1 < len(query):
+            next_c = query[i + 1]
+        else:
+            next_c = None
+
+        if state == OUTSIDE:
+            if c == "'":
+                output_query.append(c)
+                if prev_c == 'E':
+                    state = INSIDE_ES
+                else:
+                    state = INSIDE_SQ
+            elif c == '"':
+                output_query.append(c)
+                state = INSIDE_QI
+            elif c == '-':
+                output_query.append(c)
+                if prev_c == '-':
+                    state = INSIDE_CO
+            elif style == "qmark" and c == "?":
+                output_query.append(next(param_idx))
+            elif style == "numeric" and c == ":" and next_c not in ':=' \
+                    and prev_c != ':':
+                # Treat : as beginning of parameter name if and only
+                # if it's the only : around
+                # Needed to properly process type conversions
+                # i.e. sum(x)::float
+                output_query.append("$")
+            elif style == "named" and c == ":" and next_c not in ':=' \
+                    and prev_c != ':':
+                # Same logic for : as in numeric parameters
+                state = INSIDE_PN
+                placeholders.append('')
+            elif style == "pyformat" and c == '%' and next_c == "(":
+                state = INSIDE_PN
+                placeholders.append('')
+            elif style in ("format", "pyformat") and c == "%":
+                style = "format"
+                if in_param_escape:
+                    in_param_escape = False
+                    output_query.append(c)
+                else:
+                    if next_c == "%":
+                        in_param_escape = True
+                    elif next_c == "s":
+                        state = INSIDE_PN
+                        output_query.append(next(param_idx))
+                    else:
+                        raise InterfaceError(
+                            "Only %s and %% are supported in the query.")
+            else:
+                output_query.append(c)
+
+        elif state == INSIDE_SQ:
+            if c == "'":
+                if in_quote_escape:
+                    in_quote_escape = False
+                else:
+                    if next_c == "'":
+                        in_quote_escape = True
+                    else:
+                        state = OUTSIDE
+            output_query.append(c)
+
+        elif state == INSIDE_QI:
+            if c == '"':
+                state = OUTSIDE
+            output_query.append(c)
+
+        elif state == INSIDE_ES:
+            if c == "'" and prev_c != "\\":
+                # check for escaped single-quote
+                state = OUTSIDE
+            output_query.append(c)
+
+        elif state == INSIDE_PN:
+            if style == 'named':
+                placeholders[-1] += c
+                if next_c is None or (not next_c.isalnum() and next_c != '_'):
+                    state = OUTSIDE
+                    try:
+                        pidx = placeholders.index(placeholders[-1], 0, -1)
+                        output_query.append("$" + str(pidx + 1))
+                        del placeholders[-1]
+                    except ValueError:
+                        output_query.append("$" + str(len(placeholders)))
+            elif style == 'pyformat':
+                if prev_c == ')' and c == "s":
+                    state = OUTSIDE
+                    try:
+                        pidx = placeholders.index(placeholders[-1], 0, -1)
+                        output_query.append("$" + str(pidx + 1))
+                        del placeholders[-1]
+                    except ValueError:
+                        output_query.append("$" + str(len(placeholders)))
+                elif c in "()":
+                    pass
+                else:
+                    placeholders[-1] += c
+            elif style == 'format':
+                state = OUTSIDE
+
+        elif state == INSIDE_CO:
+            output_query.append(c)
+            if c == '\n':
+                state = OUTSIDE
+
+        prev_c = c
+
+    if style in ('numeric', 'qmark', 'format'):
+        def make_args(vals):
+            return vals
+    else:
+        def make_args(vals):
+            return tuple(vals[p] for p in placeholders)
+
+    return ''.join(output_query), make_args
+
+
+class Names(dict):
+    def __missing__(self, key):
+        return key
+
+
+PIECES = [
+    "'", "''", "E'", "\\'", "\\", '"', '""', "-", "--", "\n", ":", "::",
+    ":=", "?", "%", "%%", "%s", "%(", ")s", "(", ")", "a", "E", "_", "1",
+    " ", "\u00e9", "x", "SELECT ", ", "]
+
+
+@pytest.mark.parametrize(
+    "style", ["qmark", "numeric", "named", "format", "pyformat"])
+def test_same_as_old_scanner(style):
+    random = Random(style)
+    for i in range(2000):
+        query = ''.join(random.choices(PIECES, k=random.randint(0, 30)))
+        try:
+            expected, old_make_args = old_convert(style, query)
+        except InterfaceError:
+            with pytest.raises(InterfaceError):
+                convert(style, query)
+            continue
+        except TypeError:
+            # The old scanner fails on a colon at the end of the query
+            continue
+
+        new_query, make_args = convert(style, query)
+        assert new_query == expected, query
+        assert make_args(Names()) == old_make_args(Names()), query
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pg8000
+import pytest
+from pg8000.pool import ConnectionPool, PoolTimeoutError
+
+
+def test_reuse(db_kwargs):
+    with ConnectionPool(**db_kwargs) as pool:
+        with pool.connection() as con:
+            con.run("SELECT 1")
+            assert con.in_transaction
+
+        # The connection is rolled back, and keeps its prepared statements
+        assert not con.in_transaction
+        misses = con.statement_cache_info().misses
+        with pool.connection() as con2:
+            assert con2 is con
+            con2.run("SELECT 1")
+        assert con.statement_cache_info().misses == misses
+        assert pool.size == pool.idle == 1
+
+
+def test_prewarm(db_kwargs):
+    with ConnectionPool(min_size=4, **db_kwargs) as pool:
+        assert pool.size == pool.idle == 4
+
+
+def test_prewarm_failure(db_kwargs):
+    db_kwargs['database'] = 'pg8000_missing_database'
+    with pytest.raises(pg8000.ProgrammingError, match='3D000'):
+        ConnectionPool(min_size=2, **db_kwargs)
+
+
+def test_max_size(db_kwargs):
+    with ConnectionPool(max_size=1, **db_kwargs) as pool:
+        con = pool.acquire()
+        with pytest.raises(PoolTimeoutError):
+            pool.acquire(timeout=0.1)
+
+        # A waiting thread gets the connection when it's given back
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(
+            pool.acquire(timeout=5)))
+        thread.start()
+        time.sleep(0.1)
+        pool.release(con)
+        thread.join()
+        assert acquired == [con]
+
+        # A connection can't be given back twice
+        pool.release(con)
+        with pytest.raises(pg8000.InterfaceError):
+            pool.release(con)
+
+
+def test_session_state_kept(db_kwargs):
+    # Only the transaction is rolled back, so a setting made with SET is
+    # seen by the next user of the connection
+    with ConnectionPool(max_size=1, **db_kwargs) as pool:
+        with pool.connection() as con:
+            con.autocommit = True
+            con.run("SET application_name = 'pool_test'")
+            con.autocommit = False
+        with pool.connection() as con:
+            assert con.run("SHOW application_name") == (['pool_test'],)
+
+
+def test_reap(db_kwargs):
+    with ConnectionPool(min_size=1, max_idle=0, **db_kwargs) as pool:
+        cons = [pool.acquire() for i in range(3)]
+        for con in cons:
+            pool.release(con)
+        assert pool.size == 3
+
+        time.sleep(0.01)
+        pool.reap()
+        assert pool.size == pool.idle == 1
+
+
+def test_max_lifetime(db_kwargs):
+    with ConnectionPool(min_size=1, max_lifetime=0, **db_kwargs) as pool:
+        con = pool.acquire()
+        pool.release(con)
+        assert con._sock is None
+
+        # The pool is topped up to the min_size
+        pool.reap()
+        assert pool.size == pool.idle == 1
+
+
+def test_health_check(con, db_kwargs):
+    with ConnectionPool(check_after=0, **db_kwargs) as pool:
+        with pool.connection() as pool_con:
+            pid = pool_con.run("SELECT pg_backend_pid()")[0][0]
+        con.run("SELECT pg_terminate_backend(:pid)", pid=pid)
+        time.sleep(0.1)
+
+        # The broken connection is replaced
+        with pool.connection() as pool_con:
+            assert pool_con.run("SELECT pg_backend_pid()")[0][0] != pid
+        assert pool.size == 1
+
+
+def test_close(db_kwargs):
+    pool = ConnectionPool(min_size=1, **db_kwargs)
+    con = pool.acquire()
+    pool.close()
+    assert pool.idle == 0
+    pool.release(con)
+    assert pool.size == 0
+    with pytest.raises(pg8000.InterfaceError, match="closed"):
+        pool.acquire()
+
+
+def test_star_import():
+    namespace = {}
+    exec("from pg8000.pool import *", namespace)
+    assert namespace['ConnectionPool'] is ConnectionPool
+    assert namespace['PoolTimeoutError'] is PoolTimeoutError
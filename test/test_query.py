@@ -1,4 +1,6 @@
 import pg8000
+from array import array
+from collections import deque
 from datetime import datetime as Datetime, timezone as Timezone
 import pytest
 from warnings import filterwarnings
@@ -170,6 +172,50 @@ def test_int_oid(cursor):
     cursor.execute("SELECT typname FROM pg_type WHERE oid = %s", (100,))
 
 
+def test_bind_params(cursor):
+    # Runs of packed parameters, broken up by NULLs and text
+    values = (
+        1, 2 ** 20, 2 ** 40, 2.5, True, None, 'muon', -3, None,
+        Datetime(2001, 2, 3, 4, 5, 6, 789), False)
+    sql = "SELECT " + ", ".join(["%s"] * len(values))
+    for i in range(2):
+        cursor.execute(sql, values)
+        assert cursor.fetchall() == (list(values),)
+
+    # The parameters can be any sequence, not only one that can be sliced
+    cursor.execute(sql, deque(values))
+    assert cursor.fetchall() == (list(values),)
+
+    cursor.execute(
+        "SELECT %s, %s", (Datetime(1850, 1, 1, tzinfo=Timezone.utc), None))
+    assert cursor.fetchall() == (
+        [Datetime(1850, 1, 1, tzinfo=Timezone.utc), None],)
+
+
+def test_row_decoding(cursor):
+    # Runs of columns that are unpacked together, with NULLs in them
+    cursor.execute(
+        "SELECT i, i::int8, i::float8, i::int2, CAST(i AS text), i, "
+        "i %% 2 = 0, CASE WHEN i > 1 THEN i END, i::float4 "
+        "FROM generate_series(1, 3) i "
+        "UNION ALL SELECT NULL, 4, NULL, 4, NULL, NULL, NULL, NULL, NULL")
+    assert cursor.fetchall() == (
+        [1, 1, 1.0, 1, '1', 1, False, None, 1.0],
+        [2, 2, 2.0, 2, '2', 2, True, 2, 2.0],
+        [3, 3, 3.0, 3, '3', 3, False, 3, 3.0],
+        [None, 4, None, 4, None, None, None, None, None])
+
+
+def test_row_decoder_short_data():
+    # A NULL at the end of the data means that unpacking the whole run
+    # would read past the end
+    decode_row = pg8000.core.make_row_decoder(
+        [pg8000.core.int4_recv] * 3)
+    data = b'\x00\x03' + b'\x00\x00\x00\x04\x00\x00\x00\x07' + \
+        b'\xff\xff\xff\xff' * 2
+    assert decode_row(data, 0) == [7, None, None]
+
+
 def test_unicode_query(cursor):
     cursor.execute(
         "CREATE TEMPORARY TABLE \u043c\u0435\u0441\u0442\u043e "
@@ -190,6 +236,105 @@ def test_executemany(db_table):
                 (Datetime(2014, 5, 7),)))
 
 
+def test_executemany_batches(db_table):
+    # More parameter sets than fit in one batch, with the statement being
+    # prepared again part way through because the parameter types change.
+    rows = [(i, i, None) for i in range(2500)]
+    rows.append((2500, 2 ** 40, 'big'))
+    with db_table.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)", iter(rows))
+        assert cursor.rowcount == 2501
+
+        cursor.execute("SELECT count(*), max(f2) FROM t1")
+        assert cursor.fetchone() == [2501, 2 ** 40]
+
+
+def test_executemany_error(db_table):
+    db_table.commit()
+    with db_table.cursor() as cursor:
+        with pytest.raises(pg8000.IntegrityError):
+            cursor.executemany(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)",
+                [(i % 1500, i, None) for i in range(3000)])
+        db_table.rollback()
+
+        cursor.execute("SELECT count(*) FROM t1")
+        assert cursor.fetchone() == [0]
+
+
+def test_executemany_autocommit(con):
+    # In autocommit the executions are committed together, so if one fails
+    # none of them are committed
+    con.autocommit = True
+    with con.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE t2 (f1 int primary key)")
+        with pytest.raises(pg8000.IntegrityError):
+            cursor.executemany(
+                "INSERT INTO t2 VALUES (%s)", [(1,), (2,), (1,), (3,)])
+        cursor.execute("SELECT count(*) FROM t2")
+        assert cursor.fetchone() == [0]
+
+
+def test_executemany_rows(cursor):
+    # Only the rows of the last execution are left, as with execute()
+    cursor.executemany("SELECT %s", [(1,), (2,), (3,)])
+    assert cursor.fetchall() == ([3],)
+    cursor.executemany(
+        "SELECT * FROM generate_series(1, %s)", [(3,), (0,)])
+    assert cursor.fetchall() == ()
+
+
+def test_executemany_client_error(con):
+    # An error on the client means that none of the executions are committed
+    con.autocommit = True
+    with con.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE t2 (f1 int)")
+
+        def param_sets():
+            for i in range(5):
+                yield (i,)
+            raise ValueError("no more")
+
+        with pytest.raises(ValueError, match="no more"):
+            cursor.executemany("INSERT INTO t2 VALUES (%s)", param_sets())
+
+        # The server was made to fail before the Sync
+        assert con.error.args[0]['C'] == '34000'
+
+        with pytest.raises(pg8000.NotSupportedError):
+            cursor.executemany(
+                "INSERT INTO t2 VALUES (%s)", [(1,), (2,), (object(),)])
+        cursor.execute("SELECT count(*) FROM t2")
+        assert cursor.fetchone() == [0]
+
+        # If nothing has been executed the transaction isn't failed
+        con.autocommit = False
+        cursor.execute("INSERT INTO t2 VALUES (1)")
+        with pytest.raises(pg8000.NotSupportedError):
+            cursor.executemany("INSERT INTO t2 VALUES (%s)", [(object(),)])
+        cursor.execute("SELECT count(*) FROM t2")
+        assert cursor.fetchone() == [1]
+
+
+def test_executemany_large(db_kwargs):
+    # Large parameters and large results, more than the socket buffers can
+    # hold if they were all sent before any results were read
+    value = 'x' * 200000
+    with pg8000.connect(**dict(db_kwargs, timeout=30)) as con, \
+            con.cursor() as cursor:
+        cursor.executemany(
+            "SELECT %s || repeat('y', 200000)", [(value,)] * 100)
+        assert cursor.rowcount == 100
+
+
+def test_executemany_empty(db_table):
+    with db_table.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)", ())
+        assert cursor.rowcount == 0
+
+
 # Check that autocommit stays off
 # We keep track of whether we're in a transaction or not by using the
 # READY_FOR_QUERY message.
@@ -270,6 +415,345 @@ def test_deallocate_prepared_statements(db_table):
     with db_table.cursor() as cursor:
         cursor.execute("select * from t1")
         cursor.execute("alter table t1 drop column f3")
-        cursor.execute("select count(*) from pg_prepared_statements")
+
+        # The statement is prepared again, with the new result columns
+        cursor.execute("select * from t1")
+        assert len(cursor.description) == 2
+        cursor.execute(
+            "select count(*) from pg_prepared_statements "
+            "where statement = 'select * from t1'")
         res = cursor.fetchall()
         assert res[0][0] == 1
+
+
+def test_create_keeps_prepared_statements(con):
+    with con.cursor() as cursor:
+        cursor.execute("SELECT 1")
+        cursor.execute("CREATE TEMPORARY TABLE t2 (f1 int)")
+        hits = con.statement_cache_info().hits
+        cursor.execute("SELECT 1")
+        assert con.statement_cache_info().hits == hits + 1
+
+
+def test_result_type_changed(con, db_kwargs):
+    con.autocommit = True
+    with con.cursor() as cursor, pg8000.connect(**db_kwargs) as con2:
+        con2.autocommit = True
+        cursor.execute("CREATE TABLE t2 (f1 int)")
+        try:
+            cursor.execute("SELECT * FROM t2")
+            con2.run("ALTER TABLE t2 ADD COLUMN f2 int")
+
+            # Outside a transaction the statement is prepared again and the
+            # operation retried.
+            cursor.execute("SELECT * FROM t2")
+            assert len(cursor.description) == 2
+
+            # Within a transaction the error is raised, but the statement is
+            # prepared again the next time it's executed.
+            con2.run("ALTER TABLE t2 ADD COLUMN f3 int")
+            cursor.execute("BEGIN")
+            with pytest.raises(pg8000.ProgrammingError, match="0A000"):
+                cursor.execute("SELECT * FROM t2")
+            cursor.execute("ROLLBACK")
+            cursor.execute("SELECT * FROM t2")
+            assert len(cursor.description) == 3
+        finally:
+            cursor.execute("DROP TABLE t2")
+
+
+def test_statement_cache_lru(db_kwargs):
+    db_kwargs['max_prepared_statements'] = 3
+    with pg8000.connect(**db_kwargs) as con, con.cursor() as cursor:
+        con.autocommit = True
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 3", "SELECT 1"):
+            cursor.execute(sql)
+        assert con.statement_cache_info() == (1, 3, 0, 3, 3)
+
+        # The least recently used statement is the one evicted
+        cursor.execute("SELECT 4")
+        assert con.statement_cache_info() == (1, 4, 1, 3, 3)
+        cursor.execute("SELECT 1")
+        assert con.statement_cache_info().hits == 2
+
+        # The evicted statement is closed along with the next request
+        cursor.execute("SELECT statement FROM pg_prepared_statements")
+        assert sorted(r[0] for r in cursor.fetchall()) == [
+            "SELECT 1", "SELECT 3", "SELECT 4",
+            "SELECT statement FROM pg_prepared_statements"]
+
+
+def test_paramstyle_cache_shared(con, db_kwargs):
+    # The converted query is shared by the connections of the process
+    sql = "SELECT :v || 'paramstyle_cache_shared'"
+    with pg8000.connect(**db_kwargs) as con2:
+        misses = pg8000.paramstyle_cache_info().misses
+        assert con.run(sql, v='a') == (['aparamstyle_cache_shared'],)
+        assert con2.run(sql, v='b') == (['bparamstyle_cache_shared'],)
+        assert pg8000.paramstyle_cache_info().misses == misses + 1
+
+
+def test_statement_numbers_reused(db_kwargs):
+    db_kwargs['max_prepared_statements'] = 2
+    with pg8000.connect(**db_kwargs) as con, con.cursor() as cursor:
+        con.autocommit = True
+        for sql in ("SELECT 1", "SELECT 2", "SELECT 3", "SELECT 4"):
+            cursor.execute(sql)
+        cursor.execute("SELECT name FROM pg_prepared_statements")
+        nums = sorted(int(r[0].rsplit('_', 1)[1]) for r in cursor.fetchall())
+
+        # Evicted statements give up their numbers once they've been closed,
+        # so the number of the first statement has been used again
+        assert nums == [1, 3, 4]
+
+
+def test_execute_timeout(con):
+    with con.cursor() as cursor:
+        cursor.execute("SELECT 1", timeout=5)
+        with pytest.raises(pg8000.ProgrammingError, match='57014'):
+            cursor.execute("SELECT pg_sleep(10)", timeout=0.2)
+        con.rollback()
+
+        # The prepared statements survive the cancel
+        misses = con.statement_cache_info().misses
+        cursor.execute("SELECT 1")
+        assert cursor.fetchall() == ([1],)
+        assert con.statement_cache_info().misses == misses
+
+
+def test_fetch_size(con):
+    with con.cursor(fetch_size=10) as cursor:
+        cursor.execute("select * from generate_series(1, 95)")
+
+        # Only the first batch has been read from the server
+        assert len(cursor._cached_rows) == 10
+        assert cursor.rowcount == -1
+
+        assert cursor.fetchmany(15) == tuple([i] for i in range(1, 16))
+        assert len(cursor.fetchall()) == 80
+        assert cursor.rowcount == 95
+
+
+def test_fetch_size_parallel_cursors(con):
+    with con.cursor() as c1, con.cursor() as c2:
+        c1.fetch_size = c2.fetch_size = 3
+        c1.execute("select * from generate_series(1, 10)")
+        c2.execute("select * from generate_series(11, 20)")
+        rows = [r1 + r2 for r1, r2 in zip(c1, c2)]
+        assert rows == [[i, i + 10] for i in range(1, 11)]
+
+        # Executing again on the same cursor reuses the portal name
+        c1.execute("select * from generate_series(1, 5)")
+        assert len(c1.fetchall()) == 5
+
+
+def test_fetch_size_autocommit(con):
+    con.autocommit = True
+    with con.cursor(fetch_size=2) as cursor:
+        # Outside a transaction all the rows are read at once
+        cursor.execute("select * from generate_series(1, 5)")
+        assert len(cursor._cached_rows) == 5
+
+
+def test_fetch_size_transaction_ends(con):
+    # The server closes the portal at the end of the transaction, so only
+    # the rows already read are left
+    with con.cursor(fetch_size=2) as cursor:
+        cursor.execute("select * from generate_series(1, 5)")
+        assert cursor.fetchone() == [1]
+        con.commit()
+        assert cursor.fetchall() == ([2],)
+
+        cursor.execute("select * from generate_series(1, 5)")
+        con.rollback()
+        assert list(cursor) == [[1], [2]]
+
+        # The cursor can be used again
+        cursor.execute("select * from generate_series(1, 5)")
+        assert len(cursor.fetchall()) == 5
+
+
+def test_row_factory(con):
+    with con.cursor() as cursor:
+        assert cursor.row_factory is None
+        cursor.row_factory = pg8000.tuple_row
+        cursor.execute("SELECT 1 AS a, 'x' AS b")
+        assert cursor.fetchall() == ((1, 'x'),)
+
+        cursor.row_factory = pg8000.named_row
+        cursor.execute("SELECT 1 AS a, 'x' AS b, 2, 3 AS a")
+        row = cursor.fetchone()
+        assert row == (1, 'x', 2, 3)
+        assert (row.a, row.b) == (1, 'x')
+        assert type(row).__slots__ == ()
+
+        # The row class is made once for each result
+        cursor.execute("SELECT 1 AS a, 'x' AS b, 2, 3 AS a")
+        assert type(cursor.fetchone()) is type(row)
+
+        cursor.row_factory = pg8000.dict_row
+        cursor.execute("SELECT 1 AS a, 'x' AS b")
+        assert cursor.fetchone() == {'a': 1, 'b': 'x'}
+
+
+def test_row_factory_connection(con):
+    con.row_factory = pg8000.dict_row
+    with con.cursor() as cursor:
+        cursor.execute("SELECT 1 AS a")
+        assert cursor.fetchone() == {'a': 1}
+    assert con.run("SELECT 2 AS b") == ({'b': 2},)
+
+
+def test_fetch_columns(con):
+    with con.cursor() as cursor:
+        cursor.columnar = True
+        cursor.execute(
+            "SELECT i, i::float8, i %% 2 = 0, "
+            "timestamp '1970-01-01' + i * interval '1 second', i::text, "
+            "CASE WHEN i = 2 THEN NULL ELSE i::int8 END "
+            "FROM generate_series(1, 3) AS i")
+        ints, floats, bools, timestamps, texts, nullable = \
+            cursor.fetch_columns()
+        assert ints == (array('i', [1, 2, 3]), array('b', [0, 0, 0]))
+        assert floats[0] == array('d', [1, 2, 3])
+        assert bools[0] == array('b', [0, 1, 0])
+        assert timestamps[0] == array('q', [1000000, 2000000, 3000000])
+        assert texts == (['1', '2', '3'], array('b', [0, 0, 0]))
+        assert nullable == (array('q', [1, 0, 3]), array('b', [0, 1, 0]))
+        assert len(cursor.fetch_columns()[0][0]) == 0
+
+        cursor.columnar = False
+        with pytest.raises(pg8000.ProgrammingError):
+            cursor.fetch_columns()
+
+
+def test_fetch_columns_fetch_size(con):
+    with con.cursor(fetch_size=2) as cursor:
+        cursor.columnar = True
+        cursor.execute("SELECT * FROM generate_series(1, 5)")
+        assert cursor.fetch_columns() == [
+            (array('i', [1, 2, 3, 4, 5]), array('b', [0] * 5))]
+
+
+def test_fetch_columns_numpy(con):
+    numpy = pytest.importorskip("numpy")
+    with con.cursor() as cursor:
+        cursor.columnar = True
+        cursor.execute(
+            "SELECT i::int8, i = 2, "
+            "timestamp '1970-01-01' + i * interval '1 microsecond', "
+            "i::text FROM generate_series(1, 2) AS i")
+        (ints, nulls), (bools, _), (timestamps, _), (texts, _) = \
+            cursor.fetch_columns(numpy=True)
+        assert ints.dtype == numpy.int64
+        assert list(ints) == [1, 2]
+        assert list(nulls) == [False, False]
+        assert list(bools) == [False, True]
+        assert list(timestamps) == list(
+            numpy.array([1, 2], dtype='datetime64[us]'))
+        assert texts == ['1', '2']
+
+
+def test_pipeline(db_table):
+    with db_table.pipeline() as pipeline:
+        inserts = [
+            pipeline.execute(
+                "INSERT INTO t1 (f1, f2, f3) VALUES (%s, %s, %s)",
+                (i, i * 10, None)) for i in range(1, 6)]
+        c1 = pipeline.execute("SELECT f1, f2 FROM t1 WHERE f1 > %s", (3,))
+        c2 = pipeline.execute("SELECT count(*) FROM t1")
+
+    assert [c.rowcount for c in inserts] == [1] * 5
+    assert c1.fetchall() == ([4, 40], [5, 50])
+    assert c1.description[0][0] == b'f1'
+    assert c2.fetchone() == [5]
+
+
+def test_pipeline_error(con):
+    pipeline = con.pipeline()
+    c1 = pipeline.execute("SELECT 1")
+    pipeline.execute("SELECT 1 / 0")
+    c3 = pipeline.execute("SELECT 3")
+    with pytest.raises(pg8000.ProgrammingError) as e:
+        pipeline.sync()
+    assert e.value.args[0]['C'] == '22012'
+
+    # The statements after the error aren't executed
+    assert c1.fetchall() == ([1],)
+    assert c3.fetchall() == ()
+    con.rollback()
+
+    # The connection can still be used
+    with con.cursor() as cursor:
+        cursor.execute("SELECT 4")
+        assert cursor.fetchall() == ([4],)
+
+
+def test_pipeline_parse_error(con):
+    pipeline = con.pipeline()
+    c1 = pipeline.execute("SELECT 1")
+    pipeline.execute("SELECT * FROM t99")
+    with pytest.raises(pg8000.ProgrammingError) as e:
+        pipeline.sync()
+    assert e.value.args[0]['C'] == '42P01'
+
+    # All the statements are prepared before any are executed
+    assert c1.ps is None
+    con.rollback()
+
+
+def test_pipeline_sync_each(con):
+    con.autocommit = True
+    pipeline = con.pipeline(sync_each=True)
+    pipeline.execute("SELECT 1")
+    pipeline.execute("SELECT 1 / 0")
+    c3 = pipeline.execute("SELECT 3")
+    with pytest.raises(pg8000.ProgrammingError) as e:
+        pipeline.sync()
+    assert e.value.args[0]['C'] == '22012'
+
+    # With a Sync after each statement, the following statements are executed
+    assert c3.fetchall() == ([3],)
+
+
+def test_one_send_per_request(con):
+    sent = []
+
+    class Sock():
+        def __init__(self, sock):
+            self.sock = sock
+
+        def sendall(self, data):
+            sent.append(bytes(data))
+            self.sock.sendall(data)
+
+        def __getattr__(self, name):
+            return getattr(self.sock, name)
+
+    con.autocommit = True
+    with con.cursor() as cursor:
+        cursor.execute("SELECT %s", (1,))
+        con._usock = Sock(con._usock)
+        cursor.execute("SELECT %s", (2,))
+        assert cursor.fetchall() == ([2],)
+
+    # A cached statement is bound and executed with a single send, and
+    # without any Flush messages since the Sync makes the server answer.
+    assert len(sent) == 1
+    assert sent[0][0:1] == b'B' and sent[0][-5:] == b'S\x00\x00\x00\x04'
+    assert b'H\x00\x00\x00\x04' not in sent[0]
+
+
+def test_messages_across_buffer(con):
+    with con.cursor() as cursor:
+        # Messages bigger than the receive buffer, and rows that straddle
+        # the end of it
+        cursor.execute(
+            "SELECT repeat('x', n), decode(repeat('ab', n), 'hex') "
+            "FROM generate_series(100000, 100500, 100) AS n")
+        for n, (text, data) in zip(range(100000, 100501, 100), cursor):
+            assert text == 'x' * n
+            assert type(data) is bytes and data == b'\xab' * n
+
+        cursor.execute("SELECT generate_series(1, 50000)")
+        assert [r[0] for r in cursor.fetchall()] == list(range(1, 50001))
@@ -12,7 +12,7 @@ import json
 import pytz
 from collections import OrderedDict
 import pytest
-from enum import Enum
+from enum import Enum, IntEnum
 import ipaddress
 
 
@@ -24,6 +24,27 @@ def testTimeRoundtrip(cursor):
     assert retval[0][0] == Time(4, 5, 6)
 
 
+def test_time_microseconds_roundtrip(cursor):
+    v = Time(23, 59, 59, 999999)
+    cursor.execute("SELECT %s as f1, '00:00:00.000001'::time", (v,))
+    retval = cursor.fetchall()
+    assert retval[0] == [v, Time(0, 0, 0, 1)]
+
+
+def test_timetz_out(cursor):
+    cursor.execute(
+        "SELECT '04:05:06.789-08'::timetz, '04:05:06+05:30'::timetz")
+    retval = cursor.fetchall()
+    assert retval[0] == [
+        Time(4, 5, 6, 789000, Timezone(Timedelta(hours=-8))),
+        Time(4, 5, 6, 0, Timezone(Timedelta(hours=5, minutes=30)))]
+
+
+def test_time_send_float():
+    assert pg8000.core.time_send_float(Time(4, 5, 6, 500000)) == \
+        pg8000.core.d_pack(14706.5)
+
+
 def test_date_roundtrip(cursor):
     v = Date(2001, 2, 3)
     cursor.execute("SELECT %s as f1", (v,))
@@ -31,6 +52,28 @@ def test_date_roundtrip(cursor):
     assert retval[0][0] == v
 
 
+def test_date_limits_roundtrip(cursor):
+    for v in (Date.min, Date.max, Date(1999, 12, 31), Date(2000, 1, 1)):
+        retval = tuple(cursor.execute("SELECT %s, %s::text", (v, v)))
+        assert retval[0] == [v, v.isoformat()]
+
+
+def test_infinity_date_out(cursor):
+    retval = tuple(
+        cursor.execute("SELECT 'infinity'::date, '-infinity'::date"))
+    assert retval[0] == ['infinity', '-infinity']
+
+
+def test_date_out_of_range(cursor):
+    # Dates that Python can't represent are returned as the server's text
+    for v in (
+            '10000-01-01', '10400-02-29', '5874897-12-31', '0001-12-31 BC',
+            '0044-03-15 BC', '0401-02-29 BC', '4713-11-24 BC'):
+        retval = tuple(
+            cursor.execute("SELECT %s::date, %s::date::text", (v, v)))
+        assert retval[0] == [v, v]
+
+
 def test_bool_roundtrip(cursor):
     cursor.execute("SELECT %s as f1", (True,))
     retval = cursor.fetchall()
@@ -74,6 +117,27 @@ def test_decimal_roundtrip(cursor):
         assert str(retval[0][0]) == v
 
 
+def test_decimal_roundtrip_binary(cursor):
+    values = (
+        "0", "0.00", "-0.5", "1E+5", "0.00001", "1E-20", "9999.9999",
+        "100000000", "12345678901234567890123456789.0123456789")
+    for v in values:
+        cursor.execute("SELECT %s, %s::text", (decimal.Decimal(v),) * 2)
+        retval = cursor.fetchone()
+        assert str(retval[0]) == str(decimal.Decimal(retval[1]))
+
+
+def test_decimal_special_roundtrip(cursor):
+    cursor.execute(
+        "SELECT %s, %s, %s", (
+            decimal.Decimal('NaN'), decimal.Decimal('Infinity'),
+            decimal.Decimal('-Infinity')))
+    nan, inf, ninf = cursor.fetchone()
+    assert nan.is_nan()
+    assert inf == decimal.Decimal('Infinity')
+    assert ninf == decimal.Decimal('-Infinity')
+
+
 def test_float_roundtrip(cursor):
     # This test ensures that the binary float value doesn't change in a
     # roundtrip to the server.  That could happen if the value was
@@ -283,6 +347,33 @@ def test_enum_py_round_trip(cursor):
         cursor.execute("drop type lepton")
 
 
+def test_subclass_params(cursor):
+    # A value of a subclass of a mapped type is sent as that type
+    class Level(IntEnum):
+        low = 1
+        high = 2
+
+    class Name(str):
+        pass
+
+    class Amount(decimal.Decimal):
+        pass
+
+    class Row(list):
+        pass
+
+    for i in range(2):
+        cursor.execute(
+            "SELECT cast(%s as int), %s, %s, %s",
+            (Level.high, Name('muon'), Amount('1.5'), Row([1, 2])))
+        assert cursor.fetchall() == (
+            [2, 'muon', decimal.Decimal('1.5'), [1, 2]],)
+
+    for i in range(2):
+        with pytest.raises(pg8000.NotSupportedError, match="not mapped"):
+            cursor.execute("SELECT %s", (object(),))
+
+
 def test_xml_roundtrip(cursor):
     v = '<genome>gatccgagtac</genome>'
     retval = tuple(cursor.execute("select xmlparse(content %s) as f1", (v,)))
@@ -402,7 +493,7 @@ def test_boolean_out(cursor):
 
 
 def test_numeric_out(cursor):
-    for num in ('5000', '50.34'):
+    for num in ('5000', '50.34', '-0.0010', '1000000', '0.00'):
         retval = tuple(cursor.execute("SELECT " + num + "::numeric"))
         assert str(retval[0][0]) == num
 
@@ -619,6 +710,38 @@ def test_numeric_array_out(cursor):
         decimal.Decimal("1.1"), decimal.Decimal("2.2"), decimal.Decimal("3.3")]
 
 
+def test_numeric_array_multidimensional_out(cursor):
+    cursor.execute("SELECT '{{1.10,NaN},{NULL,-5E+5}}'::numeric[] AS f1")
+    retval = cursor.fetchone()[0]
+    assert str(retval[0][0]) == '1.10'
+    assert retval[0][1].is_nan()
+    assert retval[1] == [None, decimal.Decimal('-500000')]
+
+
+def test_text_arrays_out(cursor):
+    cursor.execute(
+        "SELECT '{1,NULL,4294967295}'::oid[], "
+        "'{\"{\\\"a\\\": [1, null]}\",null,\"\\\"x\\\"\"}'::json[], "
+        "'{192.168.0.1,10.0.0.0/8}'::inet[], '[0:1]={5,6}'::xid[]")
+    assert cursor.fetchone() == [
+        [1, None, 4294967295],
+        [{'a': [1, None]}, None, 'x'],
+        [
+            ipaddress.IPv4Address('192.168.0.1'),
+            ipaddress.IPv4Network('10.0.0.0/8')],
+        [5, 6]]
+
+
+def test_parse_array():
+    parse_array = pg8000.core.parse_array
+    assert parse_array('{}', int) == []
+    assert parse_array('{{1,2},{3,NULL}}', int) == [[1, 2], [3, None]]
+    assert parse_array(
+        '{"",NULL,"NULL","a,b","\\"{}\\\\",x y}', str) == [
+            '', None, 'NULL', 'a,b', '"{}\\', 'x y']
+    assert parse_array('[2:3][1:1]={{1},{2}}', int) == [[1], [2]]
+
+
 def test_numeric_array_roundtrip(cursor):
     v = [decimal.Decimal("1.1"), None, decimal.Decimal("3.3")]
     retval = tuple(cursor.execute("SELECT %s as f1", (v,)))